@@ -0,0 +1,303 @@
+"""
+LLM Admission Control
+Bounds how much LLM work the server takes on at once. Each LLM backend has a
+fixed number of slots; callers beyond that wait in a priority queue where
+paid plans (by SUBSCRIPTION_PLANS price) are served before free users, and
+each user may only hold a few slots or queue positions at a time. When the
+queue is full, a user is over their cap, or a request has waited too long, it
+is rejected at once with 429 and a Retry-After estimate instead of piling up
+behind long LLM calls. The LLM router's hedged duplicates also need a slot,
+taken only if one is free right away.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+
+try:
+    from .auth_mongo import optional_user
+    from .local_llm import llm_router, primary_backend
+    from .metrics import LLM_ADMISSIONS, LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_TIME
+    from .payment_razorpay import SUBSCRIPTION_PLANS
+    from .usage_tracker import get_user_plan
+except ImportError:
+    from auth_mongo import optional_user
+    from local_llm import llm_router, primary_backend
+    from metrics import LLM_ADMISSIONS, LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_TIME
+    from payment_razorpay import SUBSCRIPTION_PLANS
+    from usage_tracker import get_user_plan
+
+# Concurrent LLM calls per backend: Gemini is remote and parallel, a local Ollama model is not
+LLM_CONCURRENCY = {
+    "gemini": int(os.getenv("LLM_CONCURRENCY_GEMINI", "8")),
+    "ollama": int(os.getenv("LLM_CONCURRENCY_OLLAMA", "2")),
+}
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", "20"))
+# Starting guess for a call's duration, until real calls have been timed
+LLM_EXPECTED_SERVICE_TIME = float(os.getenv("LLM_EXPECTED_SERVICE_TIME", "8"))
+_SERVICE_TIME_ALPHA = 0.2
+# Peers whose X-Forwarded-For is believed (comma-separated addresses, "*" for any),
+# so anonymous callers behind a reverse proxy aren't all keyed by the proxy's address
+TRUSTED_PROXIES = {
+    address.strip()
+    for address in os.getenv("TRUSTED_PROXIES", os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")).split(",")
+    if address.strip()
+}
+# How long a router thread waits for the event loop to answer a spare-slot claim
+_SPARE_CLAIM_TIMEOUT = 1.0
+
+# Lower sorts first: pricier plans ahead of cheaper ones, free (and anonymous) last
+PLAN_PRIORITY = {plan: -details["amount"] for plan, details in SUBSCRIPTION_PLANS.items()}
+PLAN_PRIORITY["free"] = 0
+
+
+class _BackendSlots:
+    """Slot counter and priority wait queue for one LLM backend"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        self.queued = 0
+        self.service_time = LLM_EXPECTED_SERVICE_TIME
+        self._waiters: List = []
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        return max(1, math.ceil(self.service_time * (self.queued + 1) / self.limit))
+
+    def observe(self, seconds: float):
+        self.service_time += _SERVICE_TIME_ALPHA * (seconds - self.service_time)
+
+    def push(self, priority: int, seq: int, waiter: asyncio.Future):
+        heapq.heappush(self._waiters, (priority, seq, waiter))
+        self.queued += 1
+
+    def release(self):
+        """Hand the slot to the best live waiter, or free it"""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                self.queued -= 1
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """Per-backend slots with per-user caps and plan-priority queueing"""
+
+    def __init__(
+        self,
+        limits: Dict[str, int] = LLM_CONCURRENCY,
+        max_per_user: int = LLM_MAX_PER_USER,
+        max_queue: int = LLM_MAX_QUEUE,
+        max_wait: float = LLM_MAX_QUEUE_WAIT,
+    ):
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._backends = {name: _BackendSlots(name, limit) for name, limit in limits.items()}
+        self._per_user: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _slots(self, backend: str) -> _BackendSlots:
+        if backend not in self._backends:
+            self._backends[backend] = _BackendSlots(backend, min(LLM_CONCURRENCY.values()))
+        return self._backends[backend]
+
+    def _leave(self, client_key: str):
+        remaining = self._per_user.get(client_key, 1) - 1
+        if remaining > 0:
+            self._per_user[client_key] = remaining
+        else:
+            self._per_user.pop(client_key, None)
+
+    def _reject(self, slots: _BackendSlots, outcome: str, detail: str):
+        LLM_ADMISSIONS.inc(backend=slots.name, outcome=outcome)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(slots.retry_after())},
+        )
+
+    async def acquire(self, client_key: str, plan: str, backend: str):
+        """Wait for a slot on backend, or raise 429"""
+        self._loop = asyncio.get_running_loop()
+        slots = self._slots(backend)
+        if self._per_user.get(client_key, 0) >= self.max_per_user:
+            self._reject(slots, "rejected_user", "Too many analyses in progress. Please wait for one to finish.")
+        if slots.active < slots.limit and slots.queued == 0:
+            slots.active += 1
+        else:
+            if slots.queued >= self.max_queue:
+                self._reject(slots, "rejected_queue", "The server is busy. Please try again shortly.")
+            self._per_user[client_key] = self._per_user.get(client_key, 0) + 1
+            waiter = asyncio.get_running_loop().create_future()
+            slots.push(PLAN_PRIORITY.get(plan, 0), next(self._seq), waiter)
+            LLM_QUEUE_DEPTH.set(slots.queued, backend=slots.name)
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+            except BaseException as e:
+                self._leave(client_key)
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just as we gave up: pass the slot on
+                    slots.release()
+                else:
+                    waiter.cancel()
+                    slots.queued -= 1
+                LLM_QUEUE_DEPTH.set(slots.queued, backend=slots.name)
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject(slots, "timed_out", "The server is busy. Please try again shortly.")
+                raise
+            self._leave(client_key)
+            LLM_QUEUE_DEPTH.set(slots.queued, backend=slots.name)
+            LLM_QUEUE_TIME.observe(time.perf_counter() - start, backend=slots.name, plan=plan)
+        self._per_user[client_key] = self._per_user.get(client_key, 0) + 1
+        LLM_ADMISSIONS.inc(backend=slots.name, outcome="admitted")
+        LLM_IN_FLIGHT.set(slots.active, backend=slots.name)
+
+    def release(self, client_key: str, backend: str, service_time: Optional[float] = None):
+        slots = self._slots(backend)
+        if service_time is not None:
+            slots.observe(service_time)
+        slots.release()
+        self._leave(client_key)
+        LLM_IN_FLIGHT.set(slots.active, backend=slots.name)
+        LLM_QUEUE_DEPTH.set(slots.queued, backend=slots.name)
+
+    def _take_spare(self, backend: str) -> bool:
+        slots = self._slots(backend)
+        if slots.active >= slots.limit or slots.queued:
+            return False
+        slots.active += 1
+        LLM_IN_FLIGHT.set(slots.active, backend=slots.name)
+        return True
+
+    def _release_spare(self, backend: str):
+        slots = self._slots(backend)
+        slots.release()
+        LLM_IN_FLIGHT.set(slots.active, backend=slots.name)
+        LLM_QUEUE_DEPTH.set(slots.queued, backend=slots.name)
+
+    def _on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def try_acquire_spare(self, backend: str) -> bool:
+        """
+        Take a free slot on backend without queueing (for hedged requests).
+        Safe to call from worker threads: slot state is only touched on the
+        event loop.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        if self._on_loop_thread():
+            return self._take_spare(backend)
+
+        claim: Future = Future()
+
+        def take():
+            if claim.set_running_or_notify_cancel():
+                claim.set_result(self._take_spare(backend))
+
+        loop.call_soon_threadsafe(take)
+        try:
+            return claim.result(timeout=_SPARE_CLAIM_TIMEOUT)
+        except FutureTimeoutError:
+            # Loop too busy to answer: give up, unless the claim started running meanwhile
+            return False if claim.cancel() else claim.result()
+
+    def release_spare(self, backend: str):
+        """Return a slot taken by try_acquire_spare (from any thread)"""
+        if self._on_loop_thread():
+            self._release_spare(backend)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._release_spare, backend)
+
+    def stats(self) -> Dict:
+        return {
+            name: {
+                "active": slots.active,
+                "limit": slots.limit,
+                "queued": slots.queued,
+                "service_time": round(slots.service_time, 3),
+            }
+            for name, slots in self._backends.items()
+        }
+
+
+llm_admission = AdmissionController()
+# Hedged duplicates take spare slots too, so they can't push a backend past its limit
+llm_router.hedge_admit = llm_admission.try_acquire_spare
+llm_router.hedge_release = llm_admission.release_spare
+
+
+class AdmissionTicket:
+    """
+    One caller's claim on an LLM slot; use as `async with ticket:` around
+    the LLM work so the slot is only held while the call runs.
+    """
+
+    def __init__(self, client_key: str, plan: str, controller: AdmissionController = llm_admission):
+        self.client_key = client_key
+        self.plan = plan
+        self.controller = controller
+        self._backend: Optional[str] = None
+        self._start = 0.0
+
+    async def __aenter__(self):
+        backend = primary_backend()
+        await self.controller.acquire(self.client_key, self.plan, backend)
+        self._backend = backend
+        self._start = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._backend is not None:
+            self.controller.release(self.client_key, self._backend, time.perf_counter() - self._start)
+            self._backend = None
+        return False
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    return "*" in TRUSTED_PROXIES or address in TRUSTED_PROXIES
+
+
+def client_address(request: Request) -> str:
+    """
+    Caller's address. Behind trusted proxies it is the rightmost
+    X-Forwarded-For hop that isn't one of them: each proxy appends the
+    address it received from, while anything to the left of that was sent
+    by the client and can be forged.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    # "*" trusts every hop: the nearest one is the only address a proxy vouched for
+    return hops[-1] if hops else peer
+
+
+async def llm_admission_ticket(request: Request, user: Optional[Dict] = Depends(optional_user)) -> AdmissionTicket:
+    """Dependency: a ticket keyed by user (or client address for anonymous callers)"""
+    if user:
+        return AdmissionTicket(f"user:{user['_id']}", get_user_plan(user))
+    return AdmissionTicket(f"ip:{client_address(request)}", "free")
@@ -1,26 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
 from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorClient
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr
 import os
 import random
 import string
-import smtplib
-from email.mime.text import MIMEText
+import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
 try:
-    from .mongodb_config import get_users_collection, get_otps_collection, get_user_sessions_collection
-    from .tracing import TraceEvents, log_auth_event
+    from .mongodb_config import get_users_collection, get_otps_collection
+    from .tracing import TraceEvents, log_auth_event, trace_function
+    from .user_cache import user_cache
+    from .password_hasher import PasswordHasherBusy, password_hasher, pwd_context
+    from .email_dispatcher import SMTPConfig, email_dispatcher
+    from .session_store import session_store
+    from .token_validator import TokenValidator, denylist
 except ImportError:
-    from mongodb_config import get_users_collection, get_otps_collection, get_user_sessions_collection
-    from tracing import TraceEvents, log_auth_event
+    from mongodb_config import get_users_collection, get_otps_collection
+    from tracing import TraceEvents, log_auth_event, trace_function
+    from user_cache import user_cache
+    from password_hasher import PasswordHasherBusy, password_hasher, pwd_context
+    from email_dispatcher import SMTPConfig, email_dispatcher
+    from session_store import session_store
+    from token_validator import TokenValidator, denylist
 
 from dotenv import load_dotenv
 from bson import ObjectId
@@ -29,23 +37,26 @@ from pymongo.errors import DuplicateKeyError
 # Load environment variables
 load_dotenv()
 
-# Password hashing context - using bcrypt for compatibility
-pwd_context = CryptContext(schemes=["bcrypt", "pbkdf2_sha256"], deprecated="auto")
-
 # JWT Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", os.getenv("SECRET_KEY", "your-secret-key-here"))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_MINUTES = 10080  # 7 days
+token_validator = TokenValidator(SECRET_KEY, ALGORITHM, denylist)
 
 # Email Configuration
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
+OTP_SMTP_CONFIG = SMTPConfig(
+    SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS,
+    starttls=os.getenv("SMTP_STARTTLS", "true").lower() != "false"
+)
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Pydantic Models
 class UserRegister(BaseModel):
@@ -84,6 +95,27 @@ def get_password_hash(password):
     """Generate password hash"""
     return pwd_context.hash(password)
 
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please try again shortly",
+        headers={"Retry-After": "1"}
+    )
+
+async def hash_password(password: str) -> str:
+    """Hash a password off the event loop"""
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+async def check_password(plain_password: str, hashed_password: str):
+    """Verify a password off the event loop; returns (valid, new_hash_or_None)"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
 def generate_otp(length=6):
     """Generate a random OTP"""
     return ''.join(random.choices(string.digits, k=length))
@@ -95,7 +127,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -103,14 +135,18 @@ def create_refresh_token(data: dict):
     """Create JWT refresh token"""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.update({"exp": expire, "type": "refresh", "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str, token_type: str = "access"):
     """Verify JWT token"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Cached claims + in-memory denylist: no DB round trip
+        payload = token_validator.decode(token)
+        if payload is None:
+            logger.info("Rejected revoked token")
+            return None
         if token_type == "refresh" and payload.get("type") != "refresh":
             logger.warning("Token type mismatch: expected refresh token")
             return None
@@ -120,17 +156,19 @@ def verify_token(token: str, token_type: str = "access"):
         return None
 
 # Database Functions
+@trace_function(name="mongo.get_user_by_email")
 async def get_user_by_email(email: str):
     """Get user by email"""
     users_collection = get_users_collection()
     return await users_collection.find_one({"email": email})
 
+@trace_function(name="mongo.create_user")
 async def create_user(email: str, password: str, full_name: str):
     """Create a new user"""
     users_collection = get_users_collection()
     user_doc = {
         "email": email,
-        "password_hash": get_password_hash(password),
+        "password_hash": await hash_password(password),
         "full_name": full_name,
         "is_verified": False,
         "is_active": True,
@@ -143,8 +181,10 @@ async def create_user(email: str, password: str, full_name: str):
         }
     }
     result = await users_collection.insert_one(user_doc)
+    user_cache.invalidate(email=email)
     return str(result.inserted_id)
 
+@trace_function(name="mongo.store_otp")
 async def store_otp(email: str, otp: str, otp_type: str):
     """Store OTP in database"""
     otps_collection = get_otps_collection()
@@ -157,6 +197,7 @@ async def store_otp(email: str, otp: str, otp_type: str):
     }
     await otps_collection.insert_one(otp_doc)
 
+@trace_function(name="mongo.verify_otp")
 async def verify_otp(email: str, otp: str, otp_type: str):
     """Verify OTP"""
     otps_collection = get_otps_collection()
@@ -172,6 +213,7 @@ async def verify_otp(email: str, otp: str, otp_type: str):
         return True
     return False
 
+@trace_function(name="mongo.update_user_verification")
 async def update_user_verification(email: str):
     """Update user verification status"""
     users_collection = get_users_collection()
@@ -179,23 +221,38 @@ async def update_user_verification(email: str):
         {"email": email},
         {"$set": {"is_verified": True, "updated_at": datetime.utcnow()}}
     )
+    user_cache.invalidate(email=email)
 
+@trace_function(name="mongo.update_user_password")
 async def update_user_password(email: str, new_password: str):
     """Update user password"""
+    password_hash = await hash_password(new_password)
     users_collection = get_users_collection()
     await users_collection.update_one(
         {"email": email},
-        {"$set": {"password_hash": get_password_hash(new_password), "updated_at": datetime.utcnow()}}
+        {"$set": {"password_hash": password_hash, "updated_at": datetime.utcnow()}}
     )
+    user_cache.invalidate(email=email)
+
+@trace_function(name="mongo.rehash_user_password")
+async def rehash_user_password(user_id: ObjectId, password_hash: str):
+    """Replace a hash made with an outdated cost or scheme"""
+    users_collection = get_users_collection()
+    await users_collection.update_one(
+        {"_id": user_id},
+        {"$set": {"password_hash": password_hash}}
+    )
+    user_cache.invalidate(user_id=str(user_id))
 
 async def invalidate_user_sessions(user_id: str):
-    """Invalidate all user sessions"""
-    sessions_collection = get_user_sessions_collection()
-    await sessions_collection.delete_many({"user_id": user_id})
+    """Invalidate all user sessions and revoke the tokens issued for them"""
+    sessions = await session_store.invalidate_user(user_id)
+    await denylist.revoke((session["_id"], session["expires_at"]) for session in sessions)
+    return len(sessions)
 
 # Email Functions
 def send_otp_email(email: str, otp: str, purpose: str):
-    """Send OTP email"""
+    """Queue OTP email for background delivery"""
     if not SMTP_USER or not SMTP_PASS:
         # For development, return the OTP
         return {"sent": False, "otp": otp}
@@ -203,20 +260,9 @@ def send_otp_email(email: str, otp: str, purpose: str):
     subject = f"SPECTER Legal - {purpose.replace('_', ' ').title()}"
     body = f"Your OTP code is: {otp}\n\nThis code will expire in 10 minutes."
     
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = SMTP_USER
-    msg['To'] = email
-    
-    try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(SMTP_USER, email, msg.as_string())
+    if email_dispatcher.enqueue(OTP_SMTP_CONFIG, email, subject, body):
         return {"sent": True}
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return {"sent": False, "otp": otp}
+    return {"sent": False, "otp": otp}
 
 # Dependencies
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -236,7 +282,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = await get_user_by_email(email)
+    # Short-TTL cache: this is the most frequent DB read we make
+    hit, user = user_cache.get(email)
+    if not hit:
+        user = await get_user_by_email(email)
+        user_cache.put(email, user)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -245,6 +295,36 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     return user
 
+_UNRESOLVED = object()
+
+async def get_request_user(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[dict]:
+    """
+    Resolve the bearer token's user once per request and keep it in
+    request.state.user. Returns None when no token was sent; a bad token is
+    still a 401.
+    """
+    user = getattr(request.state, "user", _UNRESOLVED)
+    if user is _UNRESOLVED:
+        user = await get_current_user(credentials) if credentials else None
+        request.state.user = user
+    return user
+
+async def require_user(user: Optional[dict] = Depends(get_request_user)) -> dict:
+    """Dependency for routes that need a logged-in user"""
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+# Optional auth: the user dict, or None for anonymous requests
+optional_user = get_request_user
+
 # Router
 auth_router = APIRouter()
 
@@ -282,6 +362,8 @@ async def register(user_data: UserRegister):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Registration error: {str(e)}")
         raise HTTPException(
@@ -306,7 +388,11 @@ async def login(user_data: UserLogin):
     """User login"""
     user = await get_user_by_email(user_data.email)
     
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await check_password(user_data.password, user["password_hash"])
+    
+    if not valid:
         await log_auth_event(TraceEvents.AUTH_LOGIN, user_data.email, False, {"reason": "invalid_credentials"})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -320,9 +406,14 @@ async def login(user_data: UserLogin):
             detail="Please verify your email first"
         )
     
-    # Generate tokens
-    access_token = create_access_token(data={"sub": user["email"]})
-    refresh_token = create_refresh_token(data={"sub": user["email"]})
+    # Transparently upgrade hashes made with an old cost factor
+    if new_hash:
+        await rehash_user_password(user["_id"], new_hash)
+    
+    # Generate tokens bound to a new session
+    session_id = await session_store.create(str(user["_id"]), timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES))
+    access_token = create_access_token(data={"sub": user["email"], "sid": session_id})
+    refresh_token = create_refresh_token(data={"sub": user["email"], "sid": session_id})
     
     # Log successful login
     await log_auth_event(TraceEvents.AUTH_LOGIN, user_data.email, True, {
@@ -362,12 +453,25 @@ async def refresh_token(refresh_token: str):
             detail="User not found"
         )
     
+    # Refresh tokens of logged-out or reset sessions are no longer honoured
+    session_ttl = timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    session_id = payload.get("sid")
+    if session_id:
+        if not await session_store.refresh(session_id, session_ttl):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Session expired, please log in again"
+            )
+    else:
+        # Token issued before sessions were tracked
+        session_id = await session_store.create(str(user["_id"]), session_ttl)
+    
     # Create new tokens
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     new_access_token = create_access_token(
-        data={"sub": user["email"]}, expires_delta=access_token_expires
+        data={"sub": user["email"], "sid": session_id}, expires_delta=access_token_expires
     )
-    new_refresh_token = create_refresh_token(data={"sub": user["email"]})
+    new_refresh_token = create_refresh_token(data={"sub": user["email"], "sid": session_id})
     
     return Token(
         access_token=new_access_token,
@@ -455,6 +559,7 @@ async def update_profile(
         {"_id": current_user["_id"]},
         {"$set": {"full_name": full_name, "updated_at": datetime.utcnow()}}
     )
+    user_cache.invalidate(email=current_user["email"])
     return {"message": "Profile updated successfully"}
 
 # Development helper endpoint
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+SPECTER LLM Router Benchmark
+Starts local fake Ollama servers (a fast-but-spiky one and a steady one),
+routes a batch of requests through LLMRouter with and without hedging, and
+reports latency percentiles and which backend answered. Needs no model or
+API key, so it doubles as a smoke test for the router.
+
+Usage:
+    python bench_llm_router.py --requests 100 --spike-rate 0.04
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+def start_fake_ollama(name: str, latency: float, spike_latency: float, spike_rate: float, error_rate: float):
+    """Serve /api/chat like Ollama, with the given latency profile; returns (server, base_url)"""
+
+    class FakeOllama(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(spike_latency if random.random() < spike_rate else latency)
+            if random.random() < error_rate:
+                self.send_response(500)
+                self.end_headers()
+                return
+            payload = json.dumps({
+                "model": body.get("model"),
+                "message": {"role": "assistant", "content": f"answer from {name}"},
+                "done": True,
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(pct * (len(ordered) - 1))]
+
+
+def run_benchmark(requests: int, spike_rate: float, error_rate: float) -> dict:
+    from llm_router import LLMRouter, LLMTarget
+    from local_llm import chat_with_ollama
+
+    fast, fast_url = start_fake_ollama("fast", 0.05, 1.5, spike_rate, error_rate)
+    steady, steady_url = start_fake_ollama("steady", 0.25, 0.25, 0.0, 0.0)
+
+    def target(backend: str, url: str, prior: float) -> LLMTarget:
+        return LLMTarget(
+            backend,
+            "fake",
+            lambda messages, temperature: chat_with_ollama(messages, model="fake", temperature=temperature, base_url=url),
+            prior_latency=prior,
+        )
+
+    messages = [{"role": "user", "content": "What is Article 21?"}]
+    results = {}
+    try:
+        for hedging in (False, True):
+            router = LLMRouter(
+                [target("fast", fast_url, 0.1), target("steady", steady_url, 0.3)], hedging=hedging, reprobe_interval=2.0
+            )
+            latencies, winners = [], {}
+            for _ in range(requests):
+                start = time.perf_counter()
+                answer = router.generate(messages)
+                latencies.append(time.perf_counter() - start)
+                winners[answer] = winners.get(answer, 0) + 1
+            results["hedged" if hedging else "unhedged"] = {
+                "p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+                "winners": winners,
+                "targets": router.stats(),
+            }
+    finally:
+        fast.shutdown()
+        steady.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LLM router against fake Ollama servers")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per run")
+    parser.add_argument("--spike-rate", type=float, default=0.04, help="Share of slow responses from the fast server")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 500s from the fast server")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("LLM ROUTER BENCHMARK (fake Ollama)")
+    print("=" * 80)
+    for mode, row in run_benchmark(args.requests, args.spike_rate, args.error_rate).items():
+        print(f"\n{mode}: p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, p99 {row['p99_ms']} ms")
+        print(f"  answered by: {row['winners']}")
+        for name, stats in row["targets"].items():
+            print(f"  {name}: {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
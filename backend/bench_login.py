@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+SPECTER Login Throughput Benchmark
+Fires a burst of concurrent password verifications (the CPU-bound part of
+/auth/login) and reports logins/second plus how long the event loop stalled,
+comparing inline bcrypt against the bounded hashing pool.
+
+Usage:
+    python bench_login.py --logins 200 --concurrency 50 --rounds 12
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+async def _loop_lag_probe(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Worst observed delay of a periodic timer, i.e. how long the loop was blocked"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def _run_burst(verify, logins: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_login():
+        async with semaphore:
+            await verify()
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_loop_lag_probe(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(one_login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await probe
+    return {
+        "seconds": round(elapsed, 3),
+        "logins_per_second": round(logins / elapsed, 1),
+        "max_loop_stall_ms": round(worst_lag * 1000, 1),
+    }
+
+
+async def run_benchmark(logins: int, concurrency: int) -> dict:
+    from password_hasher import password_hasher, pwd_context
+
+    password = "correct horse battery staple"
+    hashed = pwd_context.hash(password)
+
+    async def inline_verify():
+        # What the login handler used to do: bcrypt on the event loop thread
+        pwd_context.verify(password, hashed)
+
+    async def pooled_verify():
+        await password_hasher.verify(password, hashed)
+
+    return {
+        "inline": await _run_burst(inline_verify, logins, concurrency),
+        "pooled": await _run_burst(pooled_verify, logins, concurrency),
+        "hasher": password_hasher.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login password verification")
+    parser.add_argument("--logins", type=int, default=100, help="Total logins in the burst")
+    parser.add_argument("--concurrency", type=int, default=32, help="Logins in flight at once")
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt cost (overrides BCRYPT_ROUNDS)")
+    args = parser.parse_args()
+
+    if args.rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+
+    print("=" * 80)
+    print("LOGIN THROUGHPUT BENCHMARK")
+    print("=" * 80)
+    results = asyncio.run(run_benchmark(args.logins, args.concurrency))
+    print(f"bcrypt rounds: {results['hasher']['bcrypt_rounds']}, pool workers: {results['hasher']['workers']}")
+    for mode in ("inline", "pooled"):
+        r = results[mode]
+        print(f"{mode:>7}: {r['logins_per_second']:>8} logins/s  "
+              f"{r['seconds']:>7}s total  max event loop stall {r['max_loop_stall_ms']} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
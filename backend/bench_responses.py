@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+SPECTER Response Payload Benchmark
+Serializes representative large responses (an uploaded document's extracted
+text, a long translation) with the stdlib encoder and orjson, and reports
+render time and bytes on the wire uncompressed, gzip and brotli.
+
+Usage:
+    python bench_responses.py --repeat 50
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data" / "raw_laws"
+
+
+def _document_text() -> str:
+    """~200 KB of legal prose built from the bundled corpus"""
+    sources = [DATA_DIR / "comprehensive_legal_faq.txt", DATA_DIR / "legal_knowledge_sources.txt"]
+    text = "\n".join(p.read_text(encoding="utf-8", errors="ignore") for p in sources if p.exists())
+    text = text or "Article 21. No person shall be deprived of his life or personal liberty. " * 500
+    return (text * (200_000 // max(1, len(text)) + 1))[:200_000]
+
+
+def payloads() -> dict:
+    text = _document_text()
+    hindi = "अनुच्छेद २१: किसी व्यक्ति को उसके प्राण या दैहिक स्वतंत्रता से वंचित नहीं किया जाएगा। " * 1500
+    return {
+        "upload_doc (200 KB text)": {
+            "text": text, "doc_type": "Legal Notice", "filename": "notice.pdf", "doc_id": "0" * 32,
+        },
+        "analyze_doc translate (Hindi)": {
+            "translated_text": hindi, "source_lang": "English", "target_lang": "Hindi",
+        },
+        "analyze_doc summarize": {
+            "summary": text[:20_000],
+            "key_points": [text[i:i + 300] for i in range(0, 30_000, 300)],
+        },
+    }
+
+
+def _time(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run_benchmark(repeat: int) -> list:
+    from responses import FastJSONResponse, compress, brotli
+
+    rows = []
+    for name, payload in payloads().items():
+        stdlib_ms = _time(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"), repeat)
+        orjson_ms = _time(lambda: FastJSONResponse(payload).body, repeat)
+        body = FastJSONResponse(payload).body
+        row = {
+            "payload": name,
+            "stdlib_ms": round(stdlib_ms, 3),
+            "orjson_ms": round(orjson_ms, 3),
+            "raw_bytes": len(body),
+            "gzip_bytes": len(compress(body, "gzip")),
+            "gzip_ms": round(_time(lambda: compress(body, "gzip"), max(1, repeat // 5)), 3),
+        }
+        if brotli is not None:
+            row["br_bytes"] = len(compress(body, "br"))
+            row["br_ms"] = round(_time(lambda: compress(body, "br"), max(1, repeat // 5)), 3)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON rendering and compression")
+    parser.add_argument("--repeat", type=int, default=50, help="Iterations per measurement")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("RESPONSE PAYLOAD BENCHMARK")
+    print("=" * 80)
+    for row in run_benchmark(args.repeat):
+        print(f"\n{row['payload']}")
+        print(f"  render: stdlib json {row['stdlib_ms']} ms, orjson {row['orjson_ms']} ms")
+        print(f"  wire:   raw {row['raw_bytes']:,} B, gzip {row['gzip_bytes']:,} B ({row['gzip_ms']} ms)", end="")
+        if "br_bytes" in row:
+            print(f", br {row['br_bytes']:,} B ({row['br_ms']} ms)")
+        else:
+            print("  (install brotli for br numbers)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
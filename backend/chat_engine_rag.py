@@ -4,16 +4,44 @@ Optimized for Render Free Tier (Low Memory Usage)
 """
 
 import logging
-from typing import Dict
+from typing import Dict, List, Optional
 from comprehensive_legal_db import get_comprehensive_legal_info, COMPREHENSIVE_LEGAL_FAQ
+from doc_parser import estimate_tokens
+from local_llm import llm_router
+from tracing import trace_function
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def answer_query_with_rag(query: str, user_id: str = None, mode: str = "default") -> Dict:
+# FAQ entries offered to the LLM as context for a follow-up question
+FOLLOW_UP_CONTEXTS = 4
+# Token budget for those entries (the history is already bounded by MEMORY_PROMPT_TOKENS)
+FOLLOW_UP_CONTEXT_TOKENS = 1500
+FOLLOW_UP_SYSTEM_PROMPT = (
+    "You are SPECTER, an AI legal assistant specialized in Indian law. "
+    "Answer the user's follow-up question using the conversation so far and the reference notes. "
+    "If you're unsure about any information, clearly state that."
+)
+
+def _keyword_matches(query: str, limit: int) -> List[str]:
+    """FAQ keys with the most word overlap with the query, best first"""
+    query_words = set(query.lower().split())
+    scored = []
+    for key in COMPREHENSIVE_LEGAL_FAQ:
+        overlap = len(query_words.intersection(key.replace('_', ' ').split()))
+        if overlap:
+            scored.append((overlap, key))
+    scored.sort(key=lambda item: -item[0])
+    return [key for _, key in scored[:limit]]
+
+@trace_function(name="chat.answer_query")
+def answer_query_with_rag(query: str, user_id: str = None, mode: str = "default", history: Optional[List[Dict[str, str]]] = None) -> Dict:
     """
     Get answer using lightweight fuzzy matching instead of heavy Vector RAG.
     This prevents OOM crashes on free tier servers.
+    
+    If the query alone doesn't match and history is given, the previous
+    user question is used as context for follow-ups ("what is the penalty?").
     """
     try:
         logger.info(f"Processing query: {query}")
@@ -21,6 +49,14 @@ def answer_query_with_rag(query: str, user_id: str = None, mode: str = "default"
         # 1. Try exact/keyword match from comprehensive DB
         answer = get_comprehensive_legal_info(query)
         
+        # Follow-up question: retry with the previous user turn as context
+        if not answer and history:
+            previous = next((m["content"] for m in reversed(history) if m["role"] == "user"), None)
+            if previous:
+                answer = get_comprehensive_legal_info(f"{previous} {query}")
+                if answer:
+                    query = f"{previous} {query}"
+        
         if answer:
             return {
                 "answer": answer,
@@ -30,23 +66,12 @@ def answer_query_with_rag(query: str, user_id: str = None, mode: str = "default"
             }
             
         # 2. Fuzzy Search (Fallback)
-        # Split query into words and find best matching key in DB
-        query_words = set(query.lower().split())
-        best_match = None
-        max_score = 0
+        # Pick the DB key sharing the most words with the query
+        best_keys = _keyword_matches(query, 1)
         
-        for key, value in COMPREHENSIVE_LEGAL_FAQ.items():
-            key_words = set(key.replace('_', ' ').split())
-            
-            # Calculate overlap score
-            overlap = len(query_words.intersection(key_words))
-            if overlap > max_score:
-                max_score = overlap
-                best_match = value
-        
-        if best_match and max_score > 0:
+        if best_keys:
             return {
-                "answer": best_match,
+                "answer": COMPREHENSIVE_LEGAL_FAQ[best_keys[0]],
                 "sources": ["Legal Database (Fuzzy Match)"],
                 "confidence": 0.7,
                 "matched_question": query
@@ -67,3 +92,51 @@ def answer_query_with_rag(query: str, user_id: str = None, mode: str = "default"
             "sources": [],
             "confidence": 0.0
         }
+
+def build_follow_up_messages(query: str, history: List[Dict[str, str]], context_data: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    Chat messages for a follow-up: system prompt, the conversation history
+    (summary first, as given by get_history) and the question with as many
+    reference notes as fit in FOLLOW_UP_CONTEXT_TOKENS.
+    """
+    budget = FOLLOW_UP_CONTEXT_TOKENS
+    notes = []
+    for key, text in context_data.items():
+        note = f"{key.replace('_', ' ').title()}: {text}"
+        cost = estimate_tokens(note)
+        if cost > budget:
+            continue
+        budget -= cost
+        notes.append(note)
+    
+    user_message = f"Legal Query: {query}"
+    if notes:
+        user_message += "\n\nReference notes:\n" + "\n\n".join(notes)
+    return [
+        {"role": "system", "content": FOLLOW_UP_SYSTEM_PROMPT},
+        *history,
+        {"role": "user", "content": user_message}
+    ]
+
+@trace_function(name="chat.answer_follow_up")
+def answer_follow_up(query: str, history: List[Dict[str, str]]) -> Optional[Dict]:
+    """
+    Answer a follow-up question with the LLM, with the conversation history
+    and the FAQ entries closest to the thread in the prompt.
+    
+    Returns None if no LLM backend could answer.
+    """
+    thread = " ".join(m["content"] for m in history if m["role"] == "user")
+    context_data = {key: COMPREHENSIVE_LEGAL_FAQ[key] for key in _keyword_matches(f"{thread} {query}", FOLLOW_UP_CONTEXTS)}
+    try:
+        answer = llm_router.generate(build_follow_up_messages(query, history, context_data))
+    except Exception as e:
+        logger.warning(f"Follow-up answer failed, keeping the database answer: {e}")
+        return None
+    
+    return {
+        "answer": answer,
+        "sources": list(context_data) or ["Conversation context"],
+        "confidence": 0.6,
+        "matched_question": query
+    }
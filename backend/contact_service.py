@@ -4,6 +4,11 @@ import os
 from dotenv import load_dotenv
 import logging
 
+try:
+    from .email_dispatcher import SMTPConfig, email_dispatcher
+except ImportError:
+    from email_dispatcher import SMTPConfig, email_dispatcher
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -133,6 +138,17 @@ async def contact_lawyer(request: LawyerContactRequest):
                         "message": "Your request has been sent successfully! We'll contact you within 24 hours."
                     }
             
+            # Option 3: Queue for SMTP delivery (if configured)
+            smtp_config = SMTPConfig.from_env("SMTP_")
+            
+            if smtp_config.user and smtp_config.password:
+                if email_dispatcher.enqueue(smtp_config, admin_email, subject, html_content, subtype="html"):
+                    logger.info(f"Contact email queued for {request.email}")
+                    return {
+                        "success": True,
+                        "message": "Your request has been sent successfully! We'll contact you within 24 hours."
+                    }
+            
             # Fallback: Log the request and send email to admin manually
             logger.warning("⚠️ EMAIL SERVICE NOT CONFIGURED - REQUEST LOGGED BELOW:")
             logger.info(f"""
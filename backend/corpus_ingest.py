@@ -0,0 +1,387 @@
+"""
+Corpus Ingestion Pipeline
+Streams the raw law corpus (bare act PDFs, knowledge notes, JSONL seed records)
+into the vector store: each file is split into page/line batches that are
+extracted in parallel worker processes, then article/section-aware chunking
+(doc_parser), batched embedding and bulk upserts. A checkpoint file records how
+many batches of each file are done, so an interrupted run resumes mid-file.
+Seed records get content-hash ids, so a record present in several seed files
+is embedded and stored once.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from doc_parser import iter_chunks
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+DEFAULT_SOURCES = [
+    DATA_DIR / "raw_laws" / "constitution.pdf",
+    DATA_DIR / "raw_laws" / "legal_knowledge_sources.txt",
+    DATA_DIR / "raw_laws" / "seed_notes.jsonl",
+    DATA_DIR / "processed" / "kb_seed.jsonl",
+]
+
+CORPUS_COLLECTION = "indian_law_corpus"
+CHECKPOINT_FILE = Path("./chroma_db/ingest_checkpoint.json")
+EMBED_BATCH_SIZE = 64
+UPSERT_BATCH_SIZE = 1000
+MAX_CHUNK_TOKENS = 384
+# Extraction batch sizes: PDF pages, or lines (JSONL records) of text files
+PDF_PAGES_PER_BATCH = 25
+LINES_PER_BATCH = 2000
+
+# ---------------------------------------------------------------------------
+# Extraction (runs in worker processes, so these stay module-level functions)
+# ---------------------------------------------------------------------------
+
+def _pdf_page_count(path: Path) -> int:
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def plan_batches(path: Path) -> List[Tuple[int, int]]:
+    """Split a file into (start, stop) extraction batches: page ranges for PDFs, line-aligned byte ranges otherwise"""
+    if path.suffix.lower() == ".pdf":
+        pages = _pdf_page_count(path)
+        return [(start, min(start + PDF_PAGES_PER_BATCH, pages)) for start in range(0, pages, PDF_PAGES_PER_BATCH)]
+
+    batches = []
+    start = offset = lines = 0
+    with open(path, "rb") as f:
+        for line in f:
+            offset += len(line)
+            lines += 1
+            if lines == LINES_PER_BATCH:
+                batches.append((start, offset))
+                start, lines = offset, 0
+    if offset > start:
+        batches.append((start, offset))
+    return batches
+
+
+def _record_text(record: Dict) -> str:
+    """Flatten a structured seed record into one searchable passage"""
+    parts = [record.get("title", ""), record.get("chunk_text", ""), record.get("text_summary", "")]
+    for field in ("ingredients", "exceptions", "illustrations", "exam_notes"):
+        values = record.get(field) or []
+        if values:
+            parts.append(f"{field.replace('_', ' ').title()}: " + "; ".join(str(v) for v in values))
+    return "\n".join(part for part in parts if part)
+
+
+def _is_record_file(path: Path) -> bool:
+    """JSONL seed files hold structured records (deduplicated across files)"""
+    return path.suffix.lower() == ".jsonl"
+
+
+def extract_batch(path: str, start: int, stop: int) -> Tuple[List[Dict], float]:
+    """Extract text segments from one batch of a source file; returns (segments, seconds)"""
+    begin = time.perf_counter()
+    file_path = Path(path)
+    ext = file_path.suffix.lower()
+    segments = []
+
+    if ext == ".pdf":
+        import PyPDF2
+
+        with open(file_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            text = "\n".join((reader.pages[i].extract_text() or "") for i in range(start, stop))
+        segments.append({"text": text, "metadata": {}})
+    else:
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            text = f.read(stop - start).decode("utf-8", errors="ignore")
+        if ext == ".jsonl":
+            for line in text.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                record_text = _record_text(record)
+                segments.append({
+                    "text": record_text,
+                    "content_hash": hashlib.sha1(record_text.encode("utf-8")).hexdigest(),
+                    "metadata": {
+                        "domain": record.get("domain", ""),
+                        "instrument": record.get("instrument", ""),
+                        "section": str(record.get("section", "")),
+                        "title": record.get("title", ""),
+                        "source_url": record.get("source_url", ""),
+                    },
+                })
+        else:
+            segments.append({"text": text, "metadata": {}})
+
+    return segments, time.perf_counter() - begin
+
+
+# ---------------------------------------------------------------------------
+# Chunking
+# ---------------------------------------------------------------------------
+
+def chunk_segments(
+    segments: List[Dict], source: str, batch_start: int = 0, max_tokens: int = MAX_CHUNK_TOKENS
+) -> Iterator[Dict]:
+    """
+    Yield chunk dicts (id, text, metadata) for the segments of one batch.
+    Seed records are keyed by their content hash, so the same record in two
+    files maps to the same ids.
+    """
+    for segment_index, segment in enumerate(segments):
+        scope = segment.get("content_hash") or f"{source}\x1f{batch_start}\x1f{segment_index}"
+        for chunk in iter_chunks(segment["text"], max_tokens=max_tokens):
+            key = f"{scope}\x1f{chunk['start']}\x1f{chunk['text']}"
+            digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+            metadata = {
+                "source": source,
+                "text": chunk["text"],
+                "heading": chunk["heading"],
+                "start": chunk["start"],
+                "end": chunk["end"],
+                **segment["metadata"],
+            }
+            yield {"id": f"doc_{digest}", "text": chunk["text"], "metadata": metadata}
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+@dataclass
+class StageStats:
+    items: int = 0
+    seconds: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "items": self.items,
+            "seconds": round(self.seconds, 3),
+            "items_per_second": round(self.items / self.seconds, 1) if self.seconds > 0 else 0.0,
+        }
+
+
+class CorpusIngestor:
+    """Ingest raw law files into a ChromaDB collection with resumable checkpoints"""
+
+    def __init__(
+        self,
+        model=None,
+        client=None,
+        collection_name: str = CORPUS_COLLECTION,
+        checkpoint_path: Path = CHECKPOINT_FILE,
+        workers: Optional[int] = None,
+    ):
+        if model is None:
+            from embed_store import get_embedding_model
+            model = get_embedding_model()
+        if client is None:
+            import chromadb
+            client = chromadb.PersistentClient(path="./chroma_db")
+        self.model = model
+        self.collection = client.get_or_create_collection(
+            name=collection_name,
+            metadata={"description": "Indian law corpus chunks (bare acts, notes, seed records)"}
+        )
+        self.checkpoint_path = Path(checkpoint_path)
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.stats = {stage: StageStats() for stage in ("extract", "chunk", "embed", "upsert")}
+        self.duplicates_skipped = 0
+        self._seen_records: Set[str] = set()
+
+    def _load_checkpoint(self) -> Dict[str, Dict]:
+        """{file name: {"digest", "batches_done", "batches_total"}}"""
+        if not self.checkpoint_path.exists():
+            return {}
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return {}
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Dict]):
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    @staticmethod
+    def _file_digest(path: Path) -> str:
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _flush(self, batch: List[Dict]):
+        start = time.perf_counter()
+        embeddings = self.model.encode([chunk["text"] for chunk in batch], batch_size=EMBED_BATCH_SIZE)
+        self.stats["embed"].items += len(batch)
+        self.stats["embed"].seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.collection.upsert(
+            ids=[chunk["id"] for chunk in batch],
+            embeddings=embeddings.tolist(),
+            metadatas=[chunk["metadata"] for chunk in batch],
+        )
+        self.stats["upsert"].items += len(batch)
+        self.stats["upsert"].seconds += time.perf_counter() - start
+
+    def _ingest_batch(self, source: str, batch_start: int, segments: List[Dict]) -> int:
+        # Seed records already ingested from another file in this run are skipped
+        unique = []
+        for segment in segments:
+            content_hash = segment.get("content_hash")
+            if content_hash is not None:
+                if content_hash in self._seen_records:
+                    self.duplicates_skipped += 1
+                    continue
+                self._seen_records.add(content_hash)
+            unique.append(segment)
+
+        count = 0
+        batch: List[Dict] = []
+        chunk_start = time.perf_counter()
+        for chunk in chunk_segments(unique, source, batch_start):
+            batch.append(chunk)
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                self.stats["chunk"].seconds += time.perf_counter() - chunk_start
+                self._flush(batch)
+                count += len(batch)
+                batch = []
+                chunk_start = time.perf_counter()
+        self.stats["chunk"].seconds += time.perf_counter() - chunk_start
+        if batch:
+            self._flush(batch)
+            count += len(batch)
+        self.stats["chunk"].items += count
+        return count
+
+    def run(self, paths: Optional[List[Path]] = None, resume: bool = True) -> Dict:
+        """
+        Ingest the given files (default: the bundled raw law corpus)
+
+        Args:
+            paths: Source files to ingest
+            resume: Continue from the checkpoint: skip finished files with the same
+                content and pick up partly ingested ones at their next batch
+
+        Returns:
+            Dict with per-file chunk counts and per-stage throughput
+        """
+        paths = [Path(p) for p in (paths or DEFAULT_SOURCES) if Path(p).exists()]
+        checkpoint = self._load_checkpoint() if resume else {}
+
+        digests = {path: self._file_digest(path) for path in paths}
+        changed = [
+            path for path in paths
+            if checkpoint.get(path.name, {}).get("digest") != digests[path]
+        ]
+        for path in changed:
+            # Drop chunks left over from a previous version of this file
+            self.collection.delete(where={"source": path.name})
+        # Seed records shared between files are stored once, under whichever file wrote them
+        # first, so deleting a changed seed file's chunks can remove records another seed
+        # file still provides: re-upsert every other seed file too
+        restart = set(changed)
+        if any(_is_record_file(path) for path in changed):
+            restart.update(path for path in paths if _is_record_file(path))
+
+        tasks = []
+        skipped = 0
+        for path in paths:
+            entry = checkpoint.get(path.name)
+            if path not in restart and entry["batches_done"] >= entry["batches_total"]:
+                logger.info(f"Skipping {path.name} (already ingested)")
+                skipped += 1
+                continue
+            batches = plan_batches(path)
+            if path in restart:
+                entry = checkpoint[path.name] = {
+                    "digest": digests[path], "batches_done": 0, "batches_total": len(batches)
+                }
+            else:
+                logger.info(f"Resuming {path.name} at batch {entry['batches_done'] + 1}/{len(batches)}")
+            tasks.extend(
+                (path, index, start, stop) for index, (start, stop) in enumerate(batches) if index >= entry["batches_done"]
+            )
+        self._save_checkpoint(checkpoint)
+
+        files: Dict[str, int] = {}
+        finished: Dict[str, Set[int]] = {}
+        wall_start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            queue = iter(tasks)
+            in_flight = {}
+
+            def submit_next():
+                task = next(queue, None)
+                if task is not None:
+                    path, _, start, stop = task
+                    in_flight[pool.submit(extract_batch, str(path), start, stop)] = task
+
+            # Keep only a few batches extracted ahead of the embedder so memory stays bounded
+            for _ in range(self.workers * 2):
+                submit_next()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, index, start, _ = in_flight.pop(future)
+                    submit_next()
+                    try:
+                        segments, seconds = future.result()
+                    except Exception as e:
+                        logger.error(f"Extraction failed for {path.name} batch {index + 1}: {e}")
+                        continue
+                    self.stats["extract"].items += 1
+                    self.stats["extract"].seconds += seconds
+
+                    files[path.name] = files.get(path.name, 0) + self._ingest_batch(path.name, start, segments)
+
+                    # Checkpoint the contiguous run of finished batches (upserts make redoing a batch harmless)
+                    entry = checkpoint[path.name]
+                    finished.setdefault(path.name, set()).add(index)
+                    while entry["batches_done"] in finished[path.name]:
+                        entry["batches_done"] += 1
+                    self._save_checkpoint(checkpoint)
+                    if entry["batches_done"] == entry["batches_total"]:
+                        logger.info(f"Ingested {path.name}: {files[path.name]} chunks")
+
+        report = {
+            "files": files,
+            "skipped": skipped,
+            "duplicates_skipped": self.duplicates_skipped,
+            "wall_seconds": round(time.perf_counter() - wall_start, 3),
+            "stages": {stage: stats.to_dict() for stage, stats in self.stats.items()},
+            "collection_count": self.collection.count(),
+        }
+        logger.info(f"📊 Ingestion report: {json.dumps(report, indent=2)}")
+        return report
+
+
+def main():
+    """Ingest the bundled corpus, resuming from the last checkpoint"""
+    logger.info("=" * 80)
+    logger.info("🚀 CORPUS INGESTION PIPELINE")
+    logger.info("=" * 80)
+    CorpusIngestor().run()
+
+
+if __name__ == "__main__":
+    main()
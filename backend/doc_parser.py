@@ -1,3 +1,174 @@
-def parse_and_chunk(document_text: str):
-    """Minimal doc parser implementation"""
-    return [document_text]
+"""
+Document Parser
+Structure-aware, streaming chunker for legal text. Chunks break at Part,
+Chapter, Article and Section headings, prefer clause and numbered-paragraph
+boundaries inside a unit, respect a token budget with optional overlap, and
+carry character offsets back into the source for citations.
+"""
+
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+CHUNK_MAX_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 32
+CHARS_PER_TOKEN = 4
+
+# Headings that always start a new chunk
+_MAJOR_HEADING_RE = re.compile(
+    r"^\s*(?:PART\s+[IVXLC]+\b|CHAPTER\s+[IVXLC\d]+\b|SCHEDULE\b|"
+    r"Article\s+\d+[A-Z]*\b|Art\.\s*\d+[A-Z]*\b|Section\s+\d+[A-Z]*\b|Sec\.\s*\d+[A-Z]*\b|§\s*\d+)",
+    re.IGNORECASE,
+)
+# Clause / numbered paragraph markers: preferred split points inside a unit
+_MINOR_HEADING_RE = re.compile(
+    r"^\s*(?:Clause\s+\d+|\d+[A-Z]?\.\s|\(\d+[A-Z]?\)\s|\([a-z]{1,4}\)\s|[a-z]\)\s)",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate (~4 characters per token for English legal text)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Yield lines with their newline, without copying a large string"""
+    if isinstance(source, str):
+        position = 0
+        while position < len(source):
+            newline = source.find("\n", position)
+            end = len(source) if newline == -1 else newline + 1
+            yield source[position:end]
+            position = end
+    else:
+        for piece in source:
+            yield piece
+
+
+def _make_chunk(lines: List[Tuple[int, str]], heading: Optional[str], index: int) -> Optional[Dict]:
+    raw = "".join(line for _, line in lines)
+    text = raw.strip()
+    if not text:
+        return None
+    start = lines[0][0] + (len(raw) - len(raw.lstrip()))
+    return {
+        "text": text,
+        "start": start,
+        "end": start + len(text),
+        "heading": heading or "",
+        "chunk_index": index,
+        "tokens": estimate_tokens(text),
+    }
+
+
+def _split_long_line(offset: int, line: str, max_chars: int, overlap_chars: int) -> Iterator[Tuple[int, str]]:
+    """Window an oversized line on word boundaries"""
+    words = []
+    for m in re.finditer(r"\S+", line):
+        # Hard-split "words" that alone exceed the budget (tables, base64, etc.)
+        for start in range(m.start(), m.end(), max_chars):
+            words.append((start, min(start + max_chars, m.end())))
+    i = 0
+    while i < len(words):
+        j = i
+        while j + 1 < len(words) and words[j + 1][1] - words[i][0] <= max_chars:
+            j += 1
+        yield offset + words[i][0], line[words[i][0]:words[j][1]]
+        if j + 1 >= len(words):
+            break
+        # Step back for overlap, but always make progress
+        k = j + 1
+        while k - 1 > i and words[j][1] - words[k - 1][0] <= overlap_chars:
+            k -= 1
+        i = k
+
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[Dict]:
+    """
+    Lazily yield chunks from a document
+
+    Args:
+        source: Full text, or an iterable of lines (e.g. an open file) for bounded memory
+        max_tokens: Token budget per chunk
+        overlap_tokens: Tokens carried over when a unit is split for size
+
+    Yields:
+        Dicts with text, start/end character offsets, heading, chunk_index and tokens
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens, max_tokens // 2) * CHARS_PER_TOKEN
+
+    buffer: List[Tuple[int, str]] = []
+    buffer_chars = 0
+    heading = None
+    index = 0
+    offset = 0
+
+    def flush(carry_overlap: bool):
+        nonlocal buffer, buffer_chars, index
+        chunk = _make_chunk(buffer, heading, index) if buffer else None
+        carried: List[Tuple[int, str]] = []
+        if carry_overlap and overlap_chars:
+            size = 0
+            for item in reversed(buffer):
+                if size + len(item[1]) > overlap_chars:
+                    break
+                carried.insert(0, item)
+                size += len(item[1])
+        buffer = carried
+        buffer_chars = sum(len(line) for _, line in carried)
+        if chunk:
+            index += 1
+        return chunk
+
+    for line in _iter_lines(source):
+        line_offset = offset
+        offset += len(line)
+
+        if _MAJOR_HEADING_RE.match(line):
+            chunk = flush(carry_overlap=False)
+            if chunk:
+                yield chunk
+            heading = line.strip()[:120]
+        elif _MINOR_HEADING_RE.match(line) and buffer_chars >= max_chars // 2:
+            chunk = flush(carry_overlap=False)
+            if chunk:
+                yield chunk
+
+        if len(line) > max_chars:
+            chunk = flush(carry_overlap=False)
+            if chunk:
+                yield chunk
+            for piece_offset, piece in _split_long_line(line_offset, line, max_chars, overlap_chars):
+                chunk = _make_chunk([(piece_offset, piece)], heading, index)
+                if chunk:
+                    index += 1
+                    yield chunk
+            continue
+
+        if buffer_chars + len(line) > max_chars:
+            chunk = flush(carry_overlap=True)
+            if chunk:
+                yield chunk
+            if buffer_chars + len(line) > max_chars:
+                buffer, buffer_chars = [], 0
+
+        buffer.append((line_offset, line))
+        buffer_chars += len(line)
+
+    chunk = flush(carry_overlap=False)
+    if chunk:
+        yield chunk
+
+
+def parse_and_chunk(
+    document_text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> List[Dict]:
+    """Chunk a document into structure-aware pieces with character offsets"""
+    return list(iter_chunks(document_text, max_tokens=max_tokens, overlap_tokens=overlap_tokens))
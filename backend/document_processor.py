@@ -13,7 +13,10 @@ import PyPDF2
 import docx
 from pathlib import Path
 import shutil
+import time
 import uuid
+from tracing import trace_function, current_span
+from metrics import DOCUMENT_EXTRACT_LATENCY, OCR_LATENCY
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,10 +44,15 @@ class DocumentProcessor:
             
         return file_path
 
+    @trace_function(name="document.extract_text")
     def extract_text(self, file_path: Path) -> str:
         """Extract text from file based on extension"""
         ext = file_path.suffix.lower()
+        span = current_span()
+        if span is not None:
+            span.set_attribute("document.ext", ext)
         
+        start = time.perf_counter()
         try:
             if ext == '.txt':
                 return self._read_txt(file_path)
@@ -59,6 +67,8 @@ class DocumentProcessor:
         except Exception as e:
             logger.error(f"Error extracting text from {file_path}: {str(e)}")
             raise
+        finally:
+            DOCUMENT_EXTRACT_LATENCY.observe(time.perf_counter() - start, ext=ext)
 
     def _read_txt(self, path: Path) -> str:
         with open(path, 'r', encoding='utf-8', errors='ignore') as f:
@@ -82,10 +92,12 @@ class DocumentProcessor:
         # If text is empty or very short, it might be a scanned PDF -> use OCR
         if len(text.strip()) < 50:
             logger.info("PDF appears to be scanned. Attempting OCR...")
+            start = time.perf_counter()
             try:
                 images = convert_from_path(str(path))
                 for img in images:
                     text += pytesseract.image_to_string(img) + "\n"
+                OCR_LATENCY.observe(time.perf_counter() - start, source="pdf")
             except Exception as e:
                 logger.error(f"OCR failed (Tesseract might be missing): {e}")
                 if not text:
@@ -94,9 +106,11 @@ class DocumentProcessor:
         return text
 
     def _ocr_image(self, path: Path) -> str:
+        start = time.perf_counter()
         try:
             image = Image.open(path)
             text = pytesseract.image_to_string(image)
+            OCR_LATENCY.observe(time.perf_counter() - start, source="image")
             return text
         except Exception as e:
             logger.error(f"Image OCR failed: {e}")
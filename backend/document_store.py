@@ -0,0 +1,109 @@
+"""
+Document Handles
+Short-lived server-side copies of uploaded documents' extracted text, so
+analyze_doc can take a doc_id instead of the client posting the full text
+back for every action. Text is kept zlib-compressed in process memory only,
+expires after DOC_HANDLE_TTL seconds, is evicted least-recently-used beyond
+DOC_STORE_MAX_MB, and can be purged on request.
+"""
+
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DOC_HANDLE_TTL = float(os.getenv("DOC_HANDLE_TTL", "1800"))
+DOC_STORE_MAX_BYTES = int(float(os.getenv("DOC_STORE_MAX_MB", "64")) * 1024 * 1024)
+DOC_COMPRESSION_LEVEL = 6
+
+
+class DocumentHandle:
+    __slots__ = ("doc_id", "owner_id", "doc_type", "filename", "compressed", "text_length", "expires_at")
+
+    def __init__(self, doc_id: str, owner_id: Optional[str], doc_type: str, filename: str, text: str, ttl: float):
+        self.doc_id = doc_id
+        self.owner_id = owner_id
+        self.doc_type = doc_type
+        self.filename = filename
+        self.compressed = zlib.compress(text.encode("utf-8"), DOC_COMPRESSION_LEVEL)
+        self.text_length = len(text)
+        self.expires_at = time.monotonic() + ttl
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(self.compressed).decode("utf-8")
+
+
+class DocumentStore:
+    """TTL + byte-bounded LRU map of doc_id -> DocumentHandle"""
+
+    def __init__(self, ttl: float = DOC_HANDLE_TTL, max_bytes: int = DOC_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._handles: "OrderedDict[str, DocumentHandle]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, doc_id: str) -> Optional[DocumentHandle]:
+        handle = self._handles.pop(doc_id, None)
+        if handle is not None:
+            self._bytes -= len(handle.compressed)
+        return handle
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [doc_id for doc_id, handle in self._handles.items() if handle.expires_at <= now]
+        for doc_id in expired:
+            self._remove(doc_id)
+
+    def put(self, doc_id: str, text: str, doc_type: str, filename: str, owner_id: Optional[str] = None) -> DocumentHandle:
+        """Store a document's text under doc_id"""
+        handle = DocumentHandle(doc_id, owner_id, doc_type, filename, text, self.ttl)
+        with self._lock:
+            self._remove(doc_id)
+            self._purge_expired()
+            self._handles[doc_id] = handle
+            self._bytes += len(handle.compressed)
+            while self._bytes > self.max_bytes and len(self._handles) > 1:
+                self._remove(next(iter(self._handles)))
+        return handle
+
+    def get(self, doc_id: str) -> Optional[DocumentHandle]:
+        """Live handle for doc_id, or None if unknown, expired or evicted"""
+        with self._lock:
+            handle = self._handles.get(doc_id)
+            if handle is None:
+                return None
+            if handle.expires_at <= time.monotonic():
+                self._remove(doc_id)
+                return None
+            self._handles.move_to_end(doc_id)
+            return handle
+
+    def purge(self, doc_id: str) -> bool:
+        """Forget a document immediately"""
+        with self._lock:
+            return self._remove(doc_id) is not None
+
+    def purge_owner(self, owner_id: str) -> int:
+        """Forget every document uploaded by a user"""
+        with self._lock:
+            doc_ids = [doc_id for doc_id, handle in self._handles.items() if handle.owner_id == owner_id]
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+            return len(doc_ids)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            text_chars = sum(handle.text_length for handle in self._handles.values())
+            return {
+                "documents": len(self._handles),
+                "compressed_bytes": self._bytes,
+                "text_chars": text_chars,
+                "max_bytes": self.max_bytes,
+            }
+
+
+document_store = DocumentStore()
@@ -0,0 +1,273 @@
+"""
+Email Dispatcher
+Background SMTP delivery so request handlers only enqueue a message and
+return. A single SMTP thread keeps one authenticated connection per account
+open between messages (reconnecting when it goes stale), sends whatever is
+queued as a batch over that connection, and retries transient failures with
+exponential backoff.
+
+To try it against a local debugging server:
+    python -m aiosmtpd -n -l localhost:1025
+    SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false
+"""
+
+import asyncio
+import logging
+import os
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.mime.text import MIMEText
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    from .metrics import EMAILS
+except ImportError:
+    from metrics import EMAILS
+
+logger = logging.getLogger(__name__)
+
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "1000"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "5"))
+EMAIL_RETRY_BACKOFF = float(os.getenv("EMAIL_RETRY_BACKOFF", "2.0"))
+# Connections idle longer than this are assumed dropped by the server
+EMAIL_IDLE_TIMEOUT = float(os.getenv("EMAIL_IDLE_TIMEOUT", "60"))
+EMAIL_DRAIN_TIMEOUT = float(os.getenv("EMAIL_DRAIN_TIMEOUT", "10"))
+SMTP_TIMEOUT = 15
+
+
+@dataclass(frozen=True)
+class SMTPConfig:
+    """One SMTP account; equal configs share a pooled connection"""
+
+    host: str
+    port: int
+    user: Optional[str] = None
+    password: Optional[str] = field(default=None, repr=False)
+    starttls: bool = True
+
+    @classmethod
+    def from_env(cls, prefix: str = "SMTP_") -> "SMTPConfig":
+        """Read <prefix>HOST, PORT, USER, PASS and STARTTLS"""
+        return cls(
+            host=os.getenv(f"{prefix}HOST", "smtp.gmail.com"),
+            port=int(os.getenv(f"{prefix}PORT", "587")),
+            user=os.getenv(f"{prefix}USER"),
+            password=os.getenv(f"{prefix}PASS"),
+            starttls=os.getenv(f"{prefix}STARTTLS", "true").lower() != "false",
+        )
+
+    @property
+    def sender(self) -> str:
+        return self.user or "noreply@specter.app"
+
+
+@dataclass
+class EmailMessage:
+    config: SMTPConfig
+    to: str
+    subject: str
+    body: str
+    subtype: str = "plain"
+    attempts: int = 0
+
+    def as_string(self) -> str:
+        msg = MIMEText(self.body, self.subtype)
+        msg["Subject"] = self.subject
+        msg["From"] = self.config.sender
+        msg["To"] = self.to
+        return msg.as_string()
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Errors a retry can't fix: rejected recipients, bad credentials, other 5xx replies"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class EmailDispatcher:
+    """Async email queue drained by a background task onto one SMTP thread"""
+
+    def __init__(
+        self,
+        max_queue: int = EMAIL_QUEUE_SIZE,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        max_retries: int = EMAIL_MAX_RETRIES,
+        backoff: float = EMAIL_RETRY_BACKOFF,
+        idle_timeout: float = EMAIL_IDLE_TIMEOUT,
+    ):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_tasks: Set[asyncio.Task] = set()
+        # smtplib isn't thread-safe, so every connection lives on this one thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+        self._connections: Dict[SMTPConfig, Tuple[smtplib.SMTP, float]] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def enqueue(self, config: SMTPConfig, to: str, subject: str, body: str, subtype: str = "plain") -> bool:
+        """Queue a message; returns False if the dispatcher isn't running or the queue is full"""
+        if self._queue is None:
+            logger.warning("Email dispatcher not started; dropping message to %s", to)
+            return False
+        try:
+            self._queue.put_nowait(EmailMessage(config, to, subject, body, subtype))
+        except asyncio.QueueFull:
+            EMAILS.inc(outcome="rejected")
+            logger.error("Email queue full; dropping message to %s", to)
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # SMTP thread
+    # ------------------------------------------------------------------
+
+    def _close(self, config: SMTPConfig):
+        entry = self._connections.pop(config, None)
+        if entry is not None:
+            try:
+                entry[0].quit()
+            except (smtplib.SMTPException, OSError):
+                entry[0].close()
+
+    def _connection(self, config: SMTPConfig) -> smtplib.SMTP:
+        entry = self._connections.get(config)
+        if entry is not None:
+            server, last_used = entry
+            if time.monotonic() - last_used < self.idle_timeout:
+                return server
+            self._close(config)
+
+        server = smtplib.SMTP(config.host, config.port, timeout=SMTP_TIMEOUT)
+        try:
+            server.ehlo()
+            if config.starttls:
+                server.starttls()
+                # STARTTLS discards the extensions learned so far; ask again over TLS
+                server.ehlo()
+            # Debugging servers don't advertise AUTH; talk to them unauthenticated
+            if config.user and config.password and server.has_extn("auth"):
+                server.login(config.user, config.password)
+        except Exception:
+            server.close()
+            raise
+        self._connections[config] = (server, time.monotonic())
+        return server
+
+    def _send_one(self, message: EmailMessage) -> Optional[Exception]:
+        error: Optional[Exception] = None
+        # A pooled connection may have been dropped by the server: reconnect once
+        for _ in range(2):
+            try:
+                server = self._connection(message.config)
+                server.sendmail(message.config.sender, [message.to], message.as_string())
+                self._connections[message.config] = (server, time.monotonic())
+                return None
+            except smtplib.SMTPServerDisconnected as e:
+                self._close(message.config)
+                error = e
+            except smtplib.SMTPRecipientsRefused as e:
+                return e
+            except Exception as e:
+                self._close(message.config)
+                return e
+        return error
+
+    def _send_batch(self, batch: List[EmailMessage]) -> List[Optional[Exception]]:
+        return [self._send_one(message) for message in batch]
+
+    def _close_all(self):
+        for config in list(self._connections):
+            self._close(config)
+
+    # ------------------------------------------------------------------
+    # Event loop side
+    # ------------------------------------------------------------------
+
+    async def _requeue(self, message: EmailMessage, delay: float):
+        await asyncio.sleep(delay)
+        await self._queue.put(message)
+
+    async def _deliver(self, batch: List[EmailMessage]):
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self._executor, self._send_batch, batch)
+        for message, error in zip(batch, results):
+            if error is None:
+                self.sent += 1
+                EMAILS.inc(outcome="sent")
+                continue
+            message.attempts += 1
+            if _is_permanent(error) or message.attempts > self.max_retries:
+                self.failed += 1
+                EMAILS.inc(outcome="failed")
+                logger.error(f"Giving up on email to {message.to} after {message.attempts} attempt(s): {error}")
+                continue
+            self.retried += 1
+            EMAILS.inc(outcome="retried")
+            delay = self.backoff * 2 ** (message.attempts - 1)
+            logger.warning(f"Email to {message.to} failed ({error}); retrying in {delay:.1f}s")
+            task = asyncio.create_task(self._requeue(message, delay))
+            self._retry_tasks.add(task)
+            task.add_done_callback(self._retry_tasks.discard)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._deliver(batch)
+            except Exception as e:
+                logger.error(f"Email dispatcher error: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def start(self):
+        """Start the background delivery task (call from app startup)"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = EMAIL_DRAIN_TIMEOUT):
+        """Send what is queued (up to timeout), then close connections (call from app shutdown)"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Email queue not drained on shutdown ({self._queue.qsize()} left)")
+        for task in list(self._retry_tasks):
+            task.cancel()
+        if self._retry_tasks:
+            logger.warning(f"Dropping {len(self._retry_tasks)} email(s) waiting for retry")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._queue = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_all)
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "waiting_retry": len(self._retry_tasks),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "open_connections": len(self._connections),
+        }
+
+
+email_dispatcher = EmailDispatcher()
@@ -1,7 +1,446 @@
-def add_chunks_to_db(chunks):
-    """Minimal embed store implementation"""
+"""
+Per-User Document Chunk Store
+Append-only, memory-mapped float32 vector segments with a JSONL metadata
+sidecar per segment. Inserts are batched, search scans every segment of a
+user's store and merges the top-k, and sealed segments are compacted in the
+background (merging them and dropping deleted documents).
+
+Retention: chunk text is written under EMBED_STORE_DIR, so documents are
+only kept for EMBED_STORE_TTL seconds after they were indexed (default one
+day). Expired documents stop matching at once and a background sweep
+(chunk_retention) compacts them off disk every EMBED_STORE_SWEEP_INTERVAL
+seconds, including for users who never come back.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBED_STORE_DIR = Path(os.getenv("EMBED_STORE_DIR", "./embed_store"))
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+SEGMENT_MAX_ROWS = 4096
+COMPACT_MIN_SEGMENTS = 4
+INSERT_BATCH_SIZE = 256
+EMBED_STORE_TTL = float(os.getenv("EMBED_STORE_TTL", "86400"))
+EMBED_STORE_SWEEP_INTERVAL = float(os.getenv("EMBED_STORE_SWEEP_INTERVAL", "600"))
+
+_model = None
+_model_lock = threading.Lock()
+_stores: Dict[str, "UserChunkStore"] = {}
+_stores_lock = threading.Lock()
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-compact")
+
+
+def get_embedding_model():
+    """
+    The process-wide sentence transformer, loaded on first use (keeps import
+    cheap). Other modules embedding with the same model share this copy.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBED_MODEL_NAME)
+    return _model
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    return np.asarray(
+        get_embedding_model().encode(texts, batch_size=INSERT_BATCH_SIZE, normalize_embeddings=True),
+        dtype=np.float32,
+    )
+
+
+class _Segment:
+    """One append-only vector file plus its metadata sidecar"""
+
+    def __init__(self, directory: Path, name: str, dim: int):
+        self.name = name
+        self.dim = dim
+        self.vec_path = directory / f"{name}.f32"
+        self.meta_path = directory / f"{name}.jsonl"
+        self._mmap = None
+        self._mmap_rows = 0
+        self._metadata: Optional[List[Dict]] = None
+
+    @property
+    def rows(self) -> int:
+        try:
+            return os.path.getsize(self.vec_path) // (self.dim * 4)
+        except OSError:
+            return 0
+
+    def append(self, vectors: np.ndarray, metadatas: List[Dict]):
+        with open(self.vec_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+        with open(self.meta_path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(metadata) + "\n" for metadata in metadatas)
+        if self._metadata is not None:
+            self._metadata.extend(metadatas)
+
+    def vectors(self) -> np.ndarray:
+        rows = self.rows
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._mmap is None or self._mmap_rows != rows:
+            self._mmap = np.memmap(self.vec_path, dtype="<f4", mode="r", shape=(rows, self.dim))
+            self._mmap_rows = rows
+        return self._mmap
+
+    def metadata(self) -> List[Dict]:
+        if self._metadata is None:
+            if self.meta_path.exists():
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    self._metadata = [json.loads(line) for line in f if line.strip()]
+            else:
+                self._metadata = []
+        return self._metadata
+
+    def remove(self):
+        self._mmap = None
+        for path in (self.vec_path, self.meta_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class UserChunkStore:
+    """All indexed document chunks for one user"""
+
+    def __init__(self, directory: Path, dim: int):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = directory / "manifest.json"
+        self._lock = threading.Lock()
+        self._compacting = False
+        # Bumped by clear(), so a compaction that started before it doesn't install stale rows
+        self._generation = 0
+
+        manifest = {"dim": dim, "segments": [], "deleted_docs": [], "documents": {}}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r") as f:
+                manifest.update(json.load(f))
+        self.dim = manifest["dim"]
+        self.segments = [_Segment(directory, name, self.dim) for name in manifest["segments"]]
+        self.deleted_docs = set(manifest["deleted_docs"])
+        # doc_id -> time it was first indexed (epoch seconds), for EMBED_STORE_TTL
+        self.documents: Dict[str, float] = dict(manifest["documents"])
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dim": self.dim,
+                "segments": [segment.name for segment in self.segments],
+                "deleted_docs": sorted(self.deleted_docs),
+                "documents": self.documents,
+            }, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _new_segment(self) -> _Segment:
+        segment = _Segment(self.directory, f"seg_{uuid.uuid4().hex[:12]}", self.dim)
+        self.segments.append(segment)
+        self._save_manifest()
+        return segment
+
+    def add(self, vectors: np.ndarray, metadatas: List[Dict]):
+        """Append rows, opening a new segment whenever the active one is full"""
+        with self._lock:
+            now = time.time()
+            new_docs = {row.get("doc_id") for row in metadatas} - self.documents.keys() - {None}
+            for doc_id in new_docs:
+                self.documents[doc_id] = now
+            if new_docs:
+                self._save_manifest()
+            offset = 0
+            while offset < len(metadatas):
+                active = self.segments[-1] if self.segments else None
+                if active is None or active.rows >= SEGMENT_MAX_ROWS:
+                    active = self._new_segment()
+                take = min(SEGMENT_MAX_ROWS - active.rows, len(metadatas) - offset)
+                active.append(vectors[offset:offset + take], metadatas[offset:offset + take])
+                offset += take
+
+    def search(self, query: np.ndarray, top_k: int = 5, doc_id: Optional[str] = None) -> List[Dict]:
+        """Top-k rows by cosine similarity across all segments"""
+        with self._lock:
+            segments = list(self.segments)
+            deleted = set(self.deleted_docs)
+
+        candidates = []
+        for segment in segments:
+            vectors = segment.vectors()
+            if len(vectors) == 0:
+                continue
+            metadata = segment.metadata()
+            rows = min(len(vectors), len(metadata))
+            if rows == 0:
+                # Vectors written but their metadata not appended yet
+                continue
+            scores = np.asarray(vectors[:rows] @ query)
+            if deleted or doc_id:
+                for i, row in enumerate(metadata[:rows]):
+                    if row.get("doc_id") in deleted or (doc_id and row.get("doc_id") != doc_id):
+                        scores[i] = -np.inf
+            k = min(top_k, rows)
+            for i in np.argpartition(-scores, k - 1)[:k]:
+                if np.isfinite(scores[i]):
+                    candidates.append((float(scores[i]), metadata[i]))
+
+        return [
+            {**metadata, "score": score}
+            for score, metadata in heapq.nlargest(top_k, candidates, key=lambda item: item[0])
+        ]
+
+    def delete_document(self, doc_id: str):
+        """Tombstone a document; its rows are dropped at the next compaction"""
+        with self._lock:
+            self.deleted_docs.add(doc_id)
+            self.documents.pop(doc_id, None)
+            self._save_manifest()
+
+    def expire_documents(self, ttl: float = EMBED_STORE_TTL) -> int:
+        """Tombstone documents indexed more than ttl seconds ago; returns how many"""
+        cutoff = time.time() - ttl
+        with self._lock:
+            expired = [doc_id for doc_id, indexed_at in self.documents.items() if indexed_at <= cutoff]
+            for doc_id in expired:
+                self.deleted_docs.add(doc_id)
+                del self.documents[doc_id]
+            if expired:
+                self._save_manifest()
+        return len(expired)
+
+    def needs_compaction(self) -> bool:
+        with self._lock:
+            if self._compacting:
+                return False
+            sealed = self.segments[:-1]
+            deleted = set(self.deleted_docs)
+        if len(sealed) >= COMPACT_MIN_SEGMENTS:
+            return True
+        # Only tombstones with rows in sealed segments can be reclaimed; the active one isn't compacted
+        return bool(deleted) and any(
+            row.get("doc_id") in deleted for segment in sealed for row in segment.metadata()
+        )
+
+    def compact(self, seal_active: bool = False):
+        """
+        Merge all sealed segments into one, dropping tombstoned documents.
+        seal_active first starts a fresh active segment, so rows of deleted
+        documents are removed from disk even if they were in the active one.
+        """
+        with self._lock:
+            if self._compacting:
+                return
+            if seal_active and self.segments and self.segments[-1].rows:
+                self._new_segment()
+            if len(self.segments) < 2:
+                return
+            self._compacting = True
+            sealed = self.segments[:-1]
+            deleted = set(self.deleted_docs)
+            generation = self._generation
+
+        try:
+            merged = _Segment(self.directory, f"seg_{uuid.uuid4().hex[:12]}", self.dim)
+            try:
+                for segment in sealed:
+                    metadata = segment.metadata()
+                    vectors = segment.vectors()
+                    keep = [i for i, row in enumerate(metadata[:len(vectors)]) if row.get("doc_id") not in deleted]
+                    if keep:
+                        merged.append(np.asarray(vectors[keep]), [metadata[i] for i in keep])
+            except Exception:
+                merged.remove()
+                raise
+
+            with self._lock:
+                if self._generation != generation:
+                    # The store was cleared while we merged: installing would bring its rows back
+                    merged.remove()
+                    return
+                self.segments = ([merged] if merged.rows else []) + self.segments[len(sealed):]
+                # Keep tombstones for rows still on disk: in unmerged segments, or deleted mid-compaction
+                remaining_docs = {row.get("doc_id") for segment in self.segments for row in segment.metadata()}
+                self.deleted_docs &= remaining_docs
+                self._save_manifest()
+            for segment in sealed:
+                segment.remove()
+            if not merged.rows:
+                merged.remove()
+            logger.info(f"Compacted {len(sealed)} segments in {self.directory.name}")
+        finally:
+            self._compacting = False
+
+    def clear(self):
+        """Delete every row and tombstone, including any compaction in progress"""
+        with self._lock:
+            for segment in self.segments:
+                segment.remove()
+            self.segments = []
+            self.deleted_docs.clear()
+            self.documents.clear()
+            self._generation += 1
+            self._save_manifest()
+
+    def count(self) -> int:
+        with self._lock:
+            return sum(segment.rows for segment in self.segments)
+
+
+def _store_key(user_id: str) -> str:
+    return hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:16]
+
+
+def _open_store(key: str) -> UserChunkStore:
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            directory = EMBED_STORE_DIR / key
+            # An existing store's manifest knows its dimension; only a new one needs the model
+            exists = (directory / "manifest.json").exists()
+            dim = 0 if exists else get_embedding_model().get_sentence_embedding_dimension()
+            store = UserChunkStore(directory, dim)
+            _stores[key] = store
+        return store
+
+
+def get_user_store(user_id: str) -> UserChunkStore:
+    """Get (or open) the chunk store for a user"""
+    return _open_store(_store_key(user_id))
+
+
+def _schedule_compaction(store: UserChunkStore):
+    if store.needs_compaction():
+        _compactor.submit(store.compact)
+
+
+def add_chunks_to_db(chunks: List[Union[str, Dict]], user_id: str = "anonymous", doc_id: Optional[str] = None) -> bool:
+    """
+    Embed and index document chunks for a user
+
+    Args:
+        chunks: Chunk strings, or dicts with a 'text' key plus extra metadata
+        user_id: Owner of the document
+        doc_id: Document identifier (generated if omitted)
+
+    Returns:
+        True if the chunks were indexed
+    """
+    if not chunks:
+        return False
+    doc_id = doc_id or uuid.uuid4().hex
+    records = []
+    for index, chunk in enumerate(chunks):
+        record = dict(chunk) if isinstance(chunk, dict) else {"text": chunk}
+        record.update({"doc_id": doc_id, "chunk_index": index})
+        if record["text"].strip():
+            records.append(record)
+    if not records:
+        return False
+
+    store = get_user_store(user_id)
+    for i in range(0, len(records), INSERT_BATCH_SIZE):
+        batch = records[i:i + INSERT_BATCH_SIZE]
+        store.add(_encode([record["text"] for record in batch]), batch)
+    _schedule_compaction(store)
     return True
 
-def search_chunks(query: str):
-    """Minimal search implementation"""
-    return []
+
+def search_chunks(query: str, user_id: str = "anonymous", top_k: int = 5, doc_id: Optional[str] = None) -> List[Dict]:
+    """Search a user's indexed document chunks; returns metadata dicts with a 'score'"""
+    if not query.strip():
+        return []
+    store = get_user_store(user_id)
+    if store.expire_documents():
+        _compactor.submit(store.compact, True)
+    if store.count() == 0:
+        return []
+    return store.search(_encode([query])[0], top_k=top_k, doc_id=doc_id)
+
+
+def has_user_chunks(user_id: str) -> bool:
+    """Cheap check (no model load) for whether a user has any indexed chunks"""
+    return (EMBED_STORE_DIR / _store_key(user_id) / "manifest.json").exists()
+
+
+def delete_user_chunks(user_id: str, doc_id: Optional[str] = None):
+    """
+    Delete one document (or every document) a user has indexed. A single
+    document is tombstoned at once and its rows are compacted off disk in
+    the background.
+    """
+    if not has_user_chunks(user_id):
+        return
+    store = get_user_store(user_id)
+    if doc_id:
+        store.delete_document(doc_id)
+        _compactor.submit(store.compact, True)
+        return
+    store.clear()
+
+
+def purge_expired_chunks(ttl: float = EMBED_STORE_TTL) -> int:
+    """Expire and compact away old documents in every user's store; returns how many expired"""
+    if not EMBED_STORE_DIR.exists():
+        return 0
+    expired = 0
+    for manifest_path in EMBED_STORE_DIR.glob("*/manifest.json"):
+        store = _open_store(manifest_path.parent.name)
+        expired += store.expire_documents(ttl)
+        # Tombstones only outlive a compaction while their rows are still on disk
+        if store.deleted_docs:
+            store.compact(seal_active=True)
+    if expired:
+        logger.info(f"Expired {expired} indexed documents older than {ttl:.0f}s")
+    return expired
+
+
+class ChunkRetention:
+    """Background sweep enforcing EMBED_STORE_TTL on indexed documents"""
+
+    def __init__(self, interval: float = EMBED_STORE_SWEEP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sweep_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(_compactor, purge_expired_chunks)
+            except Exception as e:
+                logger.error(f"Indexed document sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the sweep (call from app startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+chunk_retention = ChunkRetention()
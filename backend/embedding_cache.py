@@ -0,0 +1,108 @@
+"""
+Query Embedding Cache
+Byte-bounded LRU cache of normalized query -> embedding, placed in front of
+the sentence transformer so repeated questions skip the encoder forward pass.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Default budget for cached embeddings (384-dim float32 ~ 1.5 KB each)
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_EMBEDDING_CACHE_MB", "32")) * 1024 * 1024
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivial variations share one cache entry"""
+    return _WHITESPACE_RE.sub(" ", query).strip().lower()
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache sized by the bytes held rather than entry count"""
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_size(key: str, embedding: np.ndarray) -> int:
+        return embedding.nbytes + len(key.encode("utf-8"))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key: str, embedding: np.ndarray):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        size = self._entry_size(key, embedding)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._entry_size(key, previous)
+            self._entries[key] = embedding
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_embedding = self._entries.popitem(last=False)
+                self._bytes -= self._entry_size(old_key, old_embedding)
+                self.evictions += 1
+
+    def get_or_compute(self, query: str, encode: Callable[[str], np.ndarray]) -> np.ndarray:
+        """Return the cached embedding for a query, encoding it on a miss"""
+        key = normalize_query(query)
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = np.asarray(encode(key), dtype=np.float32)
+            self.put(key, embedding)
+        return embedding
+
+    def get_or_compute_many(self, queries: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for many queries, encoding all misses in one batch"""
+        keys = [normalize_query(query) for query in queries]
+        found = {}
+        for key in keys:
+            if key not in found:
+                found[key] = self.get(key)
+        missing = [key for key, embedding in found.items() if embedding is None]
+        if missing:
+            for key, embedding in zip(missing, np.asarray(encode(missing), dtype=np.float32)):
+                self.put(key, embedding)
+                found[key] = embedding
+        return np.stack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,16 +1,34 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Body, Request
-from fastapi.security import HTTPAuthorizationCredentials
+from fastapi import APIRouter, UploadFile, File, HTTPException, Body, Depends
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from document_processor import document_processor
 from legal_analysis import legal_analyzer
+from doc_parser import parse_and_chunk
+from embed_store import add_chunks_to_db, delete_user_chunks
+from usage_tracker import QuotaLease, optional_upload_quota
+from auth_mongo import optional_user, require_user
+from document_store import document_store
+from admission import AdmissionTicket, llm_admission_ticket
+from typing import Optional
+import asyncio
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 legal_router = APIRouter()
 
+def _index_document(text: str, user_id: str, doc_id: str):
+    """Chunk and embed an uploaded document (runs in the default executor)"""
+    add_chunks_to_db(parse_and_chunk(text), user_id, doc_id)
+
+def _log_indexing_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Indexing uploaded document failed: {future.exception()}")
+
 class AnalysisRequest(BaseModel):
-    text: str
-    doc_type: str
+    text: Optional[str] = None
+    doc_id: Optional[str] = None  # handle from upload_doc, instead of posting the text back
+    doc_type: Optional[str] = None
     action: str  # summarize, translate, verify
     target_lang: str = "Hindi"  # For translation
 
@@ -19,25 +37,10 @@ async def get_legal_info():
     return {"message": "Legal API endpoint"}
 
 @legal_router.post("/upload_doc")
-async def upload_document(request: Request, file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...), quota: Optional[QuotaLease] = Depends(optional_upload_quota)):
+    # Unauthenticated uploads are allowed but not tracked (quota is None)
+    user = quota.user if quota else None
     try:
-        from auth_mongo import get_current_user
-        from usage_tracker import enforce_upload_limit, increment_upload_count
-        
-        # Get authorization header
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            # Get current user
-            token = auth_header.replace("Bearer ", "")
-            credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
-            user = await get_current_user(credentials)
-            
-            # Check upload limits
-            await enforce_upload_limit(user)
-        else:
-            # Allow unauthenticated uploads but don't track
-            user = None
-        
         # 1. Save file
         file_path = document_processor.save_upload(file)
         
@@ -53,39 +56,96 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
         if not text.strip():
             raise HTTPException(status_code=400, detail="Could not extract text from document. Ensure it is a valid text-based PDF, DOCX, or clear Image.")
         
-        # Increment usage count if user is authenticated
+        # Keep a short-lived server-side copy so analyze_doc can take the doc_id
+        doc_id = uuid.uuid4().hex
+        document_store.put(doc_id, text, doc_type, file.filename, owner_id=str(user["_id"]) if user else None)
+        
         if user:
-            await increment_upload_count(str(user["_id"]))
+            # Index chunks in the background so the user can ask about this document later;
+            # they are kept on disk for EMBED_STORE_TTL (see embed_store), not indefinitely
+            indexing = asyncio.get_running_loop().run_in_executor(
+                None, _index_document, text, str(user["_id"]), doc_id
+            )
+            indexing.add_done_callback(_log_indexing_failure)
             
         return {
             "text": text,
             "doc_type": doc_type,
-            "filename": file.filename
+            "filename": file.filename,
+            "doc_id": doc_id
         }
-    except HTTPException as he:
-        raise he
     except Exception as e:
+        # Failed uploads don't count against the quota
+        if quota:
+            await quota.release()
+        if isinstance(e, HTTPException):
+            raise
         logger.error(f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _resolve_document(request: AnalysisRequest, user: Optional[dict]):
+    """(text, doc_type) from the inline text or from the document handle"""
+    if request.doc_id:
+        handle = document_store.get(request.doc_id)
+        if handle is None or (handle.owner_id and (user is None or str(user["_id"]) != handle.owner_id)):
+            if request.text:
+                return request.text, request.doc_type
+            raise HTTPException(status_code=404, detail="Document expired or not found. Please upload it again.")
+        return handle.text, request.doc_type or handle.doc_type
+    if not request.text:
+        raise HTTPException(status_code=400, detail="Either text or doc_id is required")
+    return request.text, request.doc_type
+
 @legal_router.post("/analyze_doc")
-async def analyze_document(request: AnalysisRequest):
+async def analyze_document(
+    request: AnalysisRequest,
+    user: Optional[dict] = Depends(optional_user),
+    ticket: AdmissionTicket = Depends(llm_admission_ticket),
+):
     try:
-        if request.action == "summarize":
-            result = legal_analyzer.summarize_document(request.text, request.doc_type)
-            return result
-            
-        elif request.action == "translate":
-            translation = legal_analyzer.translate_document(request.text, request.target_lang)
-            return {"translation": translation}
-            
-        elif request.action == "verify":
-            verification = legal_analyzer.verify_legality(request.text, request.doc_type)
-            return verification
-            
-        else:
+        text, doc_type = _resolve_document(request, user)
+        if request.action not in ("summarize", "translate", "verify"):
             raise HTTPException(status_code=400, detail="Invalid action")
+        
+        # Hold an LLM slot only while the model runs; 429s here when overloaded
+        async with ticket:
+            if request.action == "summarize":
+                result = await run_in_threadpool(legal_analyzer.summarize_document, text, doc_type)
+                return result
+                
+            elif request.action == "translate":
+                translation = await run_in_threadpool(legal_analyzer.translate_document, text, request.target_lang)
+                return {"translation": translation}
+                
+            else:
+                verification = await run_in_threadpool(legal_analyzer.verify_legality, text, doc_type)
+                return verification
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@legal_router.delete("/documents/{doc_id}")
+async def purge_document(doc_id: str, user: Optional[dict] = Depends(optional_user)):
+    """Drop the server-side copy of an uploaded document and its indexed chunks"""
+    handle = document_store.get(doc_id)
+    if handle is not None and handle.owner_id and (user is None or str(user["_id"]) != handle.owner_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    if handle is None and user is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    document_store.purge(doc_id)
+    if user:
+        # The handle may have expired while the chunks are still indexed; the store is per-user
+        await asyncio.get_running_loop().run_in_executor(None, delete_user_chunks, str(user["_id"]), doc_id)
+    return {"doc_id": doc_id, "purged": True}
+
+@legal_router.delete("/documents")
+async def purge_all_documents(user: dict = Depends(require_user)):
+    """Forget every document the user has uploaded: server-side copies and indexed chunks"""
+    user_id = str(user["_id"])
+    purged = document_store.purge_owner(user_id)
+    await asyncio.get_running_loop().run_in_executor(None, delete_user_chunks, user_id)
+    return {"purged": True, "documents": purged}
@@ -0,0 +1,231 @@
+"""
+LLM Router
+Picks which LLM backend/model serves a request from live measurements
+instead of a fixed order. Every target keeps an EWMA of its latency and
+error rate plus a window of recent latencies; requests go to the best-scoring
+healthy target, fall through to the next one on error, and (optionally) a
+hedged duplicate is sent to a target on another backend once the primary has
+run past its p95 latency. Whichever answers first wins; the loser finishes
+in the background and only updates the statistics. A hedge is only sent if
+hedge_admit grants it a spare slot on its backend, so hedging can't push a
+backend past its admission limit.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+try:
+    from .metrics import LLM_HEDGES
+except ImportError:
+    from metrics import LLM_HEDGES
+
+logger = logging.getLogger(__name__)
+
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() == "true"
+# Until a target has enough samples for a p95, hedge after this multiple of its EWMA latency
+LLM_HEDGE_LATENCY_FACTOR = float(os.getenv("LLM_HEDGE_LATENCY_FACTOR", "3"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", "16"))
+# A target failing more than this share of recent calls is skipped until cooldown passes
+LLM_UNHEALTHY_ERROR_RATE = 0.5
+LLM_UNHEALTHY_COOLDOWN = float(os.getenv("LLM_UNHEALTHY_COOLDOWN", "30"))
+# Send a request to a passed-over target this often so its estimate can recover
+LLM_REPROBE_INTERVAL = float(os.getenv("LLM_REPROBE_INTERVAL", "30"))
+_EWMA_ALPHA = 0.2
+_LATENCY_WINDOW = 100
+_MIN_P95_SAMPLES = 20
+
+
+class LLMTarget:
+    """One backend/model pair the router can send a request to"""
+
+    def __init__(
+        self,
+        backend: str,
+        model: str,
+        call: Callable[[List[Dict[str, str]], float], str],
+        prior_latency: float,
+        available: Callable[[], bool] = lambda: True,
+    ):
+        self.backend = backend
+        self.model = model
+        self.call = call
+        self.available = available
+        self.latency = prior_latency
+        self.error_rate = 0.0
+        self.samples = 0
+        self.last_failure = 0.0
+        self.last_used = 0.0
+        self._recent: deque = deque(maxlen=_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self.backend}:{self.model}"
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self.samples += 1
+            self.error_rate += _EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.latency += _EWMA_ALPHA * (seconds - self.latency)
+                self._recent.append(seconds)
+            else:
+                self.last_failure = time.monotonic()
+
+    def healthy(self) -> bool:
+        return (
+            self.error_rate <= LLM_UNHEALTHY_ERROR_RATE
+            or time.monotonic() - self.last_failure >= LLM_UNHEALTHY_COOLDOWN
+        )
+
+    def score(self) -> float:
+        """Expected seconds to a useful answer (lower is better)"""
+        return self.latency / max(0.05, 1.0 - self.error_rate)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._recent) < _MIN_P95_SAMPLES:
+                return None
+            ordered = sorted(self._recent)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self) -> Dict:
+        return {
+            "latency": round(self.latency, 3),
+            "error_rate": round(self.error_rate, 3),
+            "p95": self.p95(),
+            "samples": self.samples,
+            "healthy": self.healthy(),
+        }
+
+
+class LLMRouter:
+    """Latency-aware target selection with fallback and hedged requests"""
+
+    def __init__(
+        self,
+        targets: List[LLMTarget],
+        hedging: bool = LLM_HEDGING,
+        reprobe_interval: float = LLM_REPROBE_INTERVAL,
+        workers: int = LLM_ROUTER_WORKERS,
+        hedge_admit: Callable[[str], bool] = lambda backend: True,
+        hedge_release: Callable[[str], None] = lambda backend: None,
+    ):
+        self.targets = targets
+        self.hedging = hedging
+        self.reprobe_interval = reprobe_interval
+        # Claim/return a slot on a backend for a hedged duplicate (claim must not wait)
+        self.hedge_admit = hedge_admit
+        self.hedge_release = hedge_release
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-router")
+
+    def ranked(self) -> List[LLMTarget]:
+        """Available targets, healthy ones first, each group by score"""
+        available = [t for t in self.targets if t.available()]
+        return sorted(available, key=lambda t: (not t.healthy(), t.score()))
+
+    def hedge_delay(self, target: LLMTarget) -> float:
+        p95 = target.p95()
+        return max(LLM_HEDGE_MIN_DELAY, p95 if p95 is not None else LLM_HEDGE_LATENCY_FACTOR * target.latency)
+
+    def _run(self, target: LLMTarget, messages: List[Dict[str, str]], temperature: float) -> str:
+        start = time.perf_counter()
+        try:
+            result = target.call(messages, temperature)
+        except Exception:
+            target.record(time.perf_counter() - start, ok=False)
+            raise
+        target.record(time.perf_counter() - start, ok=True)
+        return result
+
+    def _claim_hedge(self, primary: LLMTarget, candidates: List[LLMTarget]) -> Optional[LLMTarget]:
+        """First candidate on another backend that has a spare slot (the slot is then held)"""
+        refused = set()
+        for target in candidates:
+            if target.backend == primary.backend or target.backend in refused:
+                continue
+            if self.hedge_admit(target.backend):
+                return target
+            refused.add(target.backend)
+        if refused:
+            LLM_HEDGES.inc(outcome="skipped")
+        return None
+
+    def generate(self, messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
+        """
+        Answer from the first target to succeed
+
+        Raises:
+            The last target's error if every target failed.
+        """
+        candidates = self.ranked()
+        if not candidates:
+            raise RuntimeError("No LLM backend is available")
+        now = time.monotonic()
+        stale = next(
+            (t for t in candidates[1:] if t.healthy() and now - t.last_used >= self.reprobe_interval), None
+        )
+        if stale is not None:
+            # One slow answer shouldn't bench a target forever
+            candidates.remove(stale)
+            candidates.insert(0, stale)
+
+        launched: Dict[Future, LLMTarget] = {}
+
+        def launch(target: LLMTarget) -> Future:
+            target.last_used = time.monotonic()
+            # Run in a copy of the caller's context so the backend's spans nest under the request
+            future = self._executor.submit(contextvars.copy_context().run, self._run, target, messages, temperature)
+            launched[future] = target
+            return future
+
+        primary = candidates.pop(0)
+        pending = {launch(primary)}
+        hedge_at = time.perf_counter() + self.hedge_delay(primary)
+        hedged = not self.hedging
+        hedge: Optional[LLMTarget] = None
+        last_error: Optional[BaseException] = None
+
+        while pending:
+            timeout = None if hedged else max(0.0, hedge_at - time.perf_counter())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Primary is past its usual latency: race it against another backend
+                hedged = True
+                hedge = self._claim_hedge(primary, candidates)
+                if hedge is not None:
+                    candidates.remove(hedge)
+                    LLM_HEDGES.inc(outcome="fired")
+                    logger.info(f"Hedging {primary.name} with {hedge.name}")
+                    future = launch(hedge)
+                    future.add_done_callback(lambda _, backend=hedge.backend: self.hedge_release(backend))
+                    pending.add(future)
+                continue
+
+            for future in done:
+                target = launched[future]
+                error = future.exception()
+                if error is None:
+                    if hedge is not None:
+                        LLM_HEDGES.inc(outcome="won" if target is hedge else "lost")
+                    return future.result()
+                last_error = error
+                logger.warning(f"LLM target {target.name} failed: {error}")
+
+            if not pending and candidates:
+                # Everything in flight failed: fall through to the next target
+                hedged = True
+                pending.add(launch(candidates.pop(0)))
+
+        raise last_error or RuntimeError("All LLM backends failed")
+
+    def stats(self) -> Dict:
+        return {target.name: target.stats() for target in self.targets}
@@ -1,9 +1,15 @@
 import os
+import asyncio
 import logging
+import threading
+import time
 from typing import List, Dict, Optional
 import requests
 import google.generativeai as genai
 from dotenv import load_dotenv
+from tracing import trace_function, current_span
+from metrics import LLM_REQUESTS, LLM_LATENCY, OLLAMA_MODEL_LOADED
+from llm_router import LLMRouter, LLMTarget
 
 # Ensure environment variables are loaded
 load_dotenv()
@@ -13,8 +19,17 @@ logger = logging.getLogger(__name__)
 # Configuration
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "lawman-legal")
-def _build_ollama_url(path: str) -> str:
-    base = OLLAMA_BASE_URL.rstrip("/")
+# How long Ollama keeps the model in memory after a request (Ollama duration string, "-1" = forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+OLLAMA_PROBE_INTERVAL = float(os.getenv("OLLAMA_PROBE_INTERVAL", "30"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_LOAD_TIMEOUT = float(os.getenv("OLLAMA_LOAD_TIMEOUT", "300"))
+# Router's latency guesses (seconds) for backends it hasn't timed yet
+GEMINI_PRIOR_LATENCY = float(os.getenv("GEMINI_PRIOR_LATENCY", "2"))
+OLLAMA_PRIOR_LATENCY = float(os.getenv("OLLAMA_PRIOR_LATENCY", "8"))
+def _build_ollama_url(path: str, base_url: Optional[str] = None) -> str:
+    base = (base_url or OLLAMA_BASE_URL).rstrip("/")
     if not path.startswith("/"):
         path = "/" + path
     return base + path
@@ -23,46 +38,89 @@ def get_google_api_key():
     """Dynamically fetch the Google API key from environment variables."""
     return os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
 
+
+GEMINI_MODELS = [
+    m.strip()
+    for m in os.getenv(
+        "GEMINI_MODELS", "gemini-1.5-flash,gemini-flash-latest,gemini-2.0-flash,gemini-pro-latest,gemini-pro"
+    ).split(",")
+    if m.strip()
+]
+
+def _split_messages(messages: List[Dict[str, str]]):
+    """
+    (system instruction, contents) in Gemini's terms: every system message
+    (e.g. the prompt and a conversation summary) merged in order, and the
+    other turns as user/model contents, consecutive same-role turns joined
+    since Gemini expects the roles to alternate.
+    """
+    system_parts = []
+    contents: List[Dict] = []
+    for msg in messages:
+        if msg["role"] == "system":
+            system_parts.append(msg["content"])
+            continue
+        role = "model" if msg["role"] == "assistant" else "user"
+        if contents and contents[-1]["role"] == role:
+            contents[-1]["parts"].append(msg["content"])
+        else:
+            contents.append({"role": role, "parts": [msg["content"]]})
+    return "\n\n".join(system_parts), contents
+
+def _ends_with_user_turn(contents: List[Dict]) -> bool:
+    return bool(contents) and contents[-1]["role"] == "user"
+
+@trace_function(name="llm.gemini_model")
+def gemini_generate(messages: List[Dict[str, str]], model_name: str, temperature: float = 0.2) -> str:
+    """Call one Gemini model"""
+    api_key = get_google_api_key()
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY is missing")
+    genai.configure(api_key=api_key)
+    
+    system_instruction, contents = _split_messages(messages)
+    if not _ends_with_user_turn(contents):
+        raise ValueError("No user message provided")
+
+    start = time.perf_counter()
+    try:
+        logger.info(f"Trying Gemini model: {model_name}")
+        span = current_span()
+        if span is not None:
+            span.set_attribute("llm.model", model_name)
+        if system_instruction:
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+        else:
+            model = genai.GenerativeModel(model_name)
+        
+        response = model.generate_content(
+            contents,
+            generation_config=genai.types.GenerationConfig(
+                temperature=temperature,
+            )
+        )
+        LLM_LATENCY.observe(time.perf_counter() - start, backend="gemini", model=model_name)
+        LLM_REQUESTS.inc(backend="gemini", model=model_name, outcome="success")
+        return response.text
+    except Exception:
+        LLM_LATENCY.observe(time.perf_counter() - start, backend="gemini", model=model_name)
+        LLM_REQUESTS.inc(backend="gemini", model=model_name, outcome="error")
+        raise
+
+@trace_function(name="llm.gemini")
 def chat_with_gemini(messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
-    """Call Google Gemini API"""
+    """Call Google Gemini API, trying each model in GEMINI_MODELS in turn"""
     try:
-        api_key = get_google_api_key()
-        if not api_key:
+        if not get_google_api_key():
             raise ValueError("GOOGLE_API_KEY is missing")
-            
-        genai.configure(api_key=api_key)
-        
-        # Try different model names in case one is not available in the region/key
-        model_names = ['gemini-1.5-flash', 'gemini-flash-latest', 'gemini-2.0-flash', 'gemini-pro-latest', 'gemini-pro']
-        last_err = None
-        
-        # Convert messages to Gemini format
-        system_instruction = ""
-        last_user_msg = ""
-        for msg in messages:
-            if msg["role"] == "system":
-                system_instruction = msg["content"]
-            elif msg["role"] == "user":
-                last_user_msg = msg["content"]
-
-        if not last_user_msg:
+        if not _ends_with_user_turn(_split_messages(messages)[1]):
             return "Error: No user message provided."
 
-        for model_name in model_names:
+        # Try different model names in case one is not available in the region/key
+        last_err = None
+        for model_name in GEMINI_MODELS:
             try:
-                logger.info(f"Trying Gemini model: {model_name}")
-                if system_instruction:
-                    model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
-                else:
-                    model = genai.GenerativeModel(model_name)
-                
-                response = model.generate_content(
-                    last_user_msg,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=temperature,
-                    )
-                )
-                return response.text
+                return gemini_generate(messages, model_name, temperature=temperature)
             except Exception as e:
                 last_err = e
                 logger.warning(f"Model {model_name} failed: {e}")
@@ -74,38 +132,229 @@ def chat_with_gemini(messages: List[Dict[str, str]], temperature: float = 0.2) -
         logger.error(f"Gemini API request failed: {e}")
         raise e
 
+@trace_function(name="llm.ollama")
 def chat_with_ollama(
     messages: List[Dict[str, str]],
     model: Optional[str] = None,
     temperature: float = 0.2,
     max_tokens: int = 1024,
+    base_url: Optional[str] = None,
 ) -> str:
-    """Call local Ollama chat API"""
+    """Call local Ollama chat API (base_url overrides OLLAMA_BASE_URL)"""
+    model_name = model or OLLAMA_MODEL
     payload = {
-        "model": model or OLLAMA_MODEL,
+        "model": model_name,
         "messages": messages,
         "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "temperature": temperature,
             "num_predict": max_tokens,
         },
     }
 
+    if base_url is None:
+        try:
+            ollama_monitor.check(model_name)
+        except OllamaUnavailable:
+            LLM_REQUESTS.inc(backend="ollama", model=model_name, outcome="unavailable")
+            raise
+
+    start = time.perf_counter()
     try:
         resp = requests.post(
-            _build_ollama_url("/api/chat"), json=payload, timeout=120
+            _build_ollama_url("/api/chat", base_url), json=payload, timeout=(OLLAMA_CONNECT_TIMEOUT, 120)
         )
         resp.raise_for_status()
         data = resp.json()
+        LLM_LATENCY.observe(time.perf_counter() - start, backend="ollama", model=model_name)
+        LLM_REQUESTS.inc(backend="ollama", model=model_name, outcome="success")
         message = data.get("message") or {}
         content = message.get("content")
         if isinstance(content, str):
             return content
         return ""
     except Exception as e:
+        LLM_LATENCY.observe(time.perf_counter() - start, backend="ollama", model=model_name)
+        LLM_REQUESTS.inc(backend="ollama", model=model_name, outcome="error")
         logger.error(f"Ollama chat request failed: {e}")
         raise e
 
+class OllamaUnavailable(RuntimeError):
+    """Ollama can't serve the model right now (down, not pulled, or not loaded)"""
+
+
+def _model_tag(name: str) -> str:
+    """Ollama reports models as name:tag; a bare name means :latest"""
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaMonitor:
+    """
+    Keeps OLLAMA_MODEL warm and knows whether Ollama can serve it. Preloads
+    the model at startup, then probes /api/tags (server up, model pulled) and
+    /api/ps (model resident) every OLLAMA_PROBE_INTERVAL seconds, so
+    chat_with_ollama can fail in milliseconds instead of waiting out its
+    timeout, and reloads the model in the background if it was evicted.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, model: Optional[str] = None):
+        self.base_url = base_url
+        self.model = model or OLLAMA_MODEL
+        self.reachable = False
+        self.installed: set = set()
+        self.loaded: set = set()
+        self.last_probe: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._preloading: set = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def probe(self) -> Dict:
+        """Refresh server/model state from /api/tags and /api/ps"""
+        try:
+            tags = requests.get(_build_ollama_url("/api/tags", self.base_url), timeout=OLLAMA_CONNECT_TIMEOUT)
+            tags.raise_for_status()
+            ps = requests.get(_build_ollama_url("/api/ps", self.base_url), timeout=OLLAMA_CONNECT_TIMEOUT)
+            ps.raise_for_status()
+            installed = {m.get("name", "") for m in tags.json().get("models", [])}
+            loaded = {m.get("name", "") for m in ps.json().get("models", [])}
+            with self._lock:
+                self.reachable, self.installed, self.loaded = True, installed, loaded
+                self.last_error = None
+        except Exception as e:
+            with self._lock:
+                if self.reachable or self.last_probe is None:
+                    logger.warning(f"Ollama health probe failed: {e}")
+                self.reachable, self.loaded = False, set()
+                self.last_error = str(e)
+        with self._lock:
+            self.last_probe = time.monotonic()
+        OLLAMA_MODEL_LOADED.set(1 if _model_tag(self.model) in self.loaded else 0, model=self.model)
+        return self.status()
+
+    def preload(self, model: Optional[str] = None) -> bool:
+        """Load a model into memory with OLLAMA_KEEP_ALIVE (an empty generate request)"""
+        model_name = model or self.model
+        try:
+            resp = requests.post(
+                _build_ollama_url("/api/generate", self.base_url),
+                json={"model": model_name, "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_LOAD_TIMEOUT),
+            )
+            resp.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Preloading Ollama model {model_name} failed: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._preloading.discard(model_name)
+        with self._lock:
+            self.loaded.add(_model_tag(model_name))
+        if model_name == self.model:
+            OLLAMA_MODEL_LOADED.set(1, model=self.model)
+        logger.info(f"Ollama model {model_name} loaded (keep_alive={OLLAMA_KEEP_ALIVE})")
+        return True
+
+    def _preload_in_background(self, model: str):
+        with self._lock:
+            if model in self._preloading:
+                return
+            self._preloading.add(model)
+        threading.Thread(target=self.preload, args=(model,), name="ollama-preload", daemon=True).start()
+
+    def check(self, model: Optional[str] = None):
+        """
+        Raise OllamaUnavailable unless the last probe says model can answer now.
+        Before the first probe nothing is known, so the call is allowed.
+        """
+        model_name = model or self.model
+        with self._lock:
+            if self.last_probe is None:
+                return
+            reachable = self.reachable
+            installed = _model_tag(model_name) in self.installed
+            loaded = _model_tag(model_name) in self.loaded
+        if not reachable:
+            raise OllamaUnavailable(f"Ollama is unreachable: {self.last_error}")
+        if not installed:
+            raise OllamaUnavailable(f"Ollama model {model_name} is not pulled")
+        if not loaded:
+            self._preload_in_background(model_name)
+            raise OllamaUnavailable(f"Ollama model {model_name} is not loaded yet; loading it now")
+
+    def available(self) -> bool:
+        try:
+            self.check()
+        except OllamaUnavailable:
+            return False
+        return True
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.model,
+                "reachable": self.reachable,
+                "installed": _model_tag(self.model) in self.installed,
+                "loaded": _model_tag(self.model) in self.loaded,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "last_error": self.last_error,
+            }
+
+    async def _probe_loop(self):
+        loop = asyncio.get_running_loop()
+        if OLLAMA_PRELOAD:
+            await loop.run_in_executor(None, self.preload)
+        while True:
+            await loop.run_in_executor(None, self.probe)
+            await asyncio.sleep(OLLAMA_PROBE_INTERVAL)
+
+    def start(self):
+        """Preload the model and start health probes (call from app startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ollama_monitor = OllamaMonitor()
+
+def _gemini_target(model_name: str, rank: int) -> LLMTarget:
+    return LLMTarget(
+        "gemini",
+        model_name,
+        lambda messages, temperature: gemini_generate(messages, model_name, temperature=temperature),
+        # Untried models keep their GEMINI_MODELS order, all ahead of local Ollama
+        prior_latency=GEMINI_PRIOR_LATENCY + 0.1 * rank,
+        available=lambda: bool(get_google_api_key()),
+    )
+
+llm_router = LLMRouter(
+    [_gemini_target(model_name, rank) for rank, model_name in enumerate(GEMINI_MODELS)]
+    + [
+        LLMTarget(
+            "ollama",
+            OLLAMA_MODEL,
+            lambda messages, temperature: chat_with_ollama(messages, temperature=temperature),
+            prior_latency=OLLAMA_PRIOR_LATENCY,
+            available=ollama_monitor.available,
+        )
+    ]
+)
+
+def primary_backend() -> str:
+    """The backend generate_with_context will try first"""
+    ranked = llm_router.ranked()
+    return ranked[0].backend if ranked else "ollama"
+
+@trace_function(name="llm.generate")
 def generate_with_context(system_prompt: str, user_prompt: str, temperature: float = 0.2) -> str:
     """Convenience wrapper for single-turn question answering."""
     messages = [
@@ -115,17 +364,9 @@ def generate_with_context(system_prompt: str, user_prompt: str, temperature: flo
     
     api_key = get_google_api_key()
     
-    # 1. Try Gemini first if API key is present
-    if api_key:
-        try:
-            return chat_with_gemini(messages, temperature=temperature)
-        except Exception as e:
-            logger.warning(f"Gemini failed: {e}. Falling back to Ollama...")
-    
-    # 2. Fallback to Ollama
+    # The router picks the fastest healthy backend, hedging and falling back as needed
     try:
-        logger.info(f"Attempting to use Ollama at {OLLAMA_BASE_URL}...")
-        return chat_with_ollama(messages, temperature=temperature)
+        return llm_router.generate(messages, temperature=temperature)
     except Exception as e:
         logger.error(f"All LLM providers failed. Last error: {e}")
         if not api_key:
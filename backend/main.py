@@ -1,35 +1,68 @@
 from dotenv import load_dotenv
 load_dotenv()
-from fastapi import FastAPI, Request, UploadFile, File, Query, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Query, Header, HTTPException, Depends
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import os
 from pydantic import BaseModel, EmailStr
-import smtplib
-from email.mime.text import MIMEText
-import sqlite3
 import logging
+import time
 
 # Standard imports for Docker/Gunicorn execution
-from doc_parser import parse_and_chunk
-from embed_store import add_chunks_to_db
-from auth_mongo import auth_router
-from legal_api import legal_router
+from embed_store import search_chunks, has_user_chunks
+from auth_mongo import auth_router, optional_user, require_user
+from usage_tracker import QuotaLease, get_usage_stats, optional_upload_quota, question_quota, upload_quota
+from admission import AdmissionTicket, llm_admission_ticket
+from user_memory_store import MEMORY_PROMPT_TOKENS, conversation_memory
+from chat_engine_rag import answer_follow_up, answer_query_with_rag
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from legal_api import AnalysisRequest, analyze_document, legal_router, upload_document
 from contact_service import contact_router
 from payment_api import payment_router
+from tracing import span, get_recent_spans, traces_access_allowed
+from responses import CompressionMiddleware, FastJSONResponse
+from metrics import HTTP_REQUESTS, HTTP_LATENCY, HTTP_IN_PROGRESS, render_metrics, router_for_path
 
-app = FastAPI(title="SPECTER Legal Assistant API", version="1.0.0")
+app = FastAPI(title="SPECTER Legal Assistant API", version="1.0.0", default_response_class=FastJSONResponse)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database connection on startup"""
-    from mongodb_config import connect_to_mongo
+    from mongodb_config import connect_to_mongo, create_indexes
+    from user_memory_store import conversation_memory
+    from usage_tracker import usage_aggregator
+    from email_dispatcher import email_dispatcher
+    from token_validator import denylist
+    from local_llm import ollama_monitor
+    from embed_store import chunk_retention
     await connect_to_mongo()
+    await create_indexes()
+    await denylist.start()
+    conversation_memory.start()
+    usage_aggregator.start()
+    email_dispatcher.start()
+    ollama_monitor.start()
+    chunk_retention.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close database connection on shutdown"""
     from mongodb_config import close_mongo_connection
+    from user_memory_store import conversation_memory
+    from usage_tracker import usage_aggregator
+    from email_dispatcher import email_dispatcher
+    from token_validator import denylist
+    from local_llm import ollama_monitor
+    from embed_store import chunk_retention
+    await ollama_monitor.stop()
+    await chunk_retention.stop()
+    await denylist.stop()
+    await conversation_memory.stop()
+    await usage_aggregator.stop()
+    await email_dispatcher.stop()
     await close_mongo_connection()
 
 # Configure CORS
@@ -41,24 +74,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Extracted document text and translations can be hundreds of KB
+app.add_middleware(CompressionMiddleware)
+
+# Trace every request as a root span (handlers, LLM and Mongo calls nest under it)
+# and record per-router request counts and latency
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    router = router_for_path(request.url.path)
+    HTTP_IN_PROGRESS.inc(router=router)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        with span(f"{request.method} {request.url.path}", **{"http.method": request.method, "http.route": request.url.path}) as request_span:
+            response = await call_next(request)
+            status_code = response.status_code
+            request_span.set_attribute("http.status_code", status_code)
+            return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        matched = request.scope.get("route")
+        route = getattr(matched, "path", None) or "unmatched"
+        HTTP_IN_PROGRESS.dec(router=router)
+        HTTP_REQUESTS.inc(router=router, method=request.method, route=route, status=str(status_code))
+        HTTP_LATENCY.observe(time.perf_counter() - start, router=router, method=request.method, route=route)
+
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["authentication"])
 app.include_router(legal_router, prefix="/legal", tags=["legal"])
 app.include_router(contact_router, prefix="/api", tags=["contact"])
 app.include_router(payment_router, prefix="/payment", tags=["payment"])
 
+# HTTP errors carry the message under both keys: FastAPI clients read
+# "detail", the chat/upload UI reads "error"
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request: Request, exc: StarletteHTTPException):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail, "error": exc.detail},
+        headers=getattr(exc, "headers", None)
+    )
+
 # Fallback routes for document analysis (to support older frontend versions)
 @app.post("/upload_doc")
-async def upload_doc_fallback(request: Request, file: UploadFile = File(...)):
-    from legal_api import upload_document
-    return await upload_document(request, file)
+async def upload_doc_fallback(file: UploadFile = File(...), quota: Optional[QuotaLease] = Depends(optional_upload_quota)):
+    return await upload_document(file, quota)
 
 @app.post("/analyze_doc")
-async def analyze_doc_fallback(request: Request):
-    from legal_api import analyze_document, AnalysisRequest
+async def analyze_doc_fallback(
+    request: Request,
+    user: Optional[dict] = Depends(optional_user),
+    ticket: AdmissionTicket = Depends(llm_admission_ticket),
+):
     data = await request.json()
     analysis_request = AnalysisRequest(**data)
-    return await analyze_document(analysis_request)
+    return await analyze_document(analysis_request, user, ticket)
 
 
 
@@ -69,45 +139,38 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    from local_llm import get_google_api_key
+    from local_llm import get_google_api_key, ollama_monitor
     api_key = get_google_api_key()
     return {
         "status": "healthy",
         "google_api_key_detected": api_key is not None and len(api_key) > 0,
+        "ollama": ollama_monitor.status(),
         "env_keys": [k for k in os.environ.keys() if "API" in k or "KEY" in k or "URL" in k or "MONGODB" in k]
     }
 
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Recent spans from the in-process ring buffer (local debugging only)
+@app.get("/traces")
+async def get_traces(
+    limit: int = Query(200, le=2000),
+    trace_id: str = None,
+    min_duration_ms: float = 0.0,
+    x_traces_token: Optional[str] = Header(None),
+):
+    # Behind a proxy every caller looks local, so require the shared token instead of checking the address
+    if not traces_access_allowed(x_traces_token):
+        raise HTTPException(status_code=403, detail="Traces require a valid X-Traces-Token")
+    return {"spans": get_recent_spans(limit=limit, trace_id=trace_id, min_duration_ms=min_duration_ms)}
+
 # Usage stats endpoint
 @app.get("/usage")
-async def get_usage(request: Request):
+async def get_usage(user: dict = Depends(require_user)):
     try:
-        from auth_mongo import get_current_user
-        from usage_tracker import get_usage_stats
-        from fastapi.security import HTTPAuthorizationCredentials
-        
-        # Get authorization header
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return JSONResponse(
-                status_code=401,
-                content={"error": "Authentication required"}
-            )
-        
-        # Get current user
-        token = auth_header.replace("Bearer ", "")
-        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
-        user = await get_current_user(credentials)
-        
-        # Get usage stats
-        stats = await get_usage_stats(user)
-        
-        return stats
-        
-    except HTTPException as he:
-        return JSONResponse(
-            status_code=he.status_code,
-            content={"error": he.detail}
-        )
+        return await get_usage_stats(user)
     except Exception as e:
         logging.error(f"Usage stats error: {e}")
         return JSONResponse(
@@ -116,56 +179,60 @@ async def get_usage(request: Request):
         )
 
 
-# Basic chat endpoint
+# Basic chat endpoint (the question is counted atomically by the quota dependency)
 @app.post("/chat")
-async def chat_endpoint(request: Request):
+async def chat_endpoint(
+    request: Request,
+    quota: QuotaLease = Depends(question_quota),
+    ticket: AdmissionTicket = Depends(llm_admission_ticket),
+):
+    user_id = str(quota.user["_id"])
     try:
-        from auth_mongo import get_current_user
-        from usage_tracker import enforce_question_limit, increment_question_count
-        from fastapi.security import HTTPAuthorizationCredentials
-        
         data = await request.json()
         user_message = data.get("message", "")
-        target_lang = data.get("target_lang", "english")
-        
-        # Get authorization header
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return JSONResponse(
-                status_code=401,
-                content={"error": "Authentication required"}
-            )
-        
-        # Get current user
-        token = auth_header.replace("Bearer ", "")
-        from fastapi.security import HTTPAuthorizationCredentials
-        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
-        user = await get_current_user(credentials)
-        
-        # Check usage limits
-        await enforce_question_limit(user)
         
         if not user_message.strip():
+            await quota.release()
             return JSONResponse(
                 status_code=400,
                 content={"error": "Message cannot be empty"}
             )
         
+        # Load conversation memory so follow-ups have context
+        await conversation_memory.load(user_id)
+        history = conversation_memory.get_history(user_id, max_tokens=MEMORY_PROMPT_TOKENS)
+        
         # Use the Vector RAG system for semantic search
-        from chat_engine_rag import answer_query_with_rag
-        response = answer_query_with_rag(user_message, user_id=str(user["_id"]))
+        response = answer_query_with_rag(user_message, user_id=user_id, history=history)
+        if history and not response.get("sources"):
+            # Nothing in the knowledge base matched, not even fuzzily: only then is a follow-up
+            # worth an LLM call (and an admission slot), answered with the conversation in the prompt
+            async with ticket:
+                follow_up = await run_in_threadpool(answer_follow_up, user_message, history)
+            if follow_up:
+                response = follow_up
+        
+        conversation_memory.append(user_id, "user", user_message)
+        conversation_memory.append(user_id, "assistant", response.get("answer", ""))
         
-        # Increment usage count
-        await increment_question_count(str(user["_id"]))
+        # Optionally search the user's previously uploaded documents
+        if data.get("search_documents") and has_user_chunks(user_id):
+            matches = await asyncio.get_running_loop().run_in_executor(
+                None, search_chunks, user_message, user_id, 3, data.get("doc_id")
+            )
+            response["document_matches"] = matches
         
         return response
         
     except HTTPException as he:
+        await quota.release()
         return JSONResponse(
             status_code=he.status_code,
             content={"error": he.detail}
         )
     except Exception as e:
+        # Don't charge for a question we failed to answer
+        await quota.release()
         logging.error(f"Chat endpoint error: {e}")
         return JSONResponse(
             status_code=500,
@@ -174,46 +241,17 @@ async def chat_endpoint(request: Request):
 
 # File upload endpoint
 @app.post("/upload")
-async def upload_file(request: Request, file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), quota: QuotaLease = Depends(upload_quota)):
     try:
-        from auth_mongo import get_current_user
-        from usage_tracker import enforce_upload_limit, increment_upload_count
-        from fastapi.security import HTTPAuthorizationCredentials
-        
-        # Get authorization header
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return JSONResponse(
-                status_code=401,
-                content={"error": "Authentication required"}
-            )
-        
-        # Get current user
-        token = auth_header.replace("Bearer ", "")
-        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
-        user = await get_current_user(credentials)
-        
-        # Check upload limits
-        await enforce_upload_limit(user)
-        
-        # Process upload
-        import os
         os.makedirs("data/processed", exist_ok=True)
         content = await file.read()
         with open(f"data/processed/{file.filename}", "wb") as f:
             f.write(content)
         
-        # Increment usage count
-        await increment_upload_count(str(user["_id"]))
-        
         return {"filename": file.filename, "status": "uploaded"}
         
-    except HTTPException as he:
-        return JSONResponse(
-            status_code=he.status_code,
-            content={"error": he.detail}
-        )
     except Exception as e:
+        await quota.release()
         logging.error(f"Upload endpoint error: {e}")
         return JSONResponse(
             status_code=500,
@@ -228,14 +266,12 @@ class LawyerContactRequest(BaseModel):
     description: str = ''
 
 @app.post('/contact-lawyer')
-def contact_lawyer(request: LawyerContactRequest):
-    smtp_user = os.getenv('LAWYER_SMTP_USER')
-    smtp_pass = os.getenv('LAWYER_SMTP_PASS')
+async def contact_lawyer(request: LawyerContactRequest):
+    from email_dispatcher import SMTPConfig, email_dispatcher
+    smtp_config = SMTPConfig.from_env('LAWYER_SMTP_')
     smtp_to = os.getenv('LAWYER_RECEIVER_EMAIL')
-    smtp_host = os.getenv('LAWYER_SMTP_HOST', 'smtp.gmail.com')
-    smtp_port = int(os.getenv('LAWYER_SMTP_PORT', '587'))
     
-    if not (smtp_user and smtp_pass and smtp_to):
+    if not (smtp_config.user and smtp_config.password and smtp_to):
         return {"status": "error", "message": "Email credentials not set in .env"}
     
     subject = f"New SPECTER Contact Request: {request.caseType}"
@@ -247,19 +283,9 @@ Case Type: {request.caseType}
 Description: {request.description}
 """
     
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = smtp_user
-    msg['To'] = smtp_to
-    
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_pass)
-            server.sendmail(smtp_user, smtp_to, msg.as_string())
+    if email_dispatcher.enqueue(smtp_config, smtp_to, subject, body):
         return {"status": "success", "message": "Request sent to lawyer network."}
-    except Exception as e:
-        return {"status": "error", "message": f"Failed to send email: {e}"}
+    return {"status": "error", "message": "Failed to send email: mail queue unavailable"}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,216 @@
+"""
+Metrics
+Counters, gauges and fixed-bucket histograms that are cheap to update on the
+hot path, rendered in the Prometheus text exposition format for /metrics.
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from fast DB lookups up to long LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self._samples())
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect plus two additions"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[key] = state
+            state[0][index] += 1
+            state[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """All registered metrics in Prometheus text format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "".join(metric.render() for metric in metrics)
+
+
+# ---------------------------------------------------------------------------
+# Application metrics
+# ---------------------------------------------------------------------------
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by router, route and status", ("router", "method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by router and route", ("router", "method", "route")
+)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests currently being served", ("router",))
+
+LLM_REQUESTS = Counter(
+    "llm_requests_total", "LLM calls by backend, model and outcome", ("backend", "model", "outcome")
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds", "LLM call latency by backend and model", ("backend", "model")
+)
+
+DOCUMENT_EXTRACT_LATENCY = Histogram(
+    "document_extract_duration_seconds", "Text extraction time by file type", ("ext",)
+)
+OCR_LATENCY = Histogram(
+    "ocr_duration_seconds", "Tesseract OCR time by source", ("source",)
+)
+
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify time including pool wait", ("op",)
+)
+
+EMAILS = Counter("emails_total", "Outgoing emails by outcome", ("outcome",))
+
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections", "MongoDB pool connections by state (open, in_use)", ("client", "address", "state")
+)
+MONGO_POOL_MAX_SIZE = Gauge("mongo_pool_max_size", "Configured MongoDB pool size", ("client", "address"))
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total", "Failed MongoDB connection checkouts by reason", ("client", "reason")
+)
+
+LLM_ADMISSIONS = Counter(
+    "llm_admissions_total", "LLM admission decisions by backend and outcome", ("backend", "outcome")
+)
+LLM_QUEUE_TIME = Histogram(
+    "llm_admission_queue_seconds", "Time spent queued for an LLM slot", ("backend", "plan")
+)
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "LLM slots in use by backend", ("backend",))
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "Requests waiting for an LLM slot by backend", ("backend",))
+
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Hedged LLM requests (fired, won, lost, skipped)", ("outcome",))
+
+OLLAMA_MODEL_LOADED = Gauge("ollama_model_loaded", "1 if the Ollama model is resident in memory", ("model",))
+
+TRACE_SPANS_DROPPED = Counter(
+    "trace_spans_dropped_total", "Finished spans not exported over OTLP by reason", ("reason",)
+)
+
+_ROUTER_PREFIXES = (("/auth", "auth"), ("/legal", "legal"), ("/payment", "payment"), ("/api", "api"))
+
+
+def router_for_path(path: str) -> str:
+    """Map a request path to the router that serves it"""
+    for prefix, router in _ROUTER_PREFIXES:
+        if path == prefix or path.startswith(prefix + "/"):
+            return router
+    return "app"
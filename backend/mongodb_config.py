@@ -1,30 +1,123 @@
 import os
+import threading
+from urllib.parse import parse_qs, urlsplit
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
-import asyncio
-from typing import Optional
+from pymongo import ASCENDING, DESCENDING, TEXT, MongoClient, monitoring
+from pymongo.errors import ConnectionFailure, OperationFailure
+from typing import Dict, List, Optional
+
+try:
+    from .metrics import MONGO_POOL_CONNECTIONS, MONGO_POOL_CHECKOUT_FAILURES, MONGO_POOL_MAX_SIZE
+except ImportError:
+    from metrics import MONGO_POOL_CONNECTIONS, MONGO_POOL_CHECKOUT_FAILURES, MONGO_POOL_MAX_SIZE
 
 # MongoDB Configuration
 MONGODB_URL = os.getenv("MONGODB_URI") or os.getenv("MONGODB_URL") or os.getenv("MONGO_URL") or "mongodb://localhost:27017"
 DATABASE_NAME = os.getenv("DATABASE_NAME", "specter_legal")
 
+# Connection pool settings (options in MONGODB_URL take precedence)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+# zlib ships with Python; add snappy/zstd here if python-snappy/zstandard are installed
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+
 # Global variables for database connections
 mongo_client: Optional[AsyncIOMotorClient] = None
 database = None
+_sync_client: Optional[MongoClient] = None
+_sync_client_lock = threading.Lock()
+
+
+class _PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Mirror connection pool events into the /metrics gauges"""
+
+    def __init__(self, client_name: str):
+        self.client_name = client_name
+
+    def _labels(self, event, state: str) -> Dict[str, str]:
+        return {"client": self.client_name, "address": "%s:%s" % event.address, "state": state}
+
+    def pool_created(self, event):
+        MONGO_POOL_MAX_SIZE.set(event.options.get("maxPoolSize", MONGO_MAX_POOL_SIZE),
+                                client=self.client_name, address="%s:%s" % event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc(**self._labels(event, "open"))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec(**self._labels(event, "open"))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.inc(client=self.client_name, reason=str(event.reason))
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CONNECTIONS.inc(**self._labels(event, "in_use"))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CONNECTIONS.dec(**self._labels(event, "in_use"))
+
+
+def _uri_option_names(url: str) -> set:
+    """Lower-cased option names given in a connection string's query"""
+    return {name.lower() for name in parse_qs(urlsplit(url).query)}
+
+
+def _client_options(client_name: str) -> Dict:
+    """Pool options from the environment, minus any the connection string sets itself"""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "compressors": MONGO_COMPRESSORS,
+        "appname": f"specter-backend-{client_name}",
+        "event_listeners": [_PoolMetricsListener(client_name)],
+    }
+    # pymongo lets keyword arguments override the URI, so leave out what MONGODB_URL already sets
+    in_uri = _uri_option_names(MONGODB_URL)
+    return {name: value for name, value in options.items() if name.lower() not in in_uri}
+
 
 async def connect_to_mongo():
     """Create database connection"""
     global mongo_client, database
-    mongo_client = AsyncIOMotorClient(MONGODB_URL)
+    mongo_client = AsyncIOMotorClient(MONGODB_URL, **_client_options("async"))
     database = mongo_client[DATABASE_NAME]
-    print(f"Connected to MongoDB: {DATABASE_NAME}")
+    print(f"Connected to MongoDB: {DATABASE_NAME} (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
 
 async def close_mongo_connection():
     """Close database connection"""
-    global mongo_client
+    global _sync_client
     if mongo_client:
         mongo_client.close()
         print("Disconnected from MongoDB")
+    with _sync_client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
 
 def get_database():
     """Get database instance"""
@@ -47,35 +140,111 @@ def get_otps_collection():
     """Get OTPs collection"""
     return database.otps
 
+def get_revoked_tokens_collection():
+    """Get revoked token/session ids collection"""
+    return database.revoked_tokens
+
+def get_conversations_collection():
+    """Get conversation turns collection"""
+    return database.conversations
+
+def get_conversation_summaries_collection():
+    """Get conversation summaries collection"""
+    return database.conversation_summaries
+
+# Index definitions: collection -> list of (keys, options). Options are part of
+# the definition, so changing one (e.g. adding a TTL) replaces the old index.
+INDEXES: Dict[str, List] = {
+    "users": [
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING)], {}),
+    ],
+    "legal_acts": [
+        ([("act", ASCENDING)], {}),
+        ([("section", ASCENDING)], {}),
+        ([("title", TEXT), ("definition", TEXT), ("keywords", TEXT)], {}),
+    ],
+    "user_sessions": [
+        ([("user_id", ASCENDING)], {}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "otps": [
+        # Matches verify_otp: equality fields first, then the expires_at range
+        ([("email", ASCENDING), ("type", ASCENDING), ("otp", ASCENDING), ("expires_at", ASCENDING)], {}),
+        # TTL: MongoDB deletes each OTP once its expires_at has passed
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    # Token denylist: synced incrementally by revoked_at, pruned by TTL
+    "revoked_tokens": [
+        ([("revoked_at", ASCENDING)], {}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    # Conversation memory (history is loaded newest-first per user)
+    "conversations": [
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+    "conversation_summaries": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+}
+
+# Indexes made redundant by a compound index above; dropped at startup if present
+OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    "otps": ["email_1"],
+}
+
+# IndexOptionsConflict / IndexKeySpecsConflict: same keys or name, different options
+_INDEX_CONFLICT_CODES = (85, 86)
+
+
+async def _ensure_index(collection, keys: List, options: Dict):
+    try:
+        await collection.create_index(keys, **options)
+    except OperationFailure as e:
+        if e.code not in _INDEX_CONFLICT_CODES:
+            raise
+        # An older definition of this index exists; rebuild it with the current options
+        existing = await collection.index_information()
+        for name, info in existing.items():
+            if name != "_id_" and list(info["key"]) == [tuple(k) for k in keys]:
+                await collection.drop_index(name)
+        await collection.create_index(keys, **options)
+        print(f"Rebuilt index {keys} on {collection.name} with {options}")
+
 # Initialize collections with indexes
 async def create_indexes():
-    """Create necessary indexes for better performance"""
-    users_collection = get_users_collection()
-    legal_acts_collection = get_legal_acts_collection()
-    sessions_collection = get_user_sessions_collection()
-    otps_collection = get_otps_collection()
-    
-    # Users collection indexes
-    await users_collection.create_index("email", unique=True)
-    await users_collection.create_index("created_at")
-    
-    # Legal acts collection indexes
-    await legal_acts_collection.create_index("act")
-    await legal_acts_collection.create_index("section")
-    await legal_acts_collection.create_index([("title", "text"), ("definition", "text"), ("keywords", "text")])
-    
-    # Sessions collection indexes
-    await sessions_collection.create_index("user_id")
-    await sessions_collection.create_index("expires_at")
-    
-    # OTPs collection indexes
-    await otps_collection.create_index("email")
-    await otps_collection.create_index("expires_at")
-    
+    """Create necessary indexes; safe to run on every startup"""
+    for collection_name, specs in INDEXES.items():
+        collection = database[collection_name]
+        for keys, options in specs:
+            try:
+                await _ensure_index(collection, keys, options)
+            except ConnectionFailure as e:
+                print(f"Skipping index creation, MongoDB unreachable: {e}")
+                return
+            except Exception as e:
+                print(f"Failed to create index {keys} on {collection_name}: {e}")
+
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        try:
+            existing = await database[collection_name].index_information()
+            for name in names:
+                if name in existing:
+                    await database[collection_name].drop_index(name)
+        except ConnectionFailure as e:
+            print(f"Skipping obsolete index cleanup, MongoDB unreachable: {e}")
+            return
+        except Exception as e:
+            print(f"Failed to drop obsolete indexes {names} on {collection_name}: {e}")
+
     print("Database indexes created successfully")
 
 # Sync version for non-async operations
 def get_sync_database():
     """Get synchronous database connection for non-async operations"""
-    sync_client = MongoClient(MONGODB_URL)
-    return sync_client[DATABASE_NAME]
+    global _sync_client
+    if _sync_client is None:
+        with _sync_client_lock:
+            if _sync_client is None:
+                _sync_client = MongoClient(MONGODB_URL, **_client_options("sync"))
+    return _sync_client[DATABASE_NAME]
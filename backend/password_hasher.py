@@ -0,0 +1,90 @@
+"""
+Password Hashing
+Runs bcrypt hashing and verification on a dedicated, bounded thread pool so a
+burst of logins doesn't stall the event loop for every other request. The
+bcrypt cost is configurable; hashes made with a different cost (or with the
+deprecated pbkdf2 scheme) are reported back by verify() for a transparent
+rehash on the next successful login.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+try:
+    from .metrics import PASSWORD_HASH_LATENCY
+except ImportError:
+    from metrics import PASSWORD_HASH_LATENCY
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Jobs allowed to wait for a free worker before new ones are turned away
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+# min/max pinned to the configured cost so needs_update flags any other cost
+pwd_context = CryptContext(
+    schemes=["bcrypt", "pbkdf2_sha256"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the hashing queue is full"""
+
+
+class PasswordHasher:
+    """Async front end for passlib on a fixed-size worker pool"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def _run(self, op: str, func, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy(f"{self._pending} password hash jobs pending")
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            self.completed += 1
+            PASSWORD_HASH_LATENCY.observe(time.perf_counter() - start, op=op)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured bcrypt cost"""
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password against its stored hash
+
+        Returns:
+            (valid, new_hash) where new_hash is set when the stored hash uses an
+            outdated cost or scheme and should be replaced
+        """
+        return await self._run("verify", pwd_context.verify_and_update, password, hashed)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+        }
+
+
+password_hasher = PasswordHasher()
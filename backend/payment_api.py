@@ -12,6 +12,7 @@ try:
         SUBSCRIPTION_PLANS
     )
     from .mongodb_config import get_users_collection
+    from .user_cache import user_cache
 except ImportError:
     from auth_mongo import get_current_user
     from payment_razorpay import (
@@ -21,6 +22,7 @@ except ImportError:
         SUBSCRIPTION_PLANS
     )
     from mongodb_config import get_users_collection
+    from user_cache import user_cache
 
 payment_router = APIRouter()
 
@@ -98,6 +100,7 @@ async def verify_payment(request: PaymentVerificationRequest, current_user: dict
                 }
             }
         )
+        user_cache.invalidate(email=current_user["email"], user_id=str(current_user["_id"]))
         
         return {"status": "success", "message": "Subscription activated successfully", "subscription": subscription}
         
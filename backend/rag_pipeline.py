@@ -3,24 +3,25 @@ import re
 from collections import defaultdict
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
+from doc_parser import estimate_tokens, iter_chunks
+from embed_store import get_embedding_model
 
-# Initialize sentence transformer model for semantic search
-EMBEDDING_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
+# Sentence transformer for semantic search (the same copy embed_store uses)
+EMBEDDING_MODEL = get_embedding_model()
+
+# Share of the prompt budget (after system prompt and query) that chat history may use
+HISTORY_BUDGET_SHARE = 1 / 3
+# Per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
 
 class LegalRAGPipeline:
     def __init__(self):
         self.embedding_model = EMBEDDING_MODEL
-        self.context_window = 3000  # Max tokens for context
+        self.context_window = 3000  # Max tokens for the whole prompt (enforced by build_prompt)
         
     def _chunk_text(self, text: str, chunk_size: int = 500) -> List[str]:
-        """Split text into smaller chunks for better embedding"""
-        words = text.split()
-        chunks = []
-        for i in range(0, len(words), chunk_size):
-            chunk = ' '.join(words[i:i + chunk_size])
-            chunks.append(chunk)
-        return chunks
+        """Split text into structure-aware chunks of at most chunk_size tokens"""
+        return [chunk['text'] for chunk in iter_chunks(text, max_tokens=chunk_size)]
     
     def _get_embedding(self, text: str) -> np.ndarray:
         """Generate embedding for a given text"""
@@ -35,8 +36,8 @@ class LegalRAGPipeline:
             np.array(context_embeddings)
         )[0]
     
-    def _retrieve_relevant_context(self, query: str, context_data: Dict[str, str], top_k: int = 3) -> List[str]:
-        """Retrieve most relevant context for the query"""
+    def _rank_contexts(self, query: str, context_data: Dict[str, str], top_k: Optional[int] = 3) -> List[Dict[str, Any]]:
+        """Top-k context chunks for the query (all of them if top_k is None), most relevant first, as {key, text, score}"""
         # Generate query embedding
         query_embedding = self._get_embedding(query)
         
@@ -57,7 +58,50 @@ class LegalRAGPipeline:
         
         # Sort by similarity and get top-k
         sorted_indices = np.argsort(similarities)[::-1][:top_k]
-        return [context_chunks[i]['text'] for i in sorted_indices]
+        return [
+            {'key': context_chunks[i]['key'], 'text': context_chunks[i]['text'], 'score': float(similarities[i])}
+            for i in sorted_indices
+        ]
+    
+    def _retrieve_relevant_context(self, query: str, context_data: Dict[str, str], top_k: int = 3) -> List[str]:
+        """Retrieve most relevant context for the query"""
+        return [ctx['text'] for ctx in self._rank_contexts(query, context_data, top_k)]
+    
+    def _message_tokens(self, message: Dict[str, str]) -> int:
+        return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+    
+    def _trim_history(self, chat_history: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """
+        Newest turns that fit in budget tokens, oldest first. A leading
+        conversation summary (system message) is kept ahead of older turns.
+        """
+        summary = chat_history[0] if chat_history and chat_history[0].get("role") == "system" else None
+        turns = chat_history[1:] if summary else chat_history
+        
+        if summary is not None and self._message_tokens(summary) <= budget:
+            budget -= self._message_tokens(summary)
+        else:
+            summary = None
+        
+        kept: List[Dict[str, str]] = []
+        for turn in reversed(turns):
+            cost = self._message_tokens(turn)
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append(turn)
+        kept.reverse()
+        return ([summary] if summary else []) + kept
+    
+    def _pack_contexts(self, ranked: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+        """Most relevant contexts that fit in budget tokens; a chunk too big to fit is skipped for smaller ones"""
+        packed = []
+        for ctx in ranked:
+            cost = estimate_tokens(f"Context {len(packed) + 1}: {ctx['text']}\n\n")
+            if cost <= budget:
+                budget -= cost
+                packed.append(ctx)
+        return packed
     
     def build_prompt(
         self,
@@ -67,7 +111,10 @@ class LegalRAGPipeline:
         include_sources: bool = True
     ) -> Dict[str, Any]:
         """
-        Build an enhanced RAG prompt with relevant context
+        Build an enhanced RAG prompt with relevant context, within
+        context_window tokens: history may use up to HISTORY_BUDGET_SHARE of
+        what the system prompt and query leave, retrieved contexts fill the
+        rest by relevance.
         
         Args:
             query: User's query
@@ -78,19 +125,16 @@ class LegalRAGPipeline:
         Returns:
             Dictionary containing the prompt and metadata
         """
-        # Retrieve relevant context
-        relevant_contexts = self._retrieve_relevant_context(query, context_data)
+        # Rank every chunk; the token budget decides how many make it into the prompt
+        ranked_contexts = self._rank_contexts(query, context_data, top_k=None)
         
         # Build system message
         system_prompt = """You are SPECTER, an AI legal assistant specialized in Indian law. 
         Provide accurate, clear, and concise legal information based on the provided context. 
         If you're unsure about any information, clearly state that."""
         
-        # Format context
-        context_str = "\n\n".join([f"Context {i+1}: {ctx}" for i, ctx in enumerate(relevant_contexts)])
-        
-        # Build user message with context
-        user_message = f"""Legal Query: {query}
+        def render_user_message(context_str: str) -> str:
+            return f"""Legal Query: {query}
         
         Relevant Legal Context:
         {context_str}
@@ -98,17 +142,46 @@ class LegalRAGPipeline:
         Please provide a comprehensive and accurate response based on the above context and your knowledge of Indian law.
         """
         
+        # Budget: system prompt and query are fixed, history and contexts share what's left
+        fixed_tokens = (
+            self._message_tokens({"content": system_prompt})
+            + self._message_tokens({"content": render_user_message("")})
+        )
+        available = max(0, self.context_window - fixed_tokens)
+        history = self._trim_history(chat_history or [], int(available * HISTORY_BUDGET_SHARE))
+        history_tokens = sum(self._message_tokens(m) for m in history)
+        relevant_contexts = self._pack_contexts(ranked_contexts, available - history_tokens)
+        
+        # Format context
+        context_str = "\n\n".join([f"Context {i+1}: {ctx['text']}" for i, ctx in enumerate(relevant_contexts)])
+        
+        # Build user message with context
+        user_message = render_user_message(context_str)
+        
         # Build messages list
         messages = [
             {"role": "system", "content": system_prompt},
-            *([] if not chat_history else chat_history),
+            *history,
             {"role": "user", "content": user_message}
         ]
         
+        system_tokens = self._message_tokens(messages[0])
+        user_tokens = self._message_tokens(messages[-1])
+        
         # Prepare metadata
         metadata = {
-            "context_sources": list(context_data.keys())[:3] if include_sources else [],
+            "context_sources": list(dict.fromkeys(ctx['key'] for ctx in relevant_contexts)) if include_sources else [],
             "context_count": len(relevant_contexts),
+            "contexts_dropped": len(ranked_contexts) - len(relevant_contexts),
+            "history_messages": len(history),
+            "history_dropped": len(chat_history or []) - len(history),
+            "token_counts": {
+                "system": system_tokens,
+                "history": history_tokens,
+                "query_and_context": user_tokens,
+                "total": system_tokens + history_tokens + user_tokens,
+                "budget": self.context_window,
+            },
             "query_terms": query.lower().split(),
             "system_prompt": system_prompt
         }
@@ -0,0 +1,101 @@
+"""
+Cross-Encoder Re-ranking
+Optional second retrieval stage that re-scores the top vector-search candidates
+with a small cross-encoder, within a fixed latency budget.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from embedding_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_BATCH_SIZE = 16
+RERANK_CACHE_SIZE = 20000
+
+
+class CrossEncoderReranker:
+    """Batched cross-encoder scoring with a per-(query, candidate) score cache"""
+
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL,
+        budget_ms: float = RERANK_BUDGET_MS,
+        batch_size: int = RERANK_BATCH_SIZE,
+        cache_size: int = RERANK_CACHE_SIZE,
+    ):
+        from sentence_transformers import CrossEncoder
+
+        logger.info(f"Loading cross-encoder re-ranker: {model_name}")
+        self.model = CrossEncoder(model_name)
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.budget_exceeded = 0
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            return score
+
+    def _cache_put(self, key: Tuple[str, str], score: float):
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def score(self, pairs: List[Tuple[str, str]]) -> Optional[List[float]]:
+        """
+        Score (query, candidate) pairs, most relevant highest.
+
+        Returns None if the latency budget ran out before every pair was
+        scored; pairs scored so far stay cached for the next request.
+        """
+        self.calls += 1
+        keys = [(normalize_query(query), candidate) for query, candidate in pairs]
+        scores: List[Optional[float]] = [self._cache_get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        start = time.perf_counter()
+        for offset in range(0, len(missing), self.batch_size):
+            batch = missing[offset:offset + self.batch_size]
+            batch_scores = self.model.predict([keys[i] for i in batch], batch_size=self.batch_size)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self._cache_put(keys[i], scores[i])
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms > self.budget_ms and offset + self.batch_size < len(missing):
+                self.budget_exceeded += 1
+                logger.warning(f"Re-rank budget exceeded ({elapsed_ms:.0f}ms > {self.budget_ms:.0f}ms); keeping first-stage order")
+                return None
+
+        return scores
+
+    def stats(self) -> Dict:
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            "calls": self.calls,
+            "skipped": self.skipped,
+            "cache_hits": self.cache_hits,
+            "cache_entries": cached,
+            "budget_exceeded": self.budget_exceeded,
+            "budget_ms": self.budget_ms,
+        }
@@ -0,0 +1,136 @@
+"""
+HTTP Responses
+Fast JSON rendering with orjson and an ASGI middleware that compresses
+response bodies above a size threshold, negotiating brotli (when the
+`brotli` package is installed) or gzip from Accept-Encoding.
+"""
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Optional
+
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional: fall back to gzip only
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Low brotli qualities compress about as well as gzip -6, much faster than the default 11
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml")
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (numpy values and non-str keys allowed)"""
+
+    def render(self, content: Any) -> bytes:
+        try:
+            return orjson.dumps(content, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # Types orjson doesn't know (e.g. Decimal): same output as JSONResponse
+            return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Parse Accept-Encoding into {coding: q}"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported content coding for a request, preferring brotli on ties"""
+    accepted = _accepted_encodings(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Compress complete (non-streaming) responses of compressible types that
+    are at least minimum_size bytes. Streaming responses pass through.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[dict] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                if start_message is not None:
+                    # Not a plain body (e.g. http.response.pathsend): can't compress, headers go first
+                    passthrough = True
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                start_message = None
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            start_message = None
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
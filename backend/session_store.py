@@ -0,0 +1,74 @@
+"""
+Session Store
+One document per login in `user_sessions`, keyed by the session id carried in
+the JWT `sid` claim. Sessions expire through a TTL index on expires_at, and
+invalidation is an indexed bulk delete; the removed session ids are returned
+so callers can revoke tokens that are still in flight.
+"""
+
+import secrets
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from .mongodb_config import get_user_sessions_collection
+    from .tracing import trace_function
+except ImportError:
+    from mongodb_config import get_user_sessions_collection
+    from tracing import trace_function
+
+
+class SessionStore:
+    """Create, check and bulk-invalidate login sessions"""
+
+    @trace_function(name="mongo.session_create")
+    async def create(self, user_id: str, ttl: timedelta) -> str:
+        """Record a new session and return its id"""
+        session_id = secrets.token_urlsafe(16)
+        now = datetime.utcnow()
+        await get_user_sessions_collection().insert_one({
+            "_id": session_id,
+            "user_id": user_id,
+            "created_at": now,
+            "expires_at": now + ttl,
+        })
+        return session_id
+
+    @trace_function(name="mongo.session_refresh")
+    async def refresh(self, session_id: str, ttl: timedelta) -> bool:
+        """Extend a live session; False if it was invalidated or has expired"""
+        now = datetime.utcnow()
+        result = await get_user_sessions_collection().update_one(
+            {"_id": session_id, "expires_at": {"$gt": now}},
+            {"$set": {"expires_at": now + ttl}},
+        )
+        return result.matched_count == 1
+
+    @trace_function(name="mongo.session_get")
+    async def get(self, session_id: str) -> Optional[dict]:
+        return await get_user_sessions_collection().find_one(
+            {"_id": session_id, "expires_at": {"$gt": datetime.utcnow()}}
+        )
+
+    async def _delete_where(self, query: Dict) -> List[Dict]:
+        collection = get_user_sessions_collection()
+        sessions = await collection.find(query, {"expires_at": 1}).to_list(length=None)
+        if sessions:
+            await collection.delete_many({"_id": {"$in": [s["_id"] for s in sessions]}})
+        return sessions
+
+    @trace_function(name="mongo.invalidate_user_sessions")
+    async def invalidate_user(self, user_id: str) -> List[Dict]:
+        """Delete every session of a user; returns the removed {_id, expires_at} docs"""
+        return await self._delete_where({"user_id": user_id})
+
+    @trace_function(name="mongo.invalidate_users_sessions")
+    async def invalidate_users(self, user_ids: Iterable[str]) -> List[Dict]:
+        """Delete the sessions of many users in one indexed delete"""
+        ids = list(user_ids)
+        if not ids:
+            return []
+        return await self._delete_where({"user_id": {"$in": ids}})
+
+
+session_store = SessionStore()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+LLM Admission Tests
+Slot limits, per-user caps, plan-priority queueing, spare slots for hedges
+and client keying behind a proxy.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+# admission pulls in the LLM and payment clients
+pytest.importorskip("google.generativeai")
+pytest.importorskip("razorpay")
+
+import admission
+from admission import AdmissionController, client_address
+
+
+def _request(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+
+def test_forwarded_for_is_only_trusted_from_proxies(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", {"10.0.0.1", "10.0.0.2"})
+    assert client_address(_request("10.0.0.1", "203.0.113.7, 10.0.0.2")) == "203.0.113.7"
+    assert client_address(_request("198.51.100.2", "203.0.113.7")) == "198.51.100.2"
+    assert client_address(_request("10.0.0.1")) == "10.0.0.1"
+
+
+def test_forged_leading_forwarded_for_is_ignored(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", {"10.0.0.1"})
+    # The client sent "X-Forwarded-For: 1.2.3.4"; the proxy appended the address it saw
+    assert client_address(_request("10.0.0.1", "1.2.3.4, 203.0.113.7")) == "203.0.113.7"
+    assert client_address(_request("10.0.0.1", "5.6.7.8, 203.0.113.7")) == "203.0.113.7"
+
+
+def test_per_user_cap_rejects_with_retry_after():
+    async def run():
+        controller = AdmissionController(limits={"ollama": 4}, max_per_user=1)
+        await controller.acquire("user:a", "free", "ollama")
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("user:a", "free", "ollama")
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+
+
+def test_paid_plan_is_served_before_free():
+    paid = max(admission.PLAN_PRIORITY, key=lambda plan: -admission.PLAN_PRIORITY[plan])
+
+    async def run():
+        controller = AdmissionController(limits={"ollama": 1})
+        await controller.acquire("user:holder", "free", "ollama")
+        order = []
+
+        async def wait(key, plan):
+            await controller.acquire(key, plan, "ollama")
+            order.append(key)
+            controller.release(key, "ollama")
+
+        waiters = [asyncio.create_task(wait("user:free", "free")), asyncio.create_task(wait("user:paid", paid))]
+        await asyncio.sleep(0)
+        controller.release("user:holder", "ollama")
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(run()) == ["user:paid", "user:free"]
+
+
+def test_spare_slot_from_worker_thread_respects_limit():
+    async def run():
+        controller = AdmissionController(limits={"ollama": 2})
+        await controller.acquire("user:a", "free", "ollama")
+        loop = asyncio.get_running_loop()
+        granted = [await loop.run_in_executor(None, controller.try_acquire_spare, "ollama") for _ in range(2)]
+        await loop.run_in_executor(None, controller.release_spare, "ollama")
+        await asyncio.sleep(0)
+        return granted, controller.stats()["ollama"]["active"]
+
+    granted, active = asyncio.run(run())
+    assert granted == [True, False]
+    assert active == 1
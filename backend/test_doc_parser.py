@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Document Parser Tests
+Chunk boundaries at legal headings, the token budget, overlap when a unit is
+split for size, and character offsets back into the source.
+"""
+
+import sys
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from doc_parser import CHARS_PER_TOKEN, iter_chunks, parse_and_chunk
+
+STATUTE = (
+    "PART I\n"
+    "Preliminary provisions.\n"
+    "Article 1 Name of the Union.\n"
+    "India shall be a Union of States.\n"
+    "Article 2 Admission of new States.\n"
+    "Parliament may admit new States.\n"
+)
+
+
+def _lines(count: int) -> str:
+    return "".join(f"Line {i:02d} of the same long unit.\n" for i in range(count))
+
+
+def test_major_headings_start_new_chunks():
+    chunks = parse_and_chunk(STATUTE)
+    assert [c["heading"] for c in chunks] == [
+        "PART I",
+        "Article 1 Name of the Union.",
+        "Article 2 Admission of new States.",
+    ]
+    assert chunks[1]["text"] == "Article 1 Name of the Union.\nIndia shall be a Union of States."
+    assert [c["chunk_index"] for c in chunks] == [0, 1, 2]
+
+
+def test_offsets_point_back_into_the_source():
+    for chunk in parse_and_chunk(STATUTE):
+        assert STATUTE[chunk["start"]:chunk["end"]] == chunk["text"]
+
+
+def test_chunks_respect_the_token_budget():
+    chunks = parse_and_chunk(_lines(40), max_tokens=40, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(len(c["text"]) <= 40 * CHARS_PER_TOKEN for c in chunks)
+
+
+def test_unit_split_for_size_carries_overlap():
+    chunks = parse_and_chunk(_lines(40), max_tokens=40, overlap_tokens=10)
+    for previous, current in zip(chunks, chunks[1:]):
+        last_line = previous["text"].splitlines()[-1]
+        assert current["text"].startswith(last_line)
+        assert current["start"] < previous["end"]
+
+
+def test_no_overlap_across_a_heading():
+    text = _lines(3) + "Section 5 Punishment.\n" + _lines(3)
+    first, second = parse_and_chunk(text, max_tokens=200, overlap_tokens=20)
+    assert second["text"].startswith("Section 5")
+    assert second["start"] >= first["end"]
+
+
+def test_oversized_line_is_windowed_on_word_boundaries():
+    line = " ".join(f"word{i:03d}" for i in range(100)) + "\n"
+    chunks = parse_and_chunk(line, max_tokens=20, overlap_tokens=4)
+    assert len(chunks) > 1
+    assert all(len(c["text"]) <= 20 * CHARS_PER_TOKEN for c in chunks)
+    for chunk in chunks:
+        assert line[chunk["start"]:chunk["end"]] == chunk["text"]
+    # Consecutive windows share their boundary words
+    assert chunks[1]["start"] < chunks[0]["end"]
+
+
+def test_line_iterable_matches_full_text():
+    text = STATUTE + _lines(30)
+    streamed = list(iter_chunks(text.splitlines(keepends=True), max_tokens=40))
+    assert streamed == parse_and_chunk(text, max_tokens=40)
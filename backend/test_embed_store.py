@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Embed Store Tests
+Segment rollover, tombstoned deletes and compaction of UserChunkStore,
+using small hand-made vectors (no embedding model needed).
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import embed_store
+from embed_store import UserChunkStore
+
+DIM = 4
+
+
+def _rows(doc_id: str, count: int):
+    vectors = np.tile(np.array([1, 0, 0, 0], dtype=np.float32), (count, 1))
+    return vectors, [{"doc_id": doc_id, "text": f"{doc_id} chunk {i}", "chunk_index": i} for i in range(count)]
+
+
+def _search_docs(store: UserChunkStore):
+    return {row["doc_id"] for row in store.search(np.array([1, 0, 0, 0], dtype=np.float32), top_k=100)}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(embed_store, "SEGMENT_MAX_ROWS", 2)
+    return UserChunkStore(tmp_path / "user", DIM)
+
+
+def test_add_rolls_over_segments(store):
+    store.add(*_rows("a", 5))
+    assert len(store.segments) == 3
+    assert store.count() == 5
+
+
+def test_delete_compact_search_keeps_active_tombstones(store):
+    store.add(*_rows("a", 2))  # fills (and seals) the first segment
+    store.add(*_rows("b", 1))  # lands in the active segment
+    store.delete_document("a")
+    store.delete_document("b")
+    assert _search_docs(store) == set()
+
+    store.compact()
+
+    # "a" was merged away entirely, so the merged segment is empty and the active one comes first
+    assert _search_docs(store) == set()
+    assert store.deleted_docs == {"b"}
+
+
+def test_compact_drops_reclaimed_tombstones(store):
+    store.add(*_rows("a", 2))
+    store.add(*_rows("c", 2))
+    store.add(*_rows("b", 1))
+    store.delete_document("a")
+
+    assert store.needs_compaction()
+    store.compact()
+
+    assert _search_docs(store) == {"b", "c"}
+    assert store.deleted_docs == set()
+    assert store.count() == 3
+
+
+def test_active_segment_tombstones_do_not_trigger_compaction(store):
+    store.add(*_rows("a", 2))
+    store.add(*_rows("b", 1))
+    store.delete_document("b")
+    assert not store.needs_compaction()
+
+
+def test_manifest_survives_reopen(store, tmp_path):
+    store.add(*_rows("a", 3))
+    store.delete_document("a")
+    reopened = UserChunkStore(tmp_path / "user", DIM)
+    assert reopened.count() == 3
+    assert _search_docs(reopened) == set()
+
+
+def test_compact_seal_active_removes_deleted_rows_from_disk(store, tmp_path):
+    store.add(*_rows("a", 1))
+    store.add(*_rows("b", 1))
+    store.delete_document("a")
+
+    store.compact(seal_active=True)
+
+    assert _search_docs(store) == {"b"}
+    assert store.deleted_docs == set()
+    on_disk = "".join(path.read_text() for path in (tmp_path / "user").glob("*.jsonl"))
+    assert "a chunk" not in on_disk
+
+
+def test_delete_all_during_compaction_does_not_resurrect_rows(store, tmp_path, monkeypatch):
+    store.add(*_rows("a", 2))
+    store.add(*_rows("b", 2))
+    store.add(*_rows("c", 1))
+
+    original_metadata = embed_store._Segment.metadata
+    cleared = []
+
+    def metadata_then_delete_all(segment):
+        rows = original_metadata(segment)
+        if not cleared:
+            # delete_user_chunks(user_id) arriving while compact() is merging
+            cleared.append(True)
+            store.clear()
+        return rows
+
+    monkeypatch.setattr(embed_store._Segment, "metadata", metadata_then_delete_all)
+    store.compact()
+    monkeypatch.undo()
+
+    assert store.count() == 0
+    assert _search_docs(store) == set()
+    assert list((tmp_path / "user").glob("seg_*")) == []
+
+
+def test_search_skips_segment_without_metadata_yet(store):
+    store.add(*_rows("a", 1))
+    segment = store.segments[-1]
+    # Vectors of a second segment are on disk, its metadata sidecar isn't
+    pending = embed_store._Segment(store.directory, "seg_pending", DIM)
+    with open(pending.vec_path, "wb") as f:
+        f.write(np.ones((1, DIM), dtype="<f4").tobytes())
+    store.segments.append(pending)
+
+    assert _search_docs(store) == {"a"}
+    assert segment.rows == 1
+
+
+def test_expired_documents_stop_matching(store):
+    store.add(*_rows("a", 1))
+    assert store.expire_documents(ttl=3600) == 0
+    assert store.expire_documents(ttl=0) == 1
+    assert _search_docs(store) == set()
+    assert store.documents == {}
+
+
+def test_sweep_removes_expired_chunk_text_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(embed_store, "EMBED_STORE_DIR", tmp_path)
+    monkeypatch.setattr(embed_store, "_stores", {})
+    directory = tmp_path / embed_store._store_key("user-1")
+    UserChunkStore(directory, DIM).add(*_rows("a", 2))
+    embed_store._stores.clear()
+
+    # Reopened from its manifest (no model needed), as the background sweep does
+    assert embed_store.purge_expired_chunks(ttl=0) == 1
+
+    on_disk = "".join(path.read_text() for path in directory.glob("*.jsonl"))
+    assert "a chunk" not in on_disk
+    assert embed_store.get_user_store("user-1").count() == 0
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+LLM Router Tests
+Fallback, hedging (and its slot admission) and context propagation of
+LLMRouter, using in-process fake targets with fixed latencies.
+"""
+
+import sys
+import time
+from contextvars import ContextVar
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import llm_router
+from llm_router import LLMRouter, LLMTarget
+
+MESSAGES = [{"role": "user", "content": "What is Article 21?"}]
+NO_REPROBE = float("inf")
+request_id: ContextVar = ContextVar("request_id", default=None)
+
+
+def fake_target(backend: str, answer: str, latency: float, prior: float, fail: bool = False, seen=None) -> LLMTarget:
+    def call(messages, temperature):
+        if seen is not None:
+            seen.append(request_id.get())
+        time.sleep(latency)
+        if fail:
+            raise RuntimeError(f"{backend} failed")
+        return answer
+
+    return LLMTarget(backend, "fake", call, prior_latency=prior)
+
+
+@pytest.fixture(autouse=True)
+def fast_hedges(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_MIN_DELAY", 0.05)
+
+
+def test_falls_through_to_next_target_on_error():
+    router = LLMRouter(
+        [fake_target("gemini", "g", 0.0, 0.1, fail=True), fake_target("ollama", "o", 0.0, 0.2)],
+        hedging=False,
+        reprobe_interval=NO_REPROBE,
+    )
+    assert router.generate(MESSAGES) == "o"
+    assert router.targets[0].error_rate > 0
+
+
+def test_backend_calls_see_the_callers_context():
+    seen = []
+    router = LLMRouter([fake_target("gemini", "g", 0.0, 0.1, seen=seen)], hedging=False, reprobe_interval=NO_REPROBE)
+    token = request_id.set("req-1")
+    try:
+        router.generate(MESSAGES)
+    finally:
+        request_id.reset(token)
+    assert seen == ["req-1"]
+
+
+def test_slow_primary_is_hedged_when_a_slot_is_free():
+    released = []
+    router = LLMRouter(
+        [fake_target("gemini", "g", 1.0, 0.02), fake_target("ollama", "o", 0.0, 0.5)],
+        hedge_admit=lambda backend: True,
+        hedge_release=released.append,
+        reprobe_interval=NO_REPROBE,
+    )
+    assert router.generate(MESSAGES) == "o"
+    time.sleep(0.05)
+    assert released == ["ollama"]
+
+
+def test_hedge_is_skipped_when_backend_is_at_capacity():
+    asked = []
+
+    def admit(backend):
+        asked.append(backend)
+        return False
+
+    router = LLMRouter(
+        [fake_target("gemini", "g", 0.3, 0.02), fake_target("ollama", "o", 0.0, 0.5)],
+        hedge_admit=admit,
+        reprobe_interval=NO_REPROBE,
+    )
+    assert router.generate(MESSAGES) == "g"
+    assert asked == ["ollama"]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Local LLM Tests
+What Gemini is actually sent for a multi-turn prompt (system prompt plus
+conversation summary, history turns and the new question), with the Gemini
+client replaced by a recorder.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+pytest.importorskip("google.generativeai")
+
+import local_llm
+
+PROMPT = [
+    {"role": "system", "content": "You are SPECTER."},
+    {"role": "system", "content": "Summary of earlier conversation:\nuser: What is bail?"},
+    {"role": "user", "content": "Is theft bailable?"},
+    {"role": "assistant", "content": "Theft is generally bailable."},
+    {"role": "user", "content": "What is the penalty?"},
+]
+
+
+@pytest.fixture
+def gemini_calls(monkeypatch):
+    calls = []
+
+    class FakeModel:
+        def __init__(self, model_name, system_instruction=None):
+            self.system_instruction = system_instruction
+
+        def generate_content(self, contents, generation_config=None):
+            calls.append({"system_instruction": self.system_instruction, "contents": contents})
+            return type("Response", (), {"text": "answer"})()
+
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    monkeypatch.setattr(local_llm.genai, "configure", lambda api_key: None)
+    monkeypatch.setattr(local_llm.genai, "GenerativeModel", FakeModel)
+    return calls
+
+
+def test_gemini_receives_merged_system_prompt_and_all_turns(gemini_calls):
+    assert local_llm.gemini_generate(PROMPT, "gemini-test") == "answer"
+
+    sent = gemini_calls[0]
+    assert sent["system_instruction"] == (
+        "You are SPECTER.\n\nSummary of earlier conversation:\nuser: What is bail?"
+    )
+    assert sent["contents"] == [
+        {"role": "user", "parts": ["Is theft bailable?"]},
+        {"role": "model", "parts": ["Theft is generally bailable."]},
+        {"role": "user", "parts": ["What is the penalty?"]},
+    ]
+
+
+def test_consecutive_turns_of_one_role_are_joined():
+    _, contents = local_llm._split_messages([
+        {"role": "user", "content": "First"},
+        {"role": "user", "content": "Second"},
+    ])
+    assert contents == [{"role": "user", "parts": ["First", "Second"]}]
+
+
+def test_prompt_without_a_final_user_turn_is_rejected(gemini_calls):
+    with pytest.raises(ValueError):
+        local_llm.gemini_generate(PROMPT[:-1], "gemini-test")
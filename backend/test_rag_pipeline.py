@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+RAG Pipeline Tests
+Prompt token budget of LegalRAGPipeline.build_prompt: history trimmed to its
+share of the budget (newest turns first, summary kept ahead of them) and
+retrieved contexts packed into what is left. Ranking is replaced by a fixed
+list so no embeddings are computed.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+# rag_pipeline binds the shared embedding model at import
+pytest.importorskip("sklearn")
+pytest.importorskip("sentence_transformers")
+
+import rag_pipeline
+from rag_pipeline import LegalRAGPipeline
+
+SUMMARY = {"role": "system", "content": "Summary of earlier conversation:\nuser: What is bail?"}
+
+
+def _history(turns: int, words: int = 40):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "detail " * words}
+        for i in range(turns)
+    ]
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    pipeline = LegalRAGPipeline()
+    contexts = [
+        {"key": f"doc{i}", "text": f"context {i} " + "provision " * 60, "score": 1.0 - i / 100}
+        for i in range(30)
+    ]
+    monkeypatch.setattr(pipeline, "_rank_contexts", lambda query, context_data, top_k=3: contexts)
+    return pipeline
+
+
+def test_trim_keeps_newest_turns_in_order(pipeline):
+    history = _history(10)
+    cost = pipeline._message_tokens(history[0])
+    kept = pipeline._trim_history(history, budget=cost * 3)
+    assert kept == history[-3:]
+
+
+def test_trim_keeps_summary_ahead_of_turns(pipeline):
+    history = [SUMMARY] + _history(10)
+    budget = pipeline._message_tokens(SUMMARY) + pipeline._message_tokens(history[1]) * 2
+    kept = pipeline._trim_history(history, budget)
+    assert kept == [SUMMARY] + history[-2:]
+
+
+def test_summary_too_big_for_budget_is_dropped(pipeline):
+    history = [SUMMARY] + _history(2, words=1)
+    kept = pipeline._trim_history(history, budget=pipeline._message_tokens(history[1]) * 2)
+    assert kept == history[1:]
+
+
+def test_long_history_is_trimmed_under_the_prompt_budget(pipeline):
+    history = [SUMMARY] + _history(60)
+    prompt = pipeline.build_prompt("What is the penalty?", {}, chat_history=history)
+
+    tokens = prompt["metadata"]["token_counts"]
+    assert tokens["total"] <= pipeline.context_window
+    assert tokens["history"] <= (pipeline.context_window - tokens["system"]) * rag_pipeline.HISTORY_BUDGET_SHARE
+    assert prompt["metadata"]["history_dropped"] > 0
+
+    messages = prompt["messages"]
+    assert messages[1] == SUMMARY
+    assert messages[-2] == history[-1]
+    assert messages[-1]["role"] == "user" and "What is the penalty?" in messages[-1]["content"]
+
+
+def test_contexts_fill_what_history_leaves(pipeline):
+    short = pipeline.build_prompt("What is bail?", {}, chat_history=_history(1))
+    long = pipeline.build_prompt("What is bail?", {}, chat_history=_history(60))
+
+    assert short["metadata"]["token_counts"]["total"] <= pipeline.context_window
+    assert long["metadata"]["context_count"] < short["metadata"]["context_count"]
+    assert short["metadata"]["contexts_dropped"] > 0
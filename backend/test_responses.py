@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Response Tests
+CompressionMiddleware headers (Content-Encoding, Content-Length, Vary), the
+minimum_size and content-type skips, streaming passthrough and encoding
+negotiation.
+"""
+
+import gzip
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import responses
+from responses import CompressionMiddleware, FastJSONResponse, choose_encoding
+
+BIG = {"answer": "Article 21 protects life and personal liberty. " * 100}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # gzip only, whether or not brotli is installed here
+    monkeypatch.setattr(responses, "brotli", None)
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+    @app.get("/big")
+    def big():
+        return FastJSONResponse(BIG)
+
+    @app.get("/small")
+    def small():
+        return FastJSONResponse({"answer": "ok"})
+
+    @app.get("/binary")
+    def binary():
+        return PlainTextResponse("x" * 2000, media_type="application/octet-stream")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"a" * 1000, b"b" * 1000]), media_type="text/plain")
+
+    return TestClient(app)
+
+
+def _get(client, path, accept_encoding="gzip"):
+    # Raw bytes as sent, without httpx decoding them
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_large_json_is_gzipped_with_headers(client):
+    response, body = _get(client, "/big")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == len(body)
+    assert gzip.decompress(body) == FastJSONResponse(BIG).body
+
+
+def test_body_below_minimum_size_is_not_compressed(client):
+    response, body = _get(client, "/small")
+    assert "content-encoding" not in response.headers
+    assert body == b'{"answer":"ok"}'
+
+
+def test_incompressible_type_is_not_compressed(client):
+    response, _ = _get(client, "/binary")
+    assert "content-encoding" not in response.headers
+
+
+def test_streaming_response_passes_through(client):
+    response, body = _get(client, "/stream")
+    assert "content-encoding" not in response.headers
+    assert body == b"a" * 1000 + b"b" * 1000
+
+
+def test_client_without_gzip_gets_identity(client):
+    response, _ = _get(client, "/big", accept_encoding="identity")
+    assert "content-encoding" not in response.headers
+
+
+def test_encoding_negotiation(monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, *;q=0.5") is None
+    assert choose_encoding("*") == "gzip"
+    monkeypatch.setattr(responses, "brotli", object())
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("gzip;q=1, br;q=0.5") == "gzip"
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Token Validator Tests
+Claim caching and revocation by session id (sid) and token id (jti) through
+the denylist, against an in-memory stand-in for the revoked_tokens collection.
+"""
+
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from jose import jwt
+from pymongo.errors import BulkWriteError
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import token_validator
+from token_validator import DUPLICATE_KEY_ERROR, Denylist, TokenValidator
+
+SECRET = "test-secret"
+EXPIRES_AT = datetime.utcnow() + timedelta(hours=1)
+
+
+class FakeRevokedTokens:
+    """Stores revocation documents; insert_many can be told to fail with given codes"""
+
+    def __init__(self):
+        self.documents = []
+        self.error_codes = []
+
+    async def insert_many(self, documents, ordered=True):
+        if self.error_codes:
+            errors = [{"index": i, "code": code, "errmsg": "write failed"} for i, code in enumerate(self.error_codes)]
+            raise BulkWriteError({"writeErrors": errors})
+        self.documents.extend(documents)
+
+    def find(self, query, projection=None):
+        since = query.get("revoked_at", {}).get("$gt")
+
+        async def cursor():
+            for document in self.documents:
+                if since is None or document["revoked_at"] > since:
+                    yield document
+
+        return cursor()
+
+
+@pytest.fixture
+def revoked_tokens(monkeypatch):
+    collection = FakeRevokedTokens()
+    monkeypatch.setattr(token_validator, "get_revoked_tokens_collection", lambda: collection)
+    return collection
+
+
+def _token(sid: str, jti: str) -> str:
+    claims = {"sub": "user-1", "sid": sid, "jti": jti, "exp": int(time.time()) + 3600}
+    return jwt.encode(claims, SECRET, algorithm="HS256")
+
+
+def test_claims_are_cached_until_expiry():
+    validator = TokenValidator(SECRET, "HS256", Denylist())
+    token = _token("session-1", "token-1")
+    assert validator.decode(token)["sid"] == "session-1"
+    assert validator.decode(token)["sid"] == "session-1"
+    assert (validator.hits, validator.misses) == (1, 1)
+
+
+def test_revoked_session_rejects_cached_token(revoked_tokens):
+    validator = TokenValidator(SECRET, "HS256", Denylist())
+    token = _token("session-1", "token-1")
+    other = _token("session-2", "token-2")
+    assert validator.decode(token) is not None
+
+    asyncio.run(validator.denylist.revoke([("session-1", EXPIRES_AT)]))
+
+    assert validator.decode(token) is None
+    assert validator.decode(other) is not None
+    assert revoked_tokens.documents[0]["_id"] == "session-1"
+
+
+def test_revoked_token_id_rejects_only_that_token(revoked_tokens):
+    validator = TokenValidator(SECRET, "HS256", Denylist())
+    asyncio.run(validator.denylist.revoke([("token-1", EXPIRES_AT)]))
+
+    assert validator.decode(_token("session-1", "token-1")) is None
+    assert validator.decode(_token("session-1", "token-2")) is not None
+
+
+def test_revocation_from_another_worker_arrives_by_sync(revoked_tokens):
+    worker_a, worker_b = Denylist(), Denylist()
+
+    async def run():
+        await worker_b.sync(full=True)
+        await worker_a.revoke([("session-1", EXPIRES_AT)])
+        await worker_b.sync()
+
+    asyncio.run(run())
+    assert "session-1" in worker_b
+    assert "session-2" not in worker_b
+
+
+def test_revoke_tolerates_ids_already_revoked(revoked_tokens):
+    revoked_tokens.error_codes = [DUPLICATE_KEY_ERROR]
+    denylist = Denylist()
+    asyncio.run(denylist.revoke([("session-1", EXPIRES_AT)]))
+    assert "session-1" in denylist
+
+
+def test_revoke_raises_on_other_write_errors(revoked_tokens):
+    revoked_tokens.error_codes = [DUPLICATE_KEY_ERROR, 1]
+    with pytest.raises(BulkWriteError):
+        asyncio.run(Denylist().revoke([("session-1", EXPIRES_AT), ("session-2", EXPIRES_AT)]))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tracing Tests
+Span nesting, OTLP exporter batching/drop accounting and the /traces token
+check, with the collector replaced by a recording stub.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tracing
+from metrics import TRACE_SPANS_DROPPED
+
+
+def _dropped(reason: str) -> float:
+    return TRACE_SPANS_DROPPED._values.get((reason,), 0)
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    # Keep the background thread asleep; the tests call flush() themselves
+    monkeypatch.setattr(tracing, "OTLP_FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(tracing, "OTLP_BATCH_SIZE", 2)
+    exporter = tracing._OTLPExporter("http://collector.invalid")
+    exporter.batches = []
+    exporter.fail = False
+
+    def export(spans):
+        if exporter.fail:
+            return False
+        exporter.batches.append([s.name for s in spans])
+        return True
+
+    monkeypatch.setattr(exporter, "_export", export)
+    return exporter
+
+
+def _finished(name: str) -> tracing.Span:
+    finished = tracing.Span(name, "t" * 32, None)
+    finished.finish()
+    return finished
+
+
+def test_child_span_nests_under_parent():
+    with tracing.span("parent") as parent:
+        with tracing.span("child") as child:
+            pass
+    assert child.parent_id == parent.span_id
+    assert child.trace_id == parent.trace_id
+
+
+def test_flush_drains_every_batch(exporter):
+    for i in range(5):
+        exporter.enqueue(_finished(f"s{i}"))
+    exporter.flush()
+    assert exporter.batches == [["s0", "s1"], ["s2", "s3"], ["s4"]]
+    assert not exporter._queue
+
+
+def test_flush_stops_when_collector_fails(exporter):
+    for i in range(5):
+        exporter.enqueue(_finished(f"s{i}"))
+    exporter.fail = True
+    exporter.flush()
+    assert len(exporter._queue) == 3
+
+
+def test_full_queue_counts_dropped_spans(exporter):
+    before = _dropped("queue_full")
+    for i in range(exporter._queue.maxlen + 3):
+        exporter.enqueue(_finished(f"s{i}"))
+    assert _dropped("queue_full") - before == 3
+
+
+def test_traces_need_configured_token(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACES_TOKEN", "")
+    assert not tracing.traces_access_allowed("")
+    monkeypatch.setattr(tracing, "TRACES_TOKEN", "s3cret")
+    assert tracing.traces_access_allowed("s3cret")
+    assert not tracing.traces_access_allowed("wrong")
+    assert not tracing.traces_access_allowed(None)
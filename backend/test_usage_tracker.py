@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Usage Tracker Tests
+Atomic quota consumption, QuotaLease release when a request fails and
+write-behind shutdown, against an in-memory stand-in for the users collection.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+# usage_tracker reads plan limits from the payment module
+pytest.importorskip("razorpay")
+
+import usage_tracker
+from usage_tracker import QuotaLease, UsageAggregator, question_quota
+
+USER_ID = ObjectId()
+
+
+def _matches(usage, condition):
+    field, test = next(iter(condition.items()))
+    value = usage.get(field.split(".", 1)[1])
+    if "$exists" in test:
+        return (value is not None) == test["$exists"]
+    if "$lt" in test:
+        return value is not None and value < test["$lt"]
+    return value is not None and value > test["$gt"]
+
+
+class FakeUsers:
+    """One user document; supports the conditional updates the quota code issues"""
+
+    def __init__(self, usage):
+        self.usage = dict(usage)
+        self.delay = 0
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        assert query["_id"] == USER_ID
+        conditions = [{k: v} for k, v in query.items() if k.startswith("usage.")]
+        if "$or" in query and not any(_matches(self.usage, c) for c in query["$or"]):
+            return None
+        if not all(_matches(self.usage, c) for c in conditions):
+            return None
+        for field, amount in update["$inc"].items():
+            name = field.split(".", 1)[1]
+            self.usage[name] = self.usage.get(name, 0) + amount
+        return {"usage": dict(self.usage)}
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(self.delay)
+        for operation in operations:
+            for field, amount in operation._doc["$inc"].items():
+                name = field.split(".", 1)[1]
+                self.usage[name] = self.usage.get(name, 0) + amount
+
+
+@pytest.fixture
+def users(monkeypatch):
+    collection = FakeUsers({"questions_asked": 0})
+    monkeypatch.setattr(usage_tracker, "get_users_collection", lambda: collection)
+    monkeypatch.setattr(usage_tracker, "get_subscription_limits", lambda plan: {"questions": 2, "uploads": 1})
+    monkeypatch.setattr(usage_tracker, "usage_aggregator", UsageAggregator())
+    return collection
+
+
+def _user():
+    return {"_id": USER_ID, "usage": {"questions_asked": 0}}
+
+
+def test_lease_release_returns_the_question(users):
+    async def run():
+        lease = await question_quota(_user())
+        assert users.usage["questions_asked"] == 1
+        # The handler failed: hand the question back
+        await lease.release()
+
+    asyncio.run(run())
+    assert users.usage["questions_asked"] == 0
+
+
+def test_lease_is_released_only_once(users):
+    async def run():
+        await question_quota(_user())
+        lease = await question_quota(_user())
+        await lease.release()
+        await lease.release()
+
+    asyncio.run(run())
+    assert users.usage["questions_asked"] == 1
+
+
+def test_released_question_can_be_asked_again_at_the_limit(users):
+    async def run():
+        await question_quota(_user())
+        lease = await question_quota(_user())
+        with pytest.raises(HTTPException) as rejected:
+            await question_quota(_user())
+        assert rejected.value.status_code == 403
+        await lease.release()
+        await question_quota(_user())
+
+    asyncio.run(run())
+    assert users.usage["questions_asked"] == 2
+
+
+def test_release_never_goes_below_zero(users):
+    asyncio.run(QuotaLease(_user(), "questions_asked").release())
+    assert users.usage["questions_asked"] == 0
+
+
+def test_unlimited_plan_release_cancels_the_buffered_increment(users, monkeypatch):
+    monkeypatch.setattr(usage_tracker, "get_subscription_limits", lambda plan: {"questions": -1})
+    aggregator = usage_tracker.usage_aggregator
+
+    async def run():
+        lease = await question_quota(_user())
+        assert aggregator.pending(str(USER_ID), "questions_asked") == 1
+        await lease.release()
+
+    asyncio.run(run())
+    assert aggregator.pending(str(USER_ID), "questions_asked") == 0
+    assert users.usage["questions_asked"] == 0
+
+
+def test_stop_during_slow_write_loses_no_increments(users):
+    users.delay = 0.2
+    aggregator = UsageAggregator()
+
+    async def run():
+        aggregator.start()
+        aggregator.add(str(USER_ID), "questions_asked")
+        aggregator._flush_event.set()
+        await asyncio.sleep(0.05)
+        # Arrives while the first increment is still being written
+        aggregator.add(str(USER_ID), "questions_asked")
+        await aggregator.stop()
+
+    asyncio.run(run())
+    assert users.usage["questions_asked"] == 2
+    assert aggregator.pending(str(USER_ID), "questions_asked") == 0
+
+
+def test_cancelled_flush_requeues_its_increments(users):
+    users.delay = 1
+    aggregator = UsageAggregator()
+    aggregator.add(str(USER_ID), "questions_asked")
+
+    async def run():
+        flush = asyncio.create_task(aggregator.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+
+    asyncio.run(run())
+    assert aggregator._pending == {str(USER_ID): {"questions_asked": 1}}
+    assert aggregator._inflight == {}
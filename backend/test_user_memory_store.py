@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Conversation Memory Tests
+Ring buffer, summary folding, token-bounded history, write-behind retry and
+shutdown of ConversationMemory, against an in-memory stand-in for the Mongo
+collections.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import user_memory_store
+from user_memory_store import ConversationMemory
+
+
+class FakeCollection:
+    """Records inserted documents; fails the indexes in fail_indexes once"""
+
+    def __init__(self):
+        self.documents = []
+        self.fail_indexes = set()
+        self.down = False
+        self.delay = 0
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(self.delay)
+        if self.down:
+            raise ConnectionError("mongo is down")
+        errors = []
+        for index, document in enumerate(documents):
+            document["_id"] = len(self.documents) + index
+            if index in self.fail_indexes:
+                errors.append({"index": index, "code": 1, "errmsg": "write failed"})
+            else:
+                self.documents.append(dict(document))
+        self.fail_indexes = set()
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+    async def bulk_write(self, requests, ordered=True):
+        self.documents.extend(requests)
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    conversations, summaries = FakeCollection(), FakeCollection()
+    monkeypatch.setattr(user_memory_store, "get_conversations_collection", lambda: conversations)
+    monkeypatch.setattr(user_memory_store, "get_conversation_summaries_collection", lambda: summaries)
+    return conversations, summaries
+
+
+def test_full_buffer_folds_oldest_turn_into_summary(monkeypatch):
+    monkeypatch.setattr(user_memory_store, "MEMORY_MAX_TURNS", 2)
+    memory = ConversationMemory()
+    for content in ("What is bail? More text.", "Bail is release.", "And anticipatory bail?"):
+        memory.append("u1", "user", content)
+
+    history = memory.get_history("u1")
+    assert history[0] == {"role": "system", "content": "Summary of earlier conversation:\nuser: What is bail?"}
+    assert [m["content"] for m in history[1:]] == ["Bail is release.", "And anticipatory bail?"]
+
+
+def test_history_keeps_newest_turns_within_budget():
+    memory = ConversationMemory()
+    for i in range(5):
+        memory.append("u1", "user", f"question number {i} " * 10)
+
+    history = memory.get_history("u1", max_tokens=50)
+    assert history
+    assert history[-1]["content"].startswith("question number 4")
+    assert sum(user_memory_store.estimate_tokens(m["content"]) for m in history) <= 50
+
+
+def test_flush_requeues_only_failed_turns(collections):
+    conversations, _ = collections
+    memory = ConversationMemory()
+    for i in range(3):
+        memory.append("u1", "user", f"turn {i}")
+    conversations.fail_indexes = {1}
+
+    asyncio.run(memory.flush())
+
+    assert [d["content"] for d in conversations.documents] == ["turn 0", "turn 2"]
+    assert [t["content"] for t in memory._pending_turns] == ["turn 1"]
+    assert "_id" not in memory._pending_turns[0]
+
+    asyncio.run(memory.flush())
+    assert [d["content"] for d in conversations.documents] == ["turn 0", "turn 2", "turn 1"]
+    assert memory._pending_turns == []
+
+
+def test_flush_requeues_everything_when_mongo_is_down(collections):
+    conversations, _ = collections
+    memory = ConversationMemory()
+    memory.append("u1", "user", "hello")
+    conversations.down = True
+
+    asyncio.run(memory.flush())
+
+    assert [t["content"] for t in memory._pending_turns] == ["hello"]
+    assert "_id" not in memory._pending_turns[0]
+
+
+def test_stop_during_slow_write_loses_no_turns(collections):
+    conversations, _ = collections
+    conversations.delay = 0.2
+    memory = ConversationMemory()
+
+    async def run():
+        memory.start()
+        memory.append("u1", "user", "first")
+        memory._flush_event.set()
+        await asyncio.sleep(0.05)
+        # Arrives while "first" is still being written
+        memory.append("u1", "user", "second")
+        await memory.stop()
+
+    asyncio.run(run())
+    assert [d["content"] for d in conversations.documents] == ["first", "second"]
+    assert memory._pending_turns == []
+
+
+def test_cancelled_flush_requeues_its_turns(collections):
+    conversations, _ = collections
+    conversations.delay = 1
+    memory = ConversationMemory()
+    memory.append("u1", "user", "hello")
+
+    async def run():
+        flush = asyncio.create_task(memory.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+
+    asyncio.run(run())
+    assert [t["content"] for t in memory._pending_turns] == ["hello"]
@@ -0,0 +1,186 @@
+"""
+Token Validation
+Fast path for JWT authentication: decoded claims are cached per token (keyed
+by a SHA-256 of the token) until the token expires, and revocation is checked
+against an in-memory denylist of revoked token/session ids. The denylist is persisted in `revoked_tokens` and synced
+from MongoDB in the background, so validating a token never waits on the
+database.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from jose import jwt
+from pymongo.errors import BulkWriteError
+
+try:
+    from .mongodb_config import get_revoked_tokens_collection
+except ImportError:
+    from mongodb_config import get_revoked_tokens_collection
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "50000"))
+DUPLICATE_KEY_ERROR = 11000
+DENYLIST_SYNC_INTERVAL = float(os.getenv("DENYLIST_SYNC_INTERVAL", "5"))
+# Full reloads drop expired entries
+DENYLIST_FULL_SYNC_INTERVAL = float(os.getenv("DENYLIST_FULL_SYNC_INTERVAL", "600"))
+
+
+class Denylist:
+    """Revoked token and session ids, mirrored from MongoDB"""
+
+    def __init__(self):
+        self._ids: Dict[str, datetime] = {}
+        self._last_revoked_at: Optional[datetime] = None
+        self._last_full_sync = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, token_id: str) -> bool:
+        # A plain dict lookup: the ids live in this process, so a bloom filter in front
+        # would only add hashing. It pays off only if the exact set moves out of process.
+        return token_id in self._ids
+
+    def _add_local(self, token_id: str, expires_at: datetime):
+        self._ids[token_id] = expires_at
+
+    async def revoke(self, entries: Iterable[Tuple[str, datetime]]):
+        """Revoke ids until their expiry; takes effect here at once, elsewhere after the next sync"""
+        now = datetime.utcnow()
+        docs = []
+        for token_id, expires_at in entries:
+            self._add_local(token_id, expires_at)
+            docs.append({"_id": token_id, "expires_at": expires_at, "revoked_at": now})
+        if not docs:
+            return
+        try:
+            await get_revoked_tokens_collection().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Ids another worker already revoked are fine; any other write error is not
+            write_errors = e.details.get("writeErrors", [])
+            if (
+                not write_errors
+                or e.details.get("writeConcernErrors")
+                or any(error.get("code") != DUPLICATE_KEY_ERROR for error in write_errors)
+            ):
+                raise
+
+    async def sync(self, full: bool = False):
+        """Pull revocations from MongoDB (only new ones unless full)"""
+        query = {}
+        if full:
+            query["expires_at"] = {"$gt": datetime.utcnow()}
+        elif self._last_revoked_at is not None:
+            query["revoked_at"] = {"$gt": self._last_revoked_at}
+        cursor = get_revoked_tokens_collection().find(query, {"expires_at": 1, "revoked_at": 1})
+
+        if full:
+            ids: Dict[str, datetime] = {}
+            async for doc in cursor:
+                ids[doc["_id"]] = doc["expires_at"]
+                if self._last_revoked_at is None or doc["revoked_at"] > self._last_revoked_at:
+                    self._last_revoked_at = doc["revoked_at"]
+            # Keep local revocations that haven't round-tripped through the database yet
+            now = datetime.utcnow()
+            for token_id, expires_at in self._ids.items():
+                if expires_at > now:
+                    ids.setdefault(token_id, expires_at)
+            self._ids = ids
+            self._last_full_sync = time.monotonic()
+            return
+
+        async for doc in cursor:
+            self._add_local(doc["_id"], doc["expires_at"])
+            if self._last_revoked_at is None or doc["revoked_at"] > self._last_revoked_at:
+                self._last_revoked_at = doc["revoked_at"]
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(DENYLIST_SYNC_INTERVAL)
+            full = time.monotonic() - self._last_full_sync >= DENYLIST_FULL_SYNC_INTERVAL
+            try:
+                await self.sync(full=full)
+            except Exception as e:
+                logger.error(f"Denylist sync failed: {e}")
+
+    async def start(self):
+        """Load the denylist and start background syncing (call from app startup)"""
+        if self._task is None:
+            try:
+                await self.sync(full=True)
+            except Exception as e:
+                logger.error(f"Initial denylist load failed: {e}")
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class TokenValidator:
+    """Decode-once JWT validation with per-token claim caching"""
+
+    def __init__(self, secret_key: str, algorithm: str, denylist: Denylist, cache_size: int = TOKEN_CACHE_SIZE):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.denylist = denylist
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, token: str) -> Optional[dict]:
+        """
+        Claims of a valid token
+
+        Returns:
+            The claims, or None if the token or its session was revoked.
+            Raises jose.JWTError for malformed, badly signed or expired tokens.
+        """
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        entry = self._cache.get(key)
+        if entry is not None and entry[1] > time.time():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            claims = entry[0]
+        else:
+            if entry is not None:
+                del self._cache[key]
+            self.misses += 1
+            claims = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            expires = claims.get("exp")
+            if expires is not None:
+                self._cache[key] = (claims, float(expires))
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        for claim in ("jti", "sid"):
+            token_id = claims.get(claim)
+            if token_id and token_id in self.denylist:
+                return None
+        return claims
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached_tokens": len(self._cache),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "revoked_ids": len(self.denylist),
+        }
+
+
+denylist = Denylist()
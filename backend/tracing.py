@@ -1,6 +1,42 @@
-"""Minimal tracing implementation"""
+"""
+Lightweight tracing
+Decorator and context-manager spans with monotonic timing, parent/child
+nesting through contextvars (works across async code), head sampling, an
+in-process ring buffer for the /traces endpoint (enabled by TRACES_TOKEN),
+and optional OTLP/HTTP JSON export to a local collector.
+"""
+
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import Enum
-from typing import Optional, Dict, Any
+from typing import Any, Deque, Dict, List, Optional
+
+try:
+    from .metrics import TRACE_SPANS_DROPPED
+except ImportError:
+    from metrics import TRACE_SPANS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "2048"))
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/")
+OTLP_FLUSH_INTERVAL = 5.0
+OTLP_BATCH_SIZE = 512
+# Shared secret for /traces (sent as X-Traces-Token); the endpoint is off when unset
+TRACES_TOKEN = os.getenv("TRACES_TOKEN", "")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "specter-backend")
+
 
 class TraceEvents(Enum):
     AUTH_LOGIN = "auth_login"
@@ -9,12 +45,232 @@ class TraceEvents(Enum):
     AUTH_VERIFY_EMAIL = "auth_verify_email"
     AUTH_PASSWORD_RESET = "auth_password_reset"
 
-def trace_function(func):
-    return func
+
+class Span:
+    """A timed operation; finished spans land in the ring buffer"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_time_ns",
+                 "_start_perf_ns", "duration_ns", "attributes", "events", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_time_ns = time.time_ns()
+        self._start_perf_ns = time.perf_counter_ns()
+        self.duration_ns = 0
+        self.attributes = dict(attributes) if attributes else {}
+        self.events: List[Dict[str, Any]] = []
+        self.status = "ok"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, data: Optional[Dict[str, Any]] = None):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "data": data or {}})
+
+    def finish(self):
+        self.duration_ns = time.perf_counter_ns() - self._start_perf_ns
+        _buffer.append(self)
+        if _exporter is not None:
+            _exporter.enqueue(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time_ns": self.start_time_ns,
+            "duration_ms": self.duration_ns / 1e6,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": self.status,
+        }
+
+
+class _NotSampled:
+    """Context marker for an unsampled trace, so children skip recording too"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, data: Optional[Dict[str, Any]] = None):
+        pass
+
+
+_NOT_SAMPLED = _NotSampled()
+_current_span: ContextVar[Optional[object]] = ContextVar("current_span", default=None)
+_buffer: Deque[Span] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def current_span():
+    """The active span (or a no-op stand-in), or None outside any trace"""
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span (or as a new sampled root)"""
+    parent = _current_span.get()
+    if parent is _NOT_SAMPLED or (parent is None and random.random() >= TRACE_SAMPLE_RATE):
+        token = _current_span.set(_NOT_SAMPLED)
+        try:
+            yield _NOT_SAMPLED
+        finally:
+            _current_span.reset(token)
+        return
+
+    if parent is None:
+        new_span = Span(name, "%032x" % random.getrandbits(128), None, attributes)
+    else:
+        new_span = Span(name, parent.trace_id, parent.span_id, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "error"
+        new_span.attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.finish()
+
+
+def trace_function(func=None, *, name: Optional[str] = None):
+    """Decorator that wraps a sync or async function in a span"""
+    if func is None:
+        return functools.partial(trace_function, name=name)
+
+    span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(span_name):
+            return func(*args, **kwargs)
+    return wrapper
+
 
 def log_event(event: str, data: dict = None):
-    pass
+    """Attach an event to the current span, or record it as a standalone span"""
+    active = _current_span.get()
+    if active is None:
+        with span(event) as standalone:
+            standalone.add_event(event, data)
+    else:
+        active.add_event(event, data)
+
 
 async def log_auth_event(event_type: TraceEvents, user_id: str, success: bool, details: Optional[Dict[str, Any]] = None):
     """Log authentication events"""
-    pass
+    data = {"user_id": user_id, "success": success, **(details or {})}
+    log_event(event_type.value, data)
+    logger.info(f"Auth event {event_type.value}: user={user_id} success={success}")
+
+
+def get_recent_spans(limit: int = 200, trace_id: Optional[str] = None, min_duration_ms: float = 0.0) -> List[Dict[str, Any]]:
+    """Most recent finished spans, newest first"""
+    spans = []
+    for finished in reversed(list(_buffer)):
+        if trace_id and finished.trace_id != trace_id:
+            continue
+        if finished.duration_ns / 1e6 < min_duration_ms:
+            continue
+        spans.append(finished.to_dict())
+        if len(spans) >= limit:
+            break
+    return spans
+
+
+def traces_access_allowed(token: Optional[str]) -> bool:
+    """Whether a /traces caller presented the configured TRACES_TOKEN"""
+    return bool(TRACES_TOKEN) and token is not None and hmac.compare_digest(token, TRACES_TOKEN)
+
+
+class _OTLPExporter:
+    """Batches finished spans and posts them as OTLP/HTTP JSON from a daemon thread"""
+
+    def __init__(self, endpoint: str):
+        self.url = f"{endpoint}/v1/traces"
+        self._queue: Deque[Span] = deque(maxlen=TRACE_BUFFER_SIZE * 4)
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, finished: Span):
+        if len(self._queue) == self._queue.maxlen:
+            TRACE_SPANS_DROPPED.inc(reason="queue_full")
+        self._queue.append(finished)
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _encode(self, spans: List[Span]) -> bytes:
+        return json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{
+                "scope": {"name": "specter.tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(s.start_time_ns),
+                    "endTimeUnixNano": str(s.start_time_ns + s.duration_ns),
+                    "attributes": [self._attribute(k, v) for k, v in s.attributes.items()],
+                    "events": [{
+                        "name": e["name"],
+                        "timeUnixNano": str(e["time_ns"]),
+                        "attributes": [self._attribute(k, v) for k, v in e["data"].items()],
+                    } for e in s.events],
+                    "status": {"code": 2 if s.status == "error" else 1},
+                } for s in spans],
+            }],
+        }]}).encode("utf-8")
+
+    def _export(self, spans: List[Span]) -> bool:
+        import urllib.request
+
+        request = urllib.request.Request(
+            self.url, data=self._encode(spans), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=2).close()
+            return True
+        except Exception as e:
+            logger.debug(f"OTLP export of {len(spans)} spans failed: {e}")
+            TRACE_SPANS_DROPPED.inc(len(spans), reason="export_failed")
+            return False
+
+    def flush(self):
+        """Export batches until the queue is empty (or the collector stops answering)"""
+        while self._queue:
+            spans = []
+            while self._queue and len(spans) < OTLP_BATCH_SIZE:
+                spans.append(self._queue.popleft())
+            if not self._export(spans):
+                # Leave the rest queued for the next wake-up
+                return
+
+    def _run(self):
+        while True:
+            time.sleep(OTLP_FLUSH_INTERVAL)
+            self.flush()
+
+
+_exporter: Optional[_OTLPExporter] = _OTLPExporter(OTLP_ENDPOINT) if OTLP_ENDPOINT else None
@@ -1,23 +1,166 @@
 """
 Usage tracking service for subscription limits enforcement
 """
+import asyncio
+import logging
+import os
 from datetime import datetime
 from typing import Dict, Optional
-from fastapi import HTTPException, status
+from fastapi import Depends, HTTPException, status
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 
 try:
     from .mongodb_config import get_users_collection
     from .payment_razorpay import get_subscription_limits
+    from .tracing import trace_function
+    from .user_cache import user_cache
+    from .auth_mongo import optional_user, require_user
 except ImportError:
     from mongodb_config import get_users_collection
     from payment_razorpay import get_subscription_limits
+    from tracing import trace_function
+    from user_cache import user_cache
+    from auth_mongo import optional_user, require_user
 
+logger = logging.getLogger(__name__)
 
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "2.0"))
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "500"))
+
+
+def _user_filter(user_id) -> Dict:
+    """Match a user by id; ids arrive as str(ObjectId) from the handlers"""
+    if isinstance(user_id, str) and ObjectId.is_valid(user_id):
+        return {"_id": ObjectId(user_id)}
+    return {"_id": user_id}
+
+
+class UsageAggregator:
+    """
+    Accumulates usage counter increments per user and writes them to MongoDB
+    with one bulk_write per interval (or once USAGE_FLUSH_BATCH users are
+    pending), instead of one update_one per request.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, Dict[str, int]] = {}
+        # Deltas handed to a bulk_write that hasn't returned yet
+        self._inflight: Dict[str, Dict[str, int]] = {}
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def add(self, user_id: str, field: str, amount: int = 1):
+        """Buffer an increment of usage.<field> for a user"""
+        counters = self._pending.setdefault(user_id, {})
+        counters[field] = counters.get(field, 0) + amount
+        if self._flush_event and len(self._pending) >= USAGE_FLUSH_BATCH:
+            self._flush_event.set()
+
+    def pending(self, user_id: str, field: str) -> int:
+        """Increments of usage.<field> not yet visible in MongoDB"""
+        return (self._pending.get(user_id, {}).get(field, 0)
+                + self._inflight.get(user_id, {}).get(field, 0))
+
+    def apply(self, user_id: str, usage: Dict) -> Dict:
+        """Stored usage plus unflushed increments (read-your-writes view)"""
+        merged = dict(usage)
+        for field in ("questions_asked", "documents_uploaded"):
+            delta = self.pending(user_id, field)
+            if delta:
+                merged[field] = merged.get(field, 0) + delta
+        return merged
+
+    def discard(self, user_id: str):
+        """Drop buffered increments for a user whose usage was reset"""
+        self._pending.pop(user_id, None)
+        # Also keeps a failed in-flight write from re-queueing pre-reset increments
+        self._inflight.pop(user_id, None)
+
+    def _requeue(self, batch: Dict[str, Dict[str, int]]):
+        for user_id, counters in batch.items():
+            for field, amount in counters.items():
+                self.add(user_id, field, amount)
+
+    async def flush(self):
+        """Write all buffered increments with a single bulk_write"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self._inflight = batch
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                _user_filter(user_id),
+                {
+                    "$inc": {f"usage.{field}": amount for field, amount in counters.items() if amount},
+                    "$set": {"updated_at": now},
+                },
+            )
+            for user_id, counters in batch.items()
+            if any(counters.values())
+        ]
+        try:
+            if operations:
+                await get_users_collection().bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Usage counter flush failed ({len(operations)} users): {e}")
+            # Merge back so the increments go out with the next flush
+            self._requeue(batch)
+        except BaseException:
+            # Cancelled mid-write: keep the increments for whoever flushes next
+            self._requeue(batch)
+            raise
+        else:
+            # Fold the flushed increments into cached users instead of evicting them
+            for user_id, counters in batch.items():
+                cached = user_cache.get_by_id(user_id)
+                if cached is not None:
+                    usage = dict(cached.get("usage") or {})
+                    for field, amount in counters.items():
+                        usage[field] = usage.get(field, 0) + amount
+                    user_cache.update(user_id, usage=usage)
+        finally:
+            self._inflight = {}
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=USAGE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flush task (call from app startup)"""
+        if self._flush_task is None:
+            self._stopping = False
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background task and flush what is left (call from app shutdown)"""
+        if self._flush_task is not None:
+            # Let a write in progress finish rather than cancelling it halfway
+            self._stopping = True
+            self._flush_event.set()
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+
+usage_aggregator = UsageAggregator()
+
+
+@trace_function(name="mongo.initialize_user_usage")
 async def initialize_user_usage(user_id: str):
     """Initialize usage tracking for a user"""
+    usage_aggregator.discard(user_id)
     users_collection = get_users_collection()
     await users_collection.update_one(
-        {"_id": user_id},
+        _user_filter(user_id),
         {
             "$set": {
                 "usage": {
@@ -28,6 +171,7 @@ async def initialize_user_usage(user_id: str):
             }
         }
     )
+    user_cache.invalidate(user_id=user_id)
 
 
 async def get_user_usage(user: Dict) -> Dict:
@@ -40,8 +184,8 @@ async def get_user_usage(user: Dict) -> Dict:
     return usage
 
 
-async def get_user_limits(user: Dict) -> Dict:
-    """Get usage limits based on user's subscription plan"""
+def get_user_plan(user: Dict) -> str:
+    """The plan a user is currently entitled to"""
     subscription = user.get("subscription", {})
     plan = subscription.get("plan", "free")
     status_val = subscription.get("status", "inactive")
@@ -50,7 +194,12 @@ async def get_user_limits(user: Dict) -> Dict:
     if status_val != "active":
         plan = "free"
     
-    return get_subscription_limits(plan)
+    return plan
+
+
+async def get_user_limits(user: Dict) -> Dict:
+    """Get usage limits based on user's subscription plan"""
+    return get_subscription_limits(get_user_plan(user))
 
 
 async def check_question_limit(user: Dict) -> bool:
@@ -84,32 +233,18 @@ async def check_upload_limit(user: Dict) -> bool:
 
 
 async def increment_question_count(user_id: str):
-    """Increment the question count for a user"""
-    users_collection = get_users_collection()
-    await users_collection.update_one(
-        {"_id": user_id},
-        {
-            "$inc": {"usage.questions_asked": 1},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
-    )
+    """Increment the question count for a user (buffered, see UsageAggregator)"""
+    usage_aggregator.add(user_id, "questions_asked")
 
 
 async def increment_upload_count(user_id: str):
-    """Increment the document upload count for a user"""
-    users_collection = get_users_collection()
-    await users_collection.update_one(
-        {"_id": user_id},
-        {
-            "$inc": {"usage.documents_uploaded": 1},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
-    )
+    """Increment the document upload count for a user (buffered, see UsageAggregator)"""
+    usage_aggregator.add(user_id, "documents_uploaded")
 
 
 async def get_usage_stats(user: Dict) -> Dict:
     """Get usage statistics with limits for frontend display"""
-    usage = await get_user_usage(user)
+    usage = usage_aggregator.apply(str(user["_id"]), await get_user_usage(user))
     limits = await get_user_limits(user)
     
     return {
@@ -148,3 +283,125 @@ async def enforce_upload_limit(user: Dict):
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"Upload limit reached ({usage.get('documents_uploaded', 0)}/{limits.get('uploads', 0)}). Please upgrade your subscription."
         )
+
+
+async def _consume_quota(user: Dict, usage_field: str, limit_key: str, label: str) -> Dict:
+    """
+    Atomically take one unit of quota with a single conditional update.
+
+    The limit check and the increment happen in one find_one_and_update, so
+    concurrent requests can't all pass a stale check. Unlimited plans have
+    nothing to check, so their increments go through the write-behind
+    aggregator instead.
+    """
+    user_id = str(user["_id"])
+    limits = await get_user_limits(user)
+    limit = limits.get(limit_key, 0)
+    if limit == -1:
+        usage_aggregator.add(user_id, usage_field)
+        return usage_aggregator.apply(user_id, await get_user_usage(user))
+
+    # Unflushed increments (e.g. from before a plan change) count toward the limit
+    threshold = limit - usage_aggregator.pending(user_id, usage_field)
+    field = f"usage.{usage_field}"
+    query = _user_filter(user_id)
+    query["$or"] = [{field: {"$lt": threshold}}]
+    if threshold > 0:
+        query["$or"].append({field: {"$exists": False}})
+
+    users_collection = get_users_collection()
+    updated = await users_collection.find_one_and_update(
+        query,
+        {"$inc": {field: 1}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"usage": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"{label} limit reached ({limit}/{limit}). Please upgrade your subscription."
+        )
+    # Keep the cached user (the /chat hot path) current rather than evicting it
+    user_cache.update(user_id, usage=updated.get("usage", {}))
+    return updated.get("usage", {})
+
+
+async def _release_quota(user_id: str, usage_field: str):
+    """Give back one unit of quota (rollback when the request failed)"""
+    if usage_aggregator.pending(user_id, usage_field) > 0:
+        usage_aggregator.add(user_id, usage_field, -1)
+        return
+    field = f"usage.{usage_field}"
+    query = _user_filter(user_id)
+    query[field] = {"$gt": 0}
+    users_collection = get_users_collection()
+    updated = await users_collection.find_one_and_update(
+        query,
+        {"$inc": {field: -1}},
+        projection={"usage": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is not None:
+        user_cache.update(user_id, usage=updated.get("usage", {}))
+
+
+@trace_function(name="mongo.consume_question_quota")
+async def consume_question_quota(user: Dict) -> Dict:
+    """Check and increment the question count in one round trip; raises 403 at the limit"""
+    return await _consume_quota(user, "questions_asked", "questions", "Question")
+
+
+@trace_function(name="mongo.release_question_quota")
+async def release_question_quota(user_id: str):
+    """Roll back a consumed question if answering failed"""
+    await _release_quota(user_id, "questions_asked")
+
+
+@trace_function(name="mongo.consume_upload_quota")
+async def consume_upload_quota(user: Dict) -> Dict:
+    """Check and increment the upload count in one round trip; raises 403 at the limit"""
+    return await _consume_quota(user, "documents_uploaded", "uploads", "Upload")
+
+
+@trace_function(name="mongo.release_upload_quota")
+async def release_upload_quota(user_id: str):
+    """Roll back a consumed upload if processing failed"""
+    await _release_quota(user_id, "documents_uploaded")
+
+
+# ---------------------------------------------------------------------------
+# FastAPI dependencies
+# ---------------------------------------------------------------------------
+
+class QuotaLease:
+    """One consumed unit of quota; release() hands it back if the request fails"""
+
+    def __init__(self, user: Dict, usage_field: str):
+        self.user = user
+        self.usage_field = usage_field
+        self.released = False
+
+    async def release(self):
+        if not self.released:
+            self.released = True
+            await _release_quota(str(self.user["_id"]), self.usage_field)
+
+
+async def question_quota(user: Dict = Depends(require_user)) -> QuotaLease:
+    """Dependency: authenticated user with one question consumed"""
+    await consume_question_quota(user)
+    return QuotaLease(user, "questions_asked")
+
+
+async def upload_quota(user: Dict = Depends(require_user)) -> QuotaLease:
+    """Dependency: authenticated user with one upload consumed"""
+    await consume_upload_quota(user)
+    return QuotaLease(user, "documents_uploaded")
+
+
+async def optional_upload_quota(user: Optional[Dict] = Depends(optional_user)) -> Optional[QuotaLease]:
+    """Dependency: consumes an upload for logged-in users; anonymous uploads aren't tracked"""
+    if user is None:
+        return None
+    await consume_upload_quota(user)
+    return QuotaLease(user, "documents_uploaded")
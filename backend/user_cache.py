@@ -0,0 +1,104 @@
+"""
+Authenticated User Cache
+Short-TTL, size-bounded in-process cache of user documents keyed by the JWT
+subject (email), so get_current_user doesn't hit MongoDB on every request.
+Writers that change a user document invalidate the entry, or write the new
+fields back when they already have them (e.g. usage counters).
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+# Cache "user not found" for this long (0 disables negative caching)
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "5"))
+
+
+class UserCache:
+    """LRU + TTL cache of email -> user document (or None for unknown users)"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_MAX_SIZE, negative_ttl: float = USER_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._email_by_id: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str) -> Tuple[bool, Optional[Dict]]:
+        """Return (hit, user); a hit with user None is a cached negative lookup"""
+        entry = self._entries.get(email)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._drop(email)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return True, entry[1]
+
+    def put(self, email: str, user: Optional[Dict]):
+        if user is None:
+            if self.negative_ttl <= 0:
+                return
+            expires_at = time.monotonic() + self.negative_ttl
+        else:
+            if self.ttl <= 0:
+                return
+            expires_at = time.monotonic() + self.ttl
+            self._email_by_id[str(user["_id"])] = email
+        self._entries[email] = (expires_at, user)
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.max_size:
+            _, (_, old_user) = self._entries.popitem(last=False)
+            if old_user is not None:
+                self._email_by_id.pop(str(old_user["_id"]), None)
+
+    def _drop(self, email: str):
+        entry = self._entries.pop(email, None)
+        if entry and entry[1] is not None:
+            self._email_by_id.pop(str(entry[1]["_id"]), None)
+
+    def get_by_id(self, user_id: str) -> Optional[Dict]:
+        """Cached user document by id, without counting a lookup"""
+        email = self._email_by_id.get(str(user_id))
+        entry = self._entries.get(email) if email is not None else None
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def update(self, user_id: str, **fields) -> bool:
+        """Overwrite top-level fields of a cached user, keeping its expiry; False if not cached"""
+        email = self._email_by_id.get(str(user_id))
+        entry = self._entries.get(email) if email is not None else None
+        if entry is None or entry[1] is None:
+            return False
+        self._entries[email] = (entry[0], {**entry[1], **fields})
+        return True
+
+    def invalidate(self, email: Optional[str] = None, user_id: Optional[str] = None):
+        """Drop a user by email and/or id after their document changed"""
+        if user_id is not None:
+            email = self._email_by_id.pop(str(user_id), None) or email
+        if email is not None:
+            self._drop(email)
+
+    def clear(self):
+        self._entries.clear()
+        self._email_by_id.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+user_cache = UserCache()
@@ -1,3 +1,239 @@
+"""
+Per-User Conversation Memory
+Keeps a capped ring buffer of recent turns per user in memory, folds evicted
+turns into a short running summary, and writes new turns to MongoDB in the
+background (write-behind). History is bulk-loaded on a user's first request.
+"""
+
+import asyncio
+import logging
+import os
+import re
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    from .mongodb_config import get_conversations_collection, get_conversation_summaries_collection
+    from .doc_parser import estimate_tokens
+except ImportError:
+    from mongodb_config import get_conversations_collection, get_conversation_summaries_collection
+    from doc_parser import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "20"))
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "10000"))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "2.0"))
+MEMORY_FLUSH_BATCH = 500
+# History budget for a chat prompt (about a third of LegalRAGPipeline.context_window)
+MEMORY_PROMPT_TOKENS = int(os.getenv("MEMORY_PROMPT_TOKENS", "1000"))
+SUMMARY_MAX_CHARS = 1500
+SUMMARY_LINE_CHARS = 200
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+
+class _UserMemory:
+    __slots__ = ("turns", "summary", "loaded", "summary_dirty")
+
+    def __init__(self):
+        self.turns: Deque[Dict] = deque(maxlen=MEMORY_MAX_TURNS)
+        self.summary = ""
+        self.loaded = False
+        self.summary_dirty = False
+
+
+def _summarize_turn(turn: Dict) -> str:
+    """Extractive one-line summary of a turn (first sentence, truncated)"""
+    first = _SENTENCE_END_RE.split(turn["content"].strip(), maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "…"
+    return f"{turn['role']}: {first}"
+
+
+class ConversationMemory:
+    """In-process conversation memory with write-behind persistence"""
+
+    def __init__(self):
+        self._users: "OrderedDict[str, _UserMemory]" = OrderedDict()
+        self._pending_turns: List[Dict] = []
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _get(self, user_id: str) -> _UserMemory:
+        memory = self._users.get(user_id)
+        if memory is None:
+            memory = _UserMemory()
+            self._users[user_id] = memory
+            while len(self._users) > MEMORY_MAX_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return memory
+
+    async def load(self, user_id: str):
+        """Bulk-load recent turns and the summary on a user's first request"""
+        memory = self._get(user_id)
+        if memory.loaded:
+            return
+        memory.loaded = True
+        try:
+            cursor = get_conversations_collection().find(
+                {"user_id": user_id},
+                {"_id": 0, "role": 1, "content": 1, "created_at": 1},
+            ).sort("created_at", -1).limit(MEMORY_MAX_TURNS)
+            stored = await cursor.to_list(length=MEMORY_MAX_TURNS)
+            summary_doc = await get_conversation_summaries_collection().find_one({"user_id": user_id})
+        except Exception as e:
+            logger.error(f"Failed to load conversation memory for {user_id}: {e}")
+            return
+
+        # Turns appended before the load finished are newer than anything stored
+        recent = list(memory.turns)
+        memory.turns.clear()
+        memory.turns.extend(reversed(stored))
+        memory.turns.extend(recent)
+        if summary_doc and not memory.summary:
+            memory.summary = summary_doc.get("summary", "")
+
+    def append(self, user_id: str, role: str, content: str):
+        """Record a turn; the oldest turn is folded into the summary when the buffer is full"""
+        memory = self._get(user_id)
+        if len(memory.turns) == memory.turns.maxlen:
+            lines = (memory.summary.split("\n") if memory.summary else []) + [_summarize_turn(memory.turns[0])]
+            while lines and sum(len(line) + 1 for line in lines) > SUMMARY_MAX_CHARS:
+                lines.pop(0)
+            memory.summary = "\n".join(lines)
+            memory.summary_dirty = True
+
+        turn = {"role": role, "content": content, "created_at": datetime.utcnow()}
+        memory.turns.append(turn)
+        self._pending_turns.append({"user_id": user_id, **turn})
+        if self._flush_event and len(self._pending_turns) >= MEMORY_FLUSH_BATCH:
+            self._flush_event.set()
+
+    def get_history(self, user_id: str, max_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Chat history for a prompt, newest turns kept first when over budget
+
+        Args:
+            user_id: User whose history to return
+            max_tokens: Token budget for summary plus turns (None for no limit)
+
+        Returns:
+            List of {"role", "content"} messages, oldest first
+        """
+        memory = self._users.get(user_id)
+        if memory is None:
+            return []
+
+        budget = max_tokens if max_tokens is not None else float("inf")
+        messages: List[Dict[str, str]] = []
+        for turn in reversed(memory.turns):
+            cost = estimate_tokens(turn["content"])
+            if cost > budget:
+                break
+            budget -= cost
+            messages.append({"role": turn["role"], "content": turn["content"]})
+        messages.reverse()
+
+        if memory.summary:
+            summary = f"Summary of earlier conversation:\n{memory.summary}"
+            if estimate_tokens(summary) <= budget:
+                messages.insert(0, {"role": "system", "content": summary})
+        return messages
+
+    def _requeue_turns(self, turns: List[Dict]):
+        # Keep the work for the next attempt, bounded so an outage can't grow memory forever
+        self._pending_turns = (turns + self._pending_turns)[-MEMORY_FLUSH_BATCH * 20:]
+
+    def _mark_summaries_dirty(self, summaries: List):
+        for user_id, _ in summaries:
+            if user_id in self._users:
+                self._users[user_id].summary_dirty = True
+
+    async def flush(self):
+        """Write pending turns and changed summaries to MongoDB"""
+        turns, self._pending_turns = self._pending_turns, []
+        summaries = []
+        for user_id, memory in self._users.items():
+            if memory.summary_dirty:
+                memory.summary_dirty = False
+                summaries.append((user_id, memory.summary))
+
+        if turns:
+            try:
+                # insert_many sets _id on the documents it is given, so keep the queued turns untouched
+                await get_conversations_collection().insert_many([dict(turn) for turn in turns], ordered=False)
+                retry = []
+            except BulkWriteError as e:
+                # Unordered insert: only the turns listed in writeErrors were not written
+                retry = [turns[error["index"]] for error in e.details.get("writeErrors", [])]
+                logger.error(f"Conversation memory flush failed for {len(retry)} of {len(turns)} turns: {e}")
+            except Exception as e:
+                retry = turns
+                logger.error(f"Conversation memory flush failed ({len(turns)} turns): {e}")
+            except BaseException:
+                # Cancelled mid-write: keep everything for whoever flushes next
+                self._requeue_turns(turns)
+                self._mark_summaries_dirty(summaries)
+                raise
+            if retry:
+                self._requeue_turns(retry)
+
+        if summaries:
+            try:
+                await get_conversation_summaries_collection().bulk_write([
+                    UpdateOne(
+                        {"user_id": user_id},
+                        {"$set": {"summary": summary, "updated_at": datetime.utcnow()}},
+                        upsert=True,
+                    )
+                    for user_id, summary in summaries
+                ], ordered=False)
+            except Exception as e:
+                logger.error(f"Conversation summary flush failed ({len(summaries)} users): {e}")
+                self._mark_summaries_dirty(summaries)
+            except BaseException:
+                self._mark_summaries_dirty(summaries)
+                raise
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=MEMORY_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background write-behind task (call from app startup)"""
+        if self._flush_task is None:
+            self._stopping = False
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background task and flush what is left (call from app shutdown)"""
+        if self._flush_task is not None:
+            # Let a write in progress finish rather than cancelling it halfway
+            self._stopping = True
+            self._flush_event.set()
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+
+conversation_memory = ConversationMemory()
+
+
 def append_user_memory(user_id: str, memory: str):
-    """Minimal user memory store implementation"""
+    """Record a user turn in conversation memory"""
+    conversation_memory.append(user_id, "user", memory)
     return True
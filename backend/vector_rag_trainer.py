@@ -3,32 +3,49 @@ Production-Grade Vector RAG System for Indian Law FAQ Bot
 Uses sentence transformers and ChromaDB for semantic search
 """
 
+import hashlib
 import json
 import logging
 import re
+import time
 from typing import List, Dict, Tuple
 from sentence_transformers import SentenceTransformer, util
 import chromadb
 import numpy as np
 from pathlib import Path
+from embedding_cache import EmbeddingCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Batch sizes for training: encoder forward passes vs. ChromaDB writes/reads
+ENCODE_BATCH_SIZE = 64
+UPSERT_BATCH_SIZE = 5000
+
+# Re-ranking: candidates fetched for the second stage, and how far below the
+# best first-stage similarity a candidate may be before it is pruned
+RERANK_TOP_K = 10
+RERANK_PRUNE_WINDOW = 0.2
+
 class VectorRAGTrainer:
     """Production-grade RAG system with vector embeddings"""
     
-    def __init__(self, model_name="all-MiniLM-L6-v2", similarity_threshold=0.65):
+    def __init__(self, model_name="all-MiniLM-L6-v2", similarity_threshold=0.65, reranker=None, rerank_margin=0.08):
         """
         Initialize the RAG system
         
         Args:
             model_name: Sentence transformer model name (default: all-MiniLM-L6-v2 for memory efficiency)
             similarity_threshold: Minimum similarity score for accepting answers
+            reranker: Optional CrossEncoderReranker for a second ranking stage
+            rerank_margin: Skip re-ranking when the top-1 similarity leads top-2 by at least this much
         """
         logger.info(f"Initializing Vector RAG with model: {model_name}")
         self.model = SentenceTransformer(model_name)
         self.similarity_threshold = similarity_threshold
+        self.reranker = reranker
+        self.rerank_margin = rerank_margin
+        self.query_cache = EmbeddingCache()
         
         # Initialize ChromaDB with new API
         self.client = chromadb.PersistentClient(path="./chroma_db")
@@ -198,71 +215,175 @@ class VectorRAGTrainer:
         logger.info(f"Built dataset with {len(unique_dataset)} unique Q&A pairs")
         return unique_dataset
     
-    def train(self, dataset: List[Dict]):
-        """Train the RAG system by adding FAQ pairs to vector database"""
+    @staticmethod
+    def _content_id(item: Dict) -> str:
+        """Stable id derived from the Q&A content, so insertions don't shift ids"""
+        content = f"{item['question'].strip()}\x1f{item['answer'].strip()}"
+        return "faq_" + hashlib.sha1(content.encode('utf-8')).hexdigest()[:20]
+
+    def _existing_records(self) -> Dict[str, Dict]:
+        """Fetch id -> metadata for everything currently in the collection"""
+        existing = {}
+        offset = 0
+        while True:
+            page = self.collection.get(include=['metadatas'], limit=UPSERT_BATCH_SIZE, offset=offset)
+            ids = page.get('ids') or []
+            for doc_id, metadata in zip(ids, page.get('metadatas') or []):
+                existing[doc_id] = metadata or {}
+            if len(ids) < UPSERT_BATCH_SIZE:
+                return existing
+            offset += len(ids)
+
+    def train(self, dataset: List[Dict], rebuild: bool = False) -> Dict:
+        """
+        Sync the vector database with the dataset.
+
+        Records are keyed by a content hash, so re-running only encodes new
+        questions, updates changed metadata in place and deletes removed pairs.
+
+        Args:
+            dataset: List of Q&A dicts (question, answer, category)
+            rebuild: Drop the collection and re-encode everything
+
+        Returns:
+            Dict with counts of added, updated, removed and unchanged records
+        """
         logger.info(f"Training RAG system with {len(dataset)} Q&A pairs...")
-        
-        # Clear existing collection
-        try:
-            self.client.delete_collection("indian_law_faq")
+
+        if rebuild:
+            try:
+                self.client.delete_collection("indian_law_faq")
+            except Exception:
+                pass
             self.collection = self.client.get_or_create_collection(
                 name="indian_law_faq",
                 metadata={"description": "Indian Law FAQ with vector embeddings"}
             )
-        except:
-            pass
-        
-        # Batch processing for efficiency
-        batch_size = 100
-        for i in range(0, len(dataset), batch_size):
-            batch = dataset[i:i+batch_size]
-            
-            # Generate embeddings
-            questions = [item['question'] for item in batch]
-            embeddings = self.model.encode(questions, show_progress_bar=True)
-            
-            # Add to ChromaDB
-            ids = [f"faq_{i+j}" for j in range(len(batch))]
-            metadatas = [
-                {
-                    'question': item['question'],
-                    'answer': item['answer'],
-                    'category': item.get('category', 'General')
-                }
-                for item in batch
-            ]
-            
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings.tolist(),
-                metadatas=metadatas
+
+        records = {}
+        for item in dataset:
+            records[self._content_id(item)] = {
+                'question': item['question'],
+                'answer': item['answer'],
+                'category': item.get('category', 'General')
+            }
+
+        existing = self._existing_records()
+        added = [doc_id for doc_id in records if doc_id not in existing]
+        removed = [doc_id for doc_id in existing if doc_id not in records]
+        updated = [doc_id for doc_id in records if doc_id in existing and existing[doc_id] != records[doc_id]]
+
+        # An edited answer changes the id but not the question text, so reuse
+        # the stored embedding instead of encoding the question again
+        reusable = {}
+        if added and removed:
+            for i in range(0, len(removed), UPSERT_BATCH_SIZE):
+                old = self.collection.get(ids=removed[i:i+UPSERT_BATCH_SIZE], include=['embeddings', 'metadatas'])
+                for metadata, embedding in zip(old['metadatas'], old['embeddings']):
+                    reusable[metadata['question']] = list(embedding)
+
+        to_encode = list({records[doc_id]['question'] for doc_id in added} - set(reusable))
+        if to_encode:
+            logger.info(f"Encoding {len(to_encode)} new questions...")
+            embeddings = self.model.encode(
+                to_encode,
+                batch_size=ENCODE_BATCH_SIZE,
+                show_progress_bar=len(to_encode) > ENCODE_BATCH_SIZE
             )
-            
-            logger.info(f"Processed batch {i//batch_size + 1}/{(len(dataset)-1)//batch_size + 1}")
-        
-        logger.info(f"✅ Training complete! Total documents in database: {self.collection.count()}")
+            reusable.update(zip(to_encode, embeddings.tolist()))
+
+        for i in range(0, len(added), UPSERT_BATCH_SIZE):
+            batch = added[i:i+UPSERT_BATCH_SIZE]
+            self.collection.upsert(
+                ids=batch,
+                embeddings=[reusable[records[doc_id]['question']] for doc_id in batch],
+                metadatas=[records[doc_id] for doc_id in batch]
+            )
+
+        for i in range(0, len(updated), UPSERT_BATCH_SIZE):
+            batch = updated[i:i+UPSERT_BATCH_SIZE]
+            self.collection.update(ids=batch, metadatas=[records[doc_id] for doc_id in batch])
+
+        for i in range(0, len(removed), UPSERT_BATCH_SIZE):
+            self.collection.delete(ids=removed[i:i+UPSERT_BATCH_SIZE])
+
+        stats = {
+            'added': len(added),
+            'updated': len(updated),
+            'removed': len(removed),
+            'unchanged': len(records) - len(added) - len(updated),
+            'encoded': len(to_encode)
+        }
+        logger.info(f"✅ Training complete! {stats} | Total documents in database: {self.collection.count()}")
+        return stats
     
-    def get_answer(self, user_query: str, top_k: int = 3) -> Dict:
-        """
-        Get answer for user query using vector similarity search
-        
-        Args:
-            user_query: User's question
-            top_k: Number of similar questions to retrieve
-            
-        Returns:
-            Dict with answer, similarity score, and sources
-        """
-        # Generate query embedding
-        query_embedding = self.model.encode(user_query)
-        
-        # Search in vector database
-        results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=top_k
+    def _encode_query(self, user_query: str) -> np.ndarray:
+        """Encode a query through the LRU embedding cache"""
+        return self.query_cache.get_or_compute(user_query, self.model.encode)
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode many queries through the cache, batching all misses"""
+        return self.query_cache.get_or_compute_many(
+            queries,
+            lambda texts: self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE)
         )
-        
-        if not results['metadatas'] or len(results['metadatas'][0]) == 0:
+
+    def _search(self, embeddings: np.ndarray, top_k: int) -> Tuple[List[List[Dict]], List[List[float]]]:
+        """Run one multi-embedding collection query, chunked to the ChromaDB batch limit"""
+        metadatas, distances = [], []
+        for i in range(0, len(embeddings), UPSERT_BATCH_SIZE):
+            results = self.collection.query(
+                query_embeddings=embeddings[i:i+UPSERT_BATCH_SIZE].tolist(),
+                n_results=top_k,
+                include=['metadatas', 'distances']
+            )
+            metadatas.extend(results['metadatas'] or [])
+            distances.extend(results['distances'] or [])
+        return metadatas, distances
+
+    def _rerank(self, queries: List[str], metadatas: List[List[Dict]], distances: List[List[float]]):
+        """Re-order candidates in place with the cross-encoder where the first stage is not decisive"""
+        if self.reranker is None:
+            return
+        
+        pending = []
+        for qi, query_distances in enumerate(distances):
+            similarities = [1 - (d / 2) for d in query_distances]
+            if len(similarities) < 2:
+                continue
+            if similarities[0] - similarities[1] >= self.rerank_margin:
+                self.reranker.skipped += 1
+                continue
+            keep = [ci for ci, sim in enumerate(similarities) if sim >= similarities[0] - RERANK_PRUNE_WINDOW]
+            if len(keep) > 1:
+                pending.append((qi, keep))
+        if not pending:
+            return
+        
+        pairs = [
+            (queries[qi], f"{metadatas[qi][ci]['question']} {metadatas[qi][ci]['answer']}")
+            for qi, keep in pending
+            for ci in keep
+        ]
+        scores = self.reranker.score(pairs)
+        if scores is None:
+            return
+        
+        offset = 0
+        for qi, keep in pending:
+            keep_scores = scores[offset:offset + len(keep)]
+            offset += len(keep)
+            ranked = [ci for _, ci in sorted(zip(keep_scores, keep), key=lambda pair: -pair[0])]
+            order = ranked + [ci for ci in range(len(metadatas[qi])) if ci not in keep]
+            metadatas[qi] = [metadatas[qi][ci] for ci in order]
+            distances[qi] = [distances[qi][ci] for ci in order]
+
+    def _candidate_count(self, top_k: int) -> int:
+        return max(top_k, RERANK_TOP_K) if self.reranker is not None else top_k
+
+    def _build_answer(self, user_query: str, metadatas: List[Dict], distances: List[float]) -> Dict:
+        """Turn the ranked candidates for one query into an answer dict"""
+        if not metadatas:
             return {
                 'answer': "I don't have specific information about that topic. Please try asking about: bail, divorce, FIR filing, driving license, property law, employment rights, or other Indian legal topics.",
                 'similarity': 0.0,
@@ -271,14 +392,14 @@ class VectorRAGTrainer:
             }
         
         # Get best match
-        best_metadata = results['metadatas'][0][0]
-        best_distance = results['distances'][0][0]
+        best_metadata = metadatas[0]
+        best_distance = distances[0]
         
         # Convert distance to similarity (ChromaDB uses L2 distance)
         # For cosine similarity: similarity = 1 - (distance / 2)
         similarity = 1 - (best_distance / 2)
         
-        logger.info(f"Query: '{user_query}' | Best match: '{best_metadata['question']}' | Similarity: {similarity:.3f}")
+        logger.debug(f"Query: '{user_query}' | Best match: '{best_metadata['question']}' | Similarity: {similarity:.3f}")
         
         # Check threshold
         if similarity < self.similarity_threshold:
@@ -295,43 +416,120 @@ class VectorRAGTrainer:
             'sources': [best_metadata.get('category', 'Legal Database')],
             'matched_question': best_metadata['question']
         }
+
+    def get_answer(self, user_query: str, top_k: int = 3) -> Dict:
+        """
+        Get answer for user query using vector similarity search
+        
+        Args:
+            user_query: User's question
+            top_k: Number of similar questions to retrieve
+            
+        Returns:
+            Dict with answer, similarity score, and sources
+        """
+        # Generate query embedding (cached for repeated questions)
+        query_embedding = self._encode_query(user_query)
+        
+        # Search in vector database
+        metadatas, distances = self._search(query_embedding.reshape(1, -1), self._candidate_count(top_k))
+        self._rerank([user_query], metadatas, distances)
+        
+        result = self._build_answer(user_query, metadatas[0], distances[0])
+        logger.info(f"Query: '{user_query}' | Best match: '{result['matched_question']}' | Similarity: {result['similarity']:.3f}")
+        return result
+
+    def get_answers(self, queries: List[str], top_k: int = 3) -> List[Dict]:
+        """
+        Answer many queries with one batched encode and one collection query
+        
+        Args:
+            queries: User questions
+            top_k: Number of similar questions to retrieve per query
+            
+        Returns:
+            List of answer dicts in the same order as queries
+        """
+        if not queries:
+            return []
+        metadatas, distances = self._search(self._encode_queries(queries), self._candidate_count(top_k))
+        self._rerank(queries, metadatas, distances)
+        return [
+            self._build_answer(query, query_metadatas, query_distances)
+            for query, query_metadatas, query_distances in zip(queries, metadatas, distances)
+        ]
     
-    def evaluate(self, test_dataset: List[Dict]) -> Dict:
+    @staticmethod
+    def _is_match(candidate_answer: str, expected_answer: str) -> bool:
+        """Check if answer matches (exact or contains key information)"""
+        return candidate_answer == expected_answer or expected_answer[:50] in candidate_answer
+
+    def evaluate(self, test_dataset: List[Dict], top_k: int = 5) -> Dict:
         """
-        Evaluate RAG system on test dataset
+        Evaluate RAG system on test dataset using batched retrieval
         
+        Args:
+            test_dataset: List of Q&A dicts to check
+            top_k: Depth of the ranking used for MRR and recall@k
+            
         Returns:
-            Dict with accuracy metrics
+            Dict with accuracy, MRR, recall@k and throughput metrics
         """
         logger.info(f"Evaluating on {len(test_dataset)} test cases...")
         
-        correct = 0
         total = len(test_dataset)
+        queries = [item['question'] for item in test_dataset]
+        
+        start = time.perf_counter()
+        embeddings = self._encode_queries(queries) if queries else np.empty((0, 0))
+        metadatas, distances = self._search(embeddings, self._candidate_count(top_k)) if queries else ([], [])
+        self._rerank(queries, metadatas, distances)
+        metadatas = [query_metadatas[:top_k] for query_metadatas in metadatas]
+        distances = [query_distances[:top_k] for query_distances in distances]
+        elapsed = time.perf_counter() - start
+        
+        correct = 0
+        hits_at_k = 0
+        reciprocal_ranks = []
         similarities = []
         
-        for item in test_dataset:
-            result = self.get_answer(item['question'])
-            
-            # Check if answer matches (exact or contains key information)
-            if result['answer'] == item['answer'] or item['answer'][:50] in result['answer']:
+        for item, query_metadatas, query_distances in zip(test_dataset, metadatas, distances):
+            result = self._build_answer(item['question'], query_metadatas, query_distances)
+            if self._is_match(result['answer'], item['answer']):
                 correct += 1
-            
             similarities.append(result['similarity'])
+            
+            rank = next(
+                (i + 1 for i, metadata in enumerate(query_metadatas) if self._is_match(metadata['answer'], item['answer'])),
+                None
+            )
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            if rank:
+                hits_at_k += 1
         
         accuracy = correct / total if total > 0 else 0
-        avg_similarity = np.mean(similarities) if similarities else 0
+        avg_similarity = float(np.mean(similarities)) if similarities else 0
+        mrr = float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0
+        recall_at_k = hits_at_k / total if total > 0 else 0
+        throughput = total / elapsed if elapsed > 0 else 0
         
         metrics = {
             'accuracy': accuracy,
             'correct': correct,
             'total': total,
             'avg_similarity': avg_similarity,
+            'mrr': mrr,
+            f'recall@{top_k}': recall_at_k,
+            'queries_per_second': throughput,
+            'retrieval_seconds': elapsed,
             'threshold': self.similarity_threshold
         }
         
         logger.info(f"📊 Evaluation Results:")
         logger.info(f"   Accuracy: {accuracy:.2%} ({correct}/{total})")
+        logger.info(f"   MRR: {mrr:.3f} | Recall@{top_k}: {recall_at_k:.2%}")
         logger.info(f"   Average Similarity: {avg_similarity:.3f}")
+        logger.info(f"   Throughput: {throughput:.1f} queries/s ({elapsed:.2f}s)")
         logger.info(f"   Threshold: {self.similarity_threshold}")
         
         return metrics
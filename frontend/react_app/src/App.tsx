@@ -20,6 +20,7 @@ function App() {
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [uploadStatus, setUploadStatus] = useState<string>("");
   const [extractedText, setExtractedText] = useState('');
+  const [docId, setDocId] = useState('');
   const [docType, setDocType] = useState('');
   const [analysisResult, setAnalysisResult] = useState<any>(null);
   const [selectedAction, setSelectedAction] = useState('summarize');
@@ -200,17 +201,24 @@ function App() {
         headers['Authorization'] = `Bearer ${token}`;
       }
 
-      const resp = await fetch(`${config.API_BASE_URL}/legal/analyze_doc`, {
+      const analyze = (document: any) => fetch(`${config.API_BASE_URL}/legal/analyze_doc`, {
         method: 'POST',
         headers,
         body: JSON.stringify({
-          text: extractedText,
+          ...document,
           doc_type: docType,
           action: action,
           target_lang: action === 'translate' ? targetLanguage : selectedLanguage
         })
       });
 
+      // Refer to the server-side copy; only resend the text if it has expired
+      let resp = await analyze(docId ? { doc_id: docId } : { text: extractedText });
+      if (resp.status === 404 && docId) {
+        setDocId('');
+        resp = await analyze({ text: extractedText });
+      }
+
       if (resp.status === 401) {
         handleLogout();
         alert("Session expired. Please login again.");
@@ -583,6 +591,7 @@ function App() {
                       if (resp.ok) {
                         setExtractedText(data.text);
                         setDocType(data.doc_type);
+                        setDocId(data.doc_id || '');
 
                         // Step 2: Analyze immediately
                         const analyzeResp = await fetch(`${config.API_BASE_URL}/legal/analyze_doc`, {
@@ -592,7 +601,7 @@ function App() {
                             'Authorization': token ? `Bearer ${token}` : ''
                           },
                           body: JSON.stringify({
-                            text: data.text,
+                            ...(data.doc_id ? { doc_id: data.doc_id } : { text: data.text }),
                             doc_type: data.doc_type,
                             action: selectedAction,
                             target_lang: selectedAction === 'translate' ? targetLanguage : selectedLanguage
@@ -621,6 +630,14 @@ function App() {
                 <div className="doc-info-card">
                   <h3>📄 Document Detected: {docType}</h3>
                   <button className="reset-btn" onClick={() => {
+                    if (docId) {
+                      // Drop the server-side copy of the document
+                      fetch(`${config.API_BASE_URL}/legal/documents/${docId}`, {
+                        method: 'DELETE',
+                        headers: token ? { 'Authorization': `Bearer ${token}` } : {}
+                      }).catch(() => {});
+                      setDocId('');
+                    }
                     setExtractedText('');
                     setAnalysisResult(null);
                     setUploadStatus('');